@@ -1,6 +1,7 @@
 import logging
 import os
 import numpy as np
+import qt
 import vtk
 import re
 import string
@@ -59,6 +60,9 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     self.logic = None
     self._parameterNode = None
     self._updatingGUIFromParameterNode = False
+    self._lazyBrowserItem = None
+    self._scrubbing = False
+    self._scrubSliders = []
 
     slicer.mymod = self
 
@@ -96,8 +100,38 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     self.ui.lineEdit_TransSeqDir.connect('textChanged(QString)', self.updateParameterNodeFromGUI)
     self.ui.lineEdit_ScalingDir.connect('textChanged(QString)', self.updateParameterNodeFromGUI)
     self.ui.lineEdit_CTDir.connect('textChanged(QString)', self.updateParameterNodeFromGUI)
+    self.ui.lineEdit_USTimestamps.connect('textChanged(QString)', self.updateParameterNodeFromGUI)
     self.ui.lineEdit_ReslicedImgDir.connect('textChanged(QString)', self.updateParameterNodeFromGUI)
     self.ui.checkBox_flip.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_parallelDecode.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.spinBox_decodeWorkers.connect("valueChanged(int)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_parallelExport.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.spinBox_resliceWorkers.connect("valueChanged(int)", self.updateParameterNodeFromGUI)
+    self.ui.spinBox_slabNumber.connect("valueChanged(int)", self.updateParameterNodeFromGUI)
+    self.ui.comboBox_slabMode.connect("currentIndexChanged(int)", self.updateParameterNodeFromGUI)
+    self.ui.comboBox_interpolation.connect("currentIndexChanged(int)", self.updateParameterNodeFromGUI)
+    self.ui.spinBox_pngCompression.connect("valueChanged(int)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_saveSlabs.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_saveVolume.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.doubleSpinBox_volumeThickness.connect("valueChanged(double)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_compressVolume.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_grayscale.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_frameCache.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_lazyLoad.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.spinBox_lazyCacheSize.connect("valueChanged(int)", self.updateParameterNodeFromGUI)
+    self.ui.spinBox_followInterval.connect("valueChanged(int)", self.updateParameterNodeFromGUI)
+    # depth presets of the calibration file
+    self.ui.comboBox_USDepth.clear()
+    for depth in self.logic.calibrationRegistry.GetDepths():
+      self.ui.comboBox_USDepth.addItem(f"{depth:g}")
+    self.ui.comboBox_USDepth.connect("currentIndexChanged(int)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_cropROI.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.comboBox_proxyFactor.connect("currentIndexChanged(int)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_syncTimestamps.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.checkBox_filterPoses.connect("toggled(bool)", self.updateParameterNodeFromGUI)
+    self.ui.spinBox_filterWindow.connect("valueChanged(int)", self.updateParameterNodeFromGUI)
+    self.ui.doubleSpinBox_maxTranslationStep.connect("valueChanged(double)", self.updateParameterNodeFromGUI)
+    self.ui.doubleSpinBox_maxRotationStep.connect("valueChanged(double)", self.updateParameterNodeFromGUI)
     self.ui.comboBox_USSeq.connect("currentNodeChanged(vtkMRMLNode*)", self.updateParameterNodeFromGUI)
     self.ui.comboBox_TransSeq.connect("currentNodeChanged(vtkMRMLNode*)", self.updateParameterNodeFromGUI)
     self.ui.comboBox_ScalTrans.connect("currentNodeChanged(vtkMRMLNode*)", self.updateParameterNodeFromGUI)
@@ -110,6 +144,11 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     self.ui.pushButton_loadCT.connect('clicked(bool)', self.onPushButton_loadCT)
     self.ui.applyButton.connect('clicked(bool)', self.onApplyButton)
     self.ui.saveAllButton.connect('clicked(bool)', self.onSaveAllButton)
+    self.ui.checkBox_follow.connect('toggled(bool)', self.onFollowToggled)
+
+    # Live import: poll the input directories and append the new files only
+    self.followTimer = qt.QTimer()
+    self.followTimer.timeout.connect(self.onFollowTimer)
 
     # Make sure parameter node is initialized (needed for module reload)
     self.initializeParameterNode()
@@ -120,6 +159,10 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     Called when the application closes and the module widget is destroyed.
     """
     self.removeObservers()
+    self.followTimer.stop()
+    self.disconnectScrubSliders()
+    if self.logic:
+      self.logic.StopLazyLoading()
 
   def enter(self):
     """
@@ -199,8 +242,43 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     self.ui.lineEdit_TransSeqDir.setText(self._parameterNode.GetParameter("TransSeqDir"))
     self.ui.lineEdit_ScalingDir.setText(self._parameterNode.GetParameter("ScalingDir"))
     self.ui.lineEdit_CTDir.setText(self._parameterNode.GetParameter("CTDir"))
+    self.ui.lineEdit_USTimestamps.setText(self._parameterNode.GetParameter("USTimestampsFile"))
     self.ui.lineEdit_ReslicedImgDir.setText(self._parameterNode.GetParameter("ReslicedImgDir"))
     self.ui.checkBox_flip.checked = (self._parameterNode.GetParameter("Flip") == "True")
+    self.ui.checkBox_parallelDecode.checked = (self._parameterNode.GetParameter("ParallelDecode") == "True")
+    self.ui.spinBox_decodeWorkers.value = int(self._parameterNode.GetParameter("DecodeWorkers"))
+    self.ui.spinBox_decodeWorkers.enabled = self.ui.checkBox_parallelDecode.checked
+    self.ui.checkBox_parallelExport.checked = (self._parameterNode.GetParameter("ParallelExport") == "True")
+    self.ui.spinBox_resliceWorkers.value = int(self._parameterNode.GetParameter("ResliceWorkers"))
+    self.ui.spinBox_resliceWorkers.enabled = self.ui.checkBox_parallelExport.checked
+    self.ui.spinBox_slabNumber.value = int(self._parameterNode.GetParameter("SlabNumber"))
+    self.ui.comboBox_slabMode.currentIndex = int(self._parameterNode.GetParameter("SlabMode"))
+    self.ui.comboBox_interpolation.currentIndex = ResliceEngine.INTERPOLATION_MODES.index(self._parameterNode.GetParameter("Interpolation"))
+    self.ui.spinBox_pngCompression.value = int(self._parameterNode.GetParameter("PNGCompressionLevel"))
+    self.ui.checkBox_saveSlabs.checked = (self._parameterNode.GetParameter("SaveSlabs") == "True")
+    self.ui.checkBox_saveVolume.checked = (self._parameterNode.GetParameter("SaveVolume") == "True")
+    self.ui.doubleSpinBox_volumeThickness.value = float(self._parameterNode.GetParameter("VolumeThickness"))
+    self.ui.checkBox_compressVolume.checked = (self._parameterNode.GetParameter("CompressVolume") == "True")
+    self.ui.doubleSpinBox_volumeThickness.enabled = self.ui.checkBox_saveVolume.checked
+    self.ui.checkBox_compressVolume.enabled = self.ui.checkBox_saveVolume.checked
+    self.ui.checkBox_grayscale.checked = (self._parameterNode.GetParameter("CollapseGrayscale") == "True")
+    self.ui.checkBox_grayscale.enabled = self.ui.checkBox_parallelDecode.checked
+    self.ui.checkBox_frameCache.checked = (self._parameterNode.GetParameter("FrameCache") == "True")
+    self.ui.checkBox_frameCache.enabled = self.ui.checkBox_parallelDecode.checked
+    self.ui.checkBox_lazyLoad.checked = (self._parameterNode.GetParameter("LazyLoad") == "True")
+    self.ui.spinBox_lazyCacheSize.value = int(self._parameterNode.GetParameter("LazyCacheSizeMB"))
+    self.ui.spinBox_lazyCacheSize.enabled = self.ui.checkBox_lazyLoad.checked
+    self.ui.spinBox_followInterval.value = int(self._parameterNode.GetParameter("FollowIntervalMs"))
+    self.ui.comboBox_USDepth.setCurrentText(self._parameterNode.GetParameter("USDepth"))
+    self.ui.checkBox_cropROI.checked = (self._parameterNode.GetParameter("CropROI") == "True")
+    self.ui.checkBox_cropROI.enabled = self.ui.checkBox_parallelDecode.checked or self.ui.checkBox_lazyLoad.checked
+    self.ui.comboBox_proxyFactor.setCurrentText(self._parameterNode.GetParameter("ProxyFactor"))
+    self.ui.comboBox_proxyFactor.enabled = self.ui.checkBox_parallelDecode.checked and not self.ui.checkBox_lazyLoad.checked
+    self.ui.checkBox_syncTimestamps.checked = (self._parameterNode.GetParameter("SyncTimestamps") == "True")
+    self.ui.checkBox_filterPoses.checked = (self._parameterNode.GetParameter("FilterPoses") == "True")
+    self.ui.spinBox_filterWindow.value = int(self._parameterNode.GetParameter("FilterWindow"))
+    self.ui.doubleSpinBox_maxTranslationStep.value = float(self._parameterNode.GetParameter("MaxTranslationStep"))
+    self.ui.doubleSpinBox_maxRotationStep.value = float(self._parameterNode.GetParameter("MaxRotationStep"))
 
     self.ui.comboBox_USSeq.setCurrentNode(self._parameterNode.GetNodeReference("USSeq"))
     self.ui.comboBox_TransSeq.setCurrentNode(self._parameterNode.GetNodeReference("TransSeq"))
@@ -264,8 +342,34 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     self._parameterNode.SetParameter("TransSeqDir", self.ui.lineEdit_TransSeqDir.text)
     self._parameterNode.SetParameter("ScalingDir", self.ui.lineEdit_ScalingDir.text)
     self._parameterNode.SetParameter("CTDir", self.ui.lineEdit_CTDir.text)
+    self._parameterNode.SetParameter("USTimestampsFile", self.ui.lineEdit_USTimestamps.text)
     self._parameterNode.SetParameter("ReslicedImgDir", self.ui.lineEdit_ReslicedImgDir.text)
     self._parameterNode.SetParameter("Flip", "True" if self.ui.checkBox_flip.checked else "False")
+    self._parameterNode.SetParameter("ParallelDecode", "True" if self.ui.checkBox_parallelDecode.checked else "False")
+    self._parameterNode.SetParameter("DecodeWorkers", str(self.ui.spinBox_decodeWorkers.value))
+    self._parameterNode.SetParameter("ParallelExport", "True" if self.ui.checkBox_parallelExport.checked else "False")
+    self._parameterNode.SetParameter("ResliceWorkers", str(self.ui.spinBox_resliceWorkers.value))
+    self._parameterNode.SetParameter("SlabNumber", str(self.ui.spinBox_slabNumber.value))
+    self._parameterNode.SetParameter("SlabMode", str(self.ui.comboBox_slabMode.currentIndex))
+    self._parameterNode.SetParameter("Interpolation", ResliceEngine.INTERPOLATION_MODES[self.ui.comboBox_interpolation.currentIndex])
+    self._parameterNode.SetParameter("PNGCompressionLevel", str(self.ui.spinBox_pngCompression.value))
+    self._parameterNode.SetParameter("SaveSlabs", "True" if self.ui.checkBox_saveSlabs.checked else "False")
+    self._parameterNode.SetParameter("SaveVolume", "True" if self.ui.checkBox_saveVolume.checked else "False")
+    self._parameterNode.SetParameter("VolumeThickness", str(self.ui.doubleSpinBox_volumeThickness.value))
+    self._parameterNode.SetParameter("CompressVolume", "True" if self.ui.checkBox_compressVolume.checked else "False")
+    self._parameterNode.SetParameter("CollapseGrayscale", "True" if self.ui.checkBox_grayscale.checked else "False")
+    self._parameterNode.SetParameter("FrameCache", "True" if self.ui.checkBox_frameCache.checked else "False")
+    self._parameterNode.SetParameter("LazyLoad", "True" if self.ui.checkBox_lazyLoad.checked else "False")
+    self._parameterNode.SetParameter("LazyCacheSizeMB", str(self.ui.spinBox_lazyCacheSize.value))
+    self._parameterNode.SetParameter("FollowIntervalMs", str(self.ui.spinBox_followInterval.value))
+    self._parameterNode.SetParameter("USDepth", self.ui.comboBox_USDepth.currentText)
+    self._parameterNode.SetParameter("CropROI", "True" if self.ui.checkBox_cropROI.checked else "False")
+    self._parameterNode.SetParameter("ProxyFactor", self.ui.comboBox_proxyFactor.currentText)
+    self._parameterNode.SetParameter("SyncTimestamps", "True" if self.ui.checkBox_syncTimestamps.checked else "False")
+    self._parameterNode.SetParameter("FilterPoses", "True" if self.ui.checkBox_filterPoses.checked else "False")
+    self._parameterNode.SetParameter("FilterWindow", str(self.ui.spinBox_filterWindow.value))
+    self._parameterNode.SetParameter("MaxTranslationStep", str(self.ui.doubleSpinBox_maxTranslationStep.value))
+    self._parameterNode.SetParameter("MaxRotationStep", str(self.ui.doubleSpinBox_maxRotationStep.value))
 
     self._parameterNode.SetNodeReferenceID("USSeq", self.ui.comboBox_USSeq.currentNodeID)    
     self._parameterNode.SetNodeReferenceID("TransSeq", self.ui.comboBox_TransSeq.currentNodeID)
@@ -309,7 +413,7 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     USImageNode = USSequneceNode.GetNthDataNode(NthItem)
     reslicedImgName = USImageNode.GetName()
 
-    transformSequenceNode = self._parameterNode.GetNodeReference("TransSeq")
+    transformSequenceNode = self.getExportTransformSequenceNode()
     transformationNode = transformSequenceNode.GetNthDataNode(NthItem)
 
     # transformationNode = slicer.util.getNode("Transform_0050")
@@ -325,14 +429,8 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     # sliceNode.SetXYZOrigin(-64.3689, -56.2447, 0)
 
     # Set the xyz origin, which defines as the center of US image
-    T_imgPixel_imgMM_LPS = self.logic.ReadSlicerTransfrom(self._parameterNode.GetParameter("ScalingDir") + "\\T_imgPixel_imgMM.txt")
-    img_depth = 16
-    imageSpacing, mask, height = self.logic.ReadMetaInfoFromDepthSetting(img_depth)
-    
-    center_pixel = np.array([(mask[3]-mask[2]+1)*0.5, (mask[1]-mask[0]+1)*0.5, 0, 1])
-    xyzOrigin_LPS_mm = np.dot(T_imgPixel_imgMM_LPS, center_pixel)
-    # print(xyzOrigin_LPS_mm)
-    xyzOrigin_RAS_mm  = np.array([-xyzOrigin_LPS_mm[0],-xyzOrigin_LPS_mm[1], xyzOrigin_LPS_mm[2], 1] )
+    img_depth = float(self.ui.comboBox_USDepth.currentText)
+    xyzOrigin_RAS_mm = self.logic.GetSliceXYZOrigin(img_depth, os.path.join(self._parameterNode.GetParameter("ScalingDir"), "T_imgPixel_imgMM.txt"))
     # sliceNode.SetXYZOrigin(-0.67, -67.213, 0)
     sliceNode.SetXYZOrigin(xyzOrigin_RAS_mm[0], xyzOrigin_RAS_mm[1], xyzOrigin_RAS_mm[2])
     sliceNode.SetSliceResolutionMode(0)
@@ -416,8 +514,13 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     #     f.write('\n')
 
     # print(transformToWrold)
-    slabNumber = 1
-    self.logic.VolumeReslice(volume_vtk, transformToWrold, reslicedImgName, img_depth, slabNumber)
+    slabNumber = self.ui.spinBox_slabNumber.value
+    self.logic.VolumeReslice(volume_vtk, transformToWrold, reslicedImgName, img_depth, slabNumber,
+      slabMode=self.ui.comboBox_slabMode.currentIndex, saveSlabs=self.ui.checkBox_saveSlabs.checked,
+      interpolation=self._parameterNode.GetParameter("Interpolation"), compressionLevel=self.ui.spinBox_pngCompression.value,
+      saveVolume=self.ui.checkBox_saveVolume.checked, volumeThickness=self.ui.doubleSpinBox_volumeThickness.value,
+      compressVolume=self.ui.checkBox_compressVolume.checked,
+      imagePixelToMM=self.logic.GetImagePixelToMMTransform(os.path.join(self._parameterNode.GetParameter("ScalingDir"), "T_imgPixel_imgMM.txt")))
 
     print("==================================================================")
     print(filename + " saved successfully!")
@@ -460,150 +563,203 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     """
     # with slicer.util.tryWithErrorDisplay("Failed to compute results.", waitCursor=True):
     volumeNode = self._parameterNode.GetNodeReference("CT_MRI")
-    
-    # load sequence broswer node
-    sequenceBrowserNode = self._parameterNode.GetNodeReference("SequenceBroswerNode_trackedUS")
-    numItems = sequenceBrowserNode.GetNumberOfItems()
     USSequneceNode = self._parameterNode.GetNodeReference("USSeq")
-    transformSequenceNode = self._parameterNode.GetNodeReference("TransSeq")
-    layoutManager = slicer.app.layoutManager()
-    redWidget = layoutManager.sliceWidget("Red")
-    sliceNode = redWidget.mrmlSliceNode()
+    transformSequenceNode = self.getExportTransformSequenceNode()
     # Set the xyz origin, which defines as the center of US image
-    T_imgPixel_imgMM_LPS = self.logic.ReadSlicerTransfrom(self._parameterNode.GetParameter("ScalingDir") + "\\T_imgPixel_imgMM.txt")
-    img_depth = 14
-    imageSpacing, mask, height = self.logic.ReadMetaInfoFromDepthSetting(img_depth)
-    
-    center_pixel = np.array([(mask[3]-mask[2]+1)*0.5, (mask[1]-mask[0]+1)*0.5, 0, 1])
-    xyzOrigin_LPS_mm = np.dot(T_imgPixel_imgMM_LPS, center_pixel)
-    # print(xyzOrigin_LPS_mm)
-    xyzOrigin_RAS_mm  = np.array([-xyzOrigin_LPS_mm[0],-xyzOrigin_LPS_mm[1], xyzOrigin_LPS_mm[2], 1] )
-    x = range(numItems)
-    for NthItem in x:
-      print(NthItem)
-      
-      # To get the resliced image name for the original image names
-      
-      USImageNode = USSequneceNode.GetNthDataNode(NthItem)
-      reslicedImgName = USImageNode.GetName()
-
-      transformationNode = transformSequenceNode.GetNthDataNode(NthItem)
-
-
-      # sliceNode.SetDimensions(*sliceShape, 1)
-      # sliceNode.SetDimensions(674, 401, 1)
-      # sliceNode.SetFieldOfView(*sliceShape, 1)
-      # sliceNode.SetFieldOfView(550, 200, 1)
-      # sliceNode.SetXYZOrigin(-64.3689, -56.2447, 0)
-
-      sliceNode.SetXYZOrigin(xyzOrigin_RAS_mm[0], xyzOrigin_RAS_mm[1], xyzOrigin_RAS_mm[2])
-      sliceNode.SetSliceResolutionMode(0)
-
-      # enum SliceResolutionModeType
-      #    {
-      #      SliceResolutionMatchVolumes=0,
-      #      SliceResolutionMatch2DView,
-      #      SliceFOVMatch2DViewSpacingMatchVolumes,
-      #      SliceFOVMatchVolumesSpacingMatch2DView,
-      #      SliceResolutionCustom
-      #    }
-
-      imageReslice = redWidget.sliceLogic().GetBackgroundLayer().GetReslice()
-
-      # imageReslice.SetSlabModeToMean()
-      # imageReslice.SetSlabNumberOfSlices(10) # mean of 10 slices will computed
-      # imageReslice.SetSlabSliceSpacingFraction(0.3) # spacing between each slice is 0.3 pixel (total 10 * 0.3 = 3 pixel neighborhood)
-
-      transformToWrold = vtk.vtkMatrix4x4()
-      transformationNode.GetMatrixTransformToWorld(transformToWrold)
-
-      sliceNode.SetSliceToRASByNTP(transformToWrold.GetElement(0, 2), transformToWrold.GetElement(1, 2), transformToWrold.GetElement(2, 2), transformToWrold.GetElement(0, 0), transformToWrold.GetElement(1, 0), transformToWrold.GetElement(2, 0), transformToWrold.GetElement(0, 3), transformToWrold.GetElement(1, 3), transformToWrold.GetElement(2, 3), 0)
-      sliceNode.Modified()
-      slicer.app.processEvents()
-      imageReslice.Update()
-      imageData = imageReslice.GetOutput()
-
-      # imageData = imageReslice.GetOutputDataObject(0)
-      # create a new volume node
-      # reslicedVolume = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", "reslicedVolume")
-      # try: 
-      #   import vtkplotlib as vpl
-      # except:
-      #   slice.util.pip_install('vtkplotlib')
-      #   import vtkplotlib as vpl
-      # fileName = "E:\\PROGRAM\\Project_PhD\\Slicing_verification\\Database\\LING_20220715_slicing_verification_1\\Sweep_Video_02\\Reordered_files\\Reordered_images\\Image_0002.bmp"
-
-      # imageData_test = vpl.image_io.read(path=fileName, raw_bytes=None, format = '.bmp', convert_to_array=False)
-      
+    img_depth = float(self.ui.comboBox_USDepth.currentText)
+    xyzOrigin_RAS_mm = self.logic.GetSliceXYZOrigin(img_depth, os.path.join(self._parameterNode.GetParameter("ScalingDir"), "T_imgPixel_imgMM.txt"))
+    # the slices of the Red slice view are computed offscreen (with the interpolation of the combo box instead of the one
+    # of the volume display), frames flagged by the pose filter are not resliced.
+    # "Parallel" spreads the frames over the reslice workers, the saved images are the same.
+    validFrames = self.logic.GetValidFrameMask(transformSequenceNode)
+    numberOfWorkers = self.ui.spinBox_resliceWorkers.value if self.ui.checkBox_parallelExport.checked else 1
+    numberOfFrames = self.logic.SaveReslicedSequence(volumeNode, transformSequenceNode, USSequneceNode,
+      self._parameterNode.GetParameter("ReslicedImgDir"), xyzOrigin_RAS_mm, validFrames, interpolation=self._parameterNode.GetParameter("Interpolation"),
+      compressionLevel=self.ui.spinBox_pngCompression.value, numberOfWorkers=numberOfWorkers)
+    print("==================================================================")
+    print(f"{numberOfFrames} resliced frames saved successfully!")
+    print("==================================================================")
 
+  def onPushButton_USSeq(self):
+    
+    dir = self.ui.lineEdit_USSeqDir.text # converting from "\" to "\\" 
+    sequenceNode_US = self._parameterNode.GetNodeReference("USSeq")
+    sequenceBrowserNode = self._parameterNode.GetNodeReference("SequenceBroswerNode_trackedUS")
+    # stop updating the frames of a previous lazy import, and release the scrub proxy
+    self.removeObserver(sequenceBrowserNode, vtk.vtkCommand.ModifiedEvent, self.onLazyBrowserModified)
+    self.disconnectScrubSliders()
+    self.logic.StopLazyLoading()
+    cropMask = self.getUSCropMask()
+    proxyFactor = self.getUSProxyFactor()
+    proxySequenceNode = self.getUSProxySequenceNode(proxyFactor > 1)
+    if self.ui.checkBox_lazyLoad.checked:
+      # only index the directory, the displayed frame is decoded when the browser changes item
+      self.logic.ImportUSSequenceLazy(dir, sequenceNode_US, flip=self.ui.checkBox_flip.checked, cacheSizeMB=self.ui.spinBox_lazyCacheSize.value,
+        cropMask=cropMask)
+    elif self.ui.checkBox_parallelDecode.checked:
+      # decode all the images with a pool of worker threads, then fill the sequence node in index order
+      self.logic.ImportUSSequence(dir, sequenceNode_US, flip=self.ui.checkBox_flip.checked, numberOfWorkers=self.ui.spinBox_decodeWorkers.value,
+        useCache=self.ui.checkBox_frameCache.checked, collapseGrayscale=self.ui.checkBox_grayscale.checked, cropMask=cropMask,
+        proxySequenceNode=proxySequenceNode, proxyFactor=proxyFactor)
+    else:
+      self.loadUSSequenceSerial(dir, sequenceNode_US)
 
-      # # save to png file
-      table = vtk.vtkScalarsToColors()
-      dataRange = imageData.GetScalarRange()
-      table.SetRange(dataRange[0], dataRange[1]) # set the range of your data values
-      
-      convert = vtk.vtkImageMapToColors()
-      convert.SetLookupTable(table)
-      convert.SetOutputFormatToRGB()
-      convert.SetInputData(imageData)
-      convert.Update()
-
-      writer = vtk.vtkPNGWriter()
-      writer.SetInputData(convert.GetOutput())
-
-      directory = self._parameterNode.GetParameter("ReslicedImgDir")
-      filename ="Resliced" + reslicedImgName + ".png"
-      path = directory +"\\" + filename
-      writer.SetFileName(path)
-      writer.Write()
-
-      fieldOfView = sliceNode.GetFieldOfView()
-      Dimensions = sliceNode.GetDimensions()
-      metaFilename = "Meta" + reslicedImgName + ".txt"
-      metaFilePath = directory +"\\" +metaFilename
-      lines = ['FOV:  ' + str(fieldOfView[0]) + '  ' + str(fieldOfView[1]) + '  ' +str(fieldOfView[2]),  'Dims:  ' + str(Dimensions[0]) + '  ' + str(Dimensions[1]) + '  ' +str(Dimensions[2])]
-      with open(metaFilePath, 'w') as f:
-        for line in lines:
-          f.write(line)
-          f.write('\n')
+    # Create a sequence browser node for the new merged sequence
+    # sequenceBrowserNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode", "Sequence_tracked_US")
+    sequenceBrowserNode.AddSynchronizedSequenceNode(sequenceNode_US)
+    slicer.modules.sequences.toolBar().setActiveBrowserNode(sequenceBrowserNode)
 
-      
-      print("==================================================================")
-      print(filename + " saved successfully!")
-      print("==================================================================") 
-      #
-      # Save this image by using the Slicer slice view
-      #
-      # sliceNode1 = slicer.mrmlScene.GetNodeByID("vtkMRMLSliceNodeRed")
-      # appLogic = slicer.app.applicationLogic()
-      # sliceLogic = appLogic.GetSliceLogic(sliceNode1)
-      # sliceLayerLogic = sliceLogic.GetBackgroundLayer()
-      # reslice = sliceLayerLogic.GetReslice()
-      # reslice.SetSlabModeToMean()
-      # reslice.SetSlabNumberOfSlices(10) # mean of 10 slices will computed
-      # reslice.SetSlabSliceSpacingFraction(0.3) # spacing between each slice is 0.3 pixel (total 10 * 0.3 = 3 pixel neighborhood)
-      # sliceNode1.Modified()
-      # imageData1 = reslice.GetOutput()
-
-      # table = vtk.vtkScalarsToColors()
-      # range = imageData1.GetScalarRange()
-      # table.SetRange(range[0], range[1]) # set the range of your data values
-      
-      # convert1 = vtk.vtkImageMapToColors()
-      # convert1.SetLookupTable(table)
-      # convert1.SetOutputFormatToRGB()
-      # convert1.SetInputData(imageData1)
-      # convert1.Update()
+    # Show proxy noe in slice vidwers
+    proxyNode = sequenceBrowserNode.GetProxyNode(sequenceNode_US)
+    if self.ui.checkBox_lazyLoad.checked:
+      # the sequence items are placeholders, the decoded frame is shown in a separate volume node
+      self._lazyBrowserItem = None
+      self.addObserver(sequenceBrowserNode, vtk.vtkCommand.ModifiedEvent, self.onLazyBrowserModified)
+      self.onLazyBrowserModified(sequenceBrowserNode)
+      proxyNode = self.logic.lazyFrameNode
+    elif self.ui.checkBox_parallelDecode.checked and proxySequenceNode:
+      # the downsampled proxy sequence shares the item indexing of the US sequence
+      sequenceBrowserNode.AddSynchronizedSequenceNode(proxySequenceNode)
+      self._scrubbing = False
+      self.connectScrubSliders()
+    slicer.util.setSliceViewerLayers(background=proxyNode)
+    print("==================================================================")
+    print('Genearting sequence node (US image) successfully!')
+    print("==================================================================")
+    # self.ui.textEdit_US.setPlainText("Push button US clicked and set the text in this QTextEdit_US")
 
-      # writer1 = vtk.vtkPNGWriter()
-      # writer1.SetInputData(convert1.GetOutput())
-      # writer1.SetFileName("ImageData2Png1.png")
-      # writer1.Write()
+  def getFilteredTransformSequenceNode(self, create=False):
+    # the sequence of the smoothed poses is created on demand next to the transform sequence node
+    filteredSequenceNode = self._parameterNode.GetNodeReference("TransSeqFiltered")
+    if not filteredSequenceNode and create:
+      sequenceNode_Trans = self._parameterNode.GetNodeReference("TransSeq")
+      filteredSequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", sequenceNode_Trans.GetName() + "_filtered")
+      self._parameterNode.SetNodeReferenceID("TransSeqFiltered", filteredSequenceNode.GetID())
+    return filteredSequenceNode
+
+  def getExportTransformSequenceNode(self):
+    # the smoothed poses if "Filter poses" is checked and they were computed from the current transform sequence, the raw ones otherwise
+    sequenceNode_Trans = self._parameterNode.GetNodeReference("TransSeq")
+    filteredSequenceNode = self.getFilteredTransformSequenceNode()
+    if (self.ui.checkBox_filterPoses.checked and filteredSequenceNode
+        and filteredSequenceNode.GetNumberOfDataNodes() == sequenceNode_Trans.GetNumberOfDataNodes()):
+      return filteredSequenceNode
+    return sequenceNode_Trans
+
+  def getUSCropMask(self):
+    # fan ROI [top, bottom, left, right] of the selected depth if "Crop to ROI" is checked, otherwise None
+    if not self.ui.checkBox_cropROI.checked:
+      return None
+    imageSpacing, mask, height = self.logic.ReadMetaInfoFromDepthSetting(float(self.ui.comboBox_USDepth.currentText))
+    return mask
+
+  def getUSProxyFactor(self):
+    # downsampling factor of the scrub proxy sequence (1: no proxy)
+    if not self.ui.checkBox_parallelDecode.checked or self.ui.checkBox_lazyLoad.checked:
+      return 1
+    return {"2x": 2, "4x": 4}.get(self.ui.comboBox_proxyFactor.currentText, 1)
+
+  def getUSProxySequenceNode(self, enabled):
+    # the proxy sequence node is created on demand next to the US sequence node, and detached from the browser when disabled
+    proxySequenceNode = self._parameterNode.GetNodeReference("USSeqProxy")
+    sequenceBrowserNode = self._parameterNode.GetNodeReference("SequenceBroswerNode_trackedUS")
+    if not enabled:
+      if proxySequenceNode and sequenceBrowserNode.IsSynchronizedSequenceNode(proxySequenceNode, True):
+        sequenceBrowserNode.RemoveSynchronizedSequenceNode(proxySequenceNode.GetID())
+      return None
+    if not proxySequenceNode:
+      sequenceNode_US = self._parameterNode.GetNodeReference("USSeq")
+      proxySequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", sequenceNode_US.GetName() + "_Proxy")
+      self._parameterNode.SetNodeReferenceID("USSeqProxy", proxySequenceNode.GetID())
+    return proxySequenceNode
+
+  def connectScrubSliders(self):
+    # the item sliders of the sequence browser seek widgets (toolbar, Sequences module)
+    self.disconnectScrubSliders()
+    for seekWidget in slicer.util.findChildren(className="qMRMLSequenceBrowserSeekWidget"):
+      for slider in slicer.util.findChildren(seekWidget, name="slider_IndexValue"):
+        slider.connect('sliderPressed()', self.onScrubSliderPressed)
+        slider.connect('sliderReleased()', self.onScrubSliderReleased)
+        self._scrubSliders.append(slider)
+
+  def disconnectScrubSliders(self):
+    for slider in self._scrubSliders:
+      slider.disconnect('sliderPressed()', self.onScrubSliderPressed)
+      slider.disconnect('sliderReleased()', self.onScrubSliderReleased)
+    self._scrubSliders = []
+    self.onScrubSliderReleased()
+
+  def onScrubSliderPressed(self):
+    # While the item slider is dragged, show the downsampled proxy and stop updating the full-resolution proxy node
+    sequenceBrowserNode = self._parameterNode.GetNodeReference("SequenceBroswerNode_trackedUS")
+    proxySequenceNode = self._parameterNode.GetNodeReference("USSeqProxy")
+    if self._scrubbing or not proxySequenceNode or not sequenceBrowserNode.IsSynchronizedSequenceNode(proxySequenceNode, True):
+      return
+    self._scrubbing = True
+    sequenceBrowserNode.SetPlayback(self._parameterNode.GetNodeReference("USSeq"), False)
+    slicer.util.setSliceViewerLayers(background=sequenceBrowserNode.GetProxyNode(proxySequenceNode))
 
-  def onPushButton_USSeq(self):
-    
-    dir = self.ui.lineEdit_USSeqDir.text # converting from "\" to "\\" 
+  def onScrubSliderReleased(self):
+    # Swap the full-resolution frame of the selected item back in when the slider is released
+    if not self._scrubbing:
+      return
+    self._scrubbing = False
+    sequenceBrowserNode = self._parameterNode.GetNodeReference("SequenceBroswerNode_trackedUS")
     sequenceNode_US = self._parameterNode.GetNodeReference("USSeq")
+    sequenceBrowserNode.SetPlayback(sequenceNode_US, True)
+    slicer.modules.sequences.logic().UpdateProxyNodesFromSequences(sequenceBrowserNode)
+    slicer.util.setSliceViewerLayers(background=sequenceBrowserNode.GetProxyNode(sequenceNode_US))
+
+  def onFollowToggled(self, checked):
+    if checked:
+      self.logic.ResetFollowManifests()
+      self.followTimer.start(self.ui.spinBox_followInterval.value)
+    else:
+      self.followTimer.stop()
+
+  def onFollowTimer(self):
+    # Append the frames and transforms written since the previous poll
+    self.followTimer.interval = self.ui.spinBox_followInterval.value
+    sequenceBrowserNode = self._parameterNode.GetNodeReference("SequenceBroswerNode_trackedUS")
+    wasAtLastItem = sequenceBrowserNode.GetSelectedItemNumber() >= sequenceBrowserNode.GetNumberOfItems() - 1
+    numberOfNewItems = 0
+    try:
+      sequenceNode_US = self._parameterNode.GetNodeReference("USSeq")
+      if sequenceNode_US and os.path.isdir(self.ui.lineEdit_USSeqDir.text):
+        numberOfNewItems += self.logic.FollowUSSequence(self.ui.lineEdit_USSeqDir.text, sequenceNode_US,
+          flip=self.ui.checkBox_flip.checked, numberOfWorkers=self.ui.spinBox_decodeWorkers.value,
+          # the layout of the frames already in the sequence wins over the checkbox (see FollowUSSequence)
+          collapseGrayscale=self.ui.checkBox_grayscale.checked, cropMask=self.getUSCropMask(),
+          proxySequenceNode=self.getUSProxySequenceNode(self.getUSProxyFactor() > 1), proxyFactor=self.getUSProxyFactor())
+        if not sequenceBrowserNode.IsSynchronizedSequenceNode(sequenceNode_US, True) and sequenceNode_US.GetNumberOfDataNodes() > 0:
+          sequenceBrowserNode.AddSynchronizedSequenceNode(sequenceNode_US)
+      sequenceNode_Trans = self._parameterNode.GetNodeReference("TransSeq")
+      if sequenceNode_Trans and os.path.isdir(self.ui.lineEdit_TransSeqDir.text):
+        numberOfNewItems += self.logic.FollowTransformSequence(self.ui.lineEdit_TransSeqDir.text, sequenceNode_Trans)
+        if not sequenceBrowserNode.IsSynchronizedSequenceNode(sequenceNode_Trans, True) and sequenceNode_Trans.GetNumberOfDataNodes() > 0:
+          sequenceBrowserNode.AddSynchronizedSequenceNode(sequenceNode_Trans)
+    except Exception as e:
+      # a file may still be written by the acquisition software, it will be picked up again at the next poll
+      logging.warning('Live import failed: ' + str(e))
+      return
+    if numberOfNewItems > 0 and wasAtLastItem:
+      # keep showing the latest frame while acquiring
+      sequenceBrowserNode.SetSelectedItemNumber(sequenceBrowserNode.GetNumberOfItems() - 1)
+
+  def onLazyBrowserModified(self, caller, event=None):
+    # Decode the selected frame on demand and prefetch a few frames ahead in the browsing direction
+    NthItem = caller.GetSelectedItemNumber()
+    numItems = caller.GetNumberOfItems()
+    if NthItem < 0 or NthItem == self._lazyBrowserItem:
+      return
+    direction = 1
+    if self._lazyBrowserItem is not None and (NthItem - self._lazyBrowserItem) % numItems > numItems // 2:
+      direction = -1
+    self._lazyBrowserItem = NthItem
+    self.logic.UpdateLazyFrame(NthItem, direction)
+
+  def loadUSSequenceSerial(self, dir, sequenceNode_US):
+    # Load the US images one by one with slicer.util.loadVolume (original import path)
     Nth = 1
     TotalN = len(os.listdir(dir))
     filenames = os.listdir(dir)
@@ -612,22 +768,9 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     loadedVolumeNode = slicer.util.loadVolume(absolute_filename, {"singleFile": True})
     
     if self.ui.checkBox_flip.checked == True: # the US image has been flipped
-      transformNode_flip = slicer.vtkMRMLTransformNode()
-      slicer.mrmlScene.AddNode(transformNode_flip)
-      transform_matrix_flip = vtk.vtkMatrix4x4()
-      transform_matrix_flip.SetElement(0, 0, -1)
       imageDimensions = loadedVolumeNode.GetImageData().GetDimensions()
       imageSpacings = loadedVolumeNode.GetImageData().GetSpacing()
-      transform_matrix_translate = vtk.vtkMatrix4x4()
-      transform_matrix_translate.SetElement(0, 3, imageDimensions[0]*0.5*imageSpacings[0])
-
-      transform_matrix_translate_inverted = vtk.vtkMatrix4x4()
-      transform_matrix_translate_inverted.SetElement(0, 3, -imageDimensions[0]*0.5*imageSpacings[0])
-
-      transform_matrix_concatenated = vtk.vtkMatrix4x4()
-      vtk.vtkMatrix4x4.Multiply4x4(transform_matrix_flip, transform_matrix_translate, transform_matrix_concatenated)
-      vtk.vtkMatrix4x4.Multiply4x4(transform_matrix_translate_inverted, transform_matrix_concatenated, transform_matrix_concatenated)
-      transformNode_flip.SetMatrixTransformToParent(transform_matrix_concatenated)
+      transform_matrix_concatenated = self.logic.GetFlipMatrix(imageDimensions[0], imageSpacings[0])
 
       slicer.mrmlScene.RemoveNode(slicer.util.getNode(loadedVolumeNode.GetID()))
       for filename in filenames: # making sure the file postfix  is  "image format"
@@ -638,15 +781,14 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
         # loadedVolumeNode.GetDisplayNode().SetAndObserveColorNodeID("vtkMRMLColorTableNodeRed")
         # Whehter flipping the US images
         
-        loadedVolumeNode.SetAndObserveTransformNodeID(transformNode_flip.GetID())
-        loadedVolumeNode.HardenTransform()
+        # same result as hardening the flip transform, without a transform node round-trip
+        loadedVolumeNode.ApplyTransformMatrix(transform_matrix_concatenated)
         
         filename_ = filename.split('.')
         itemIndex_ = filename_[0].split('_')
         itemIndex = itemIndex_[1]
         sequenceNode_US.SetDataNodeAtValue(loadedVolumeNode, itemIndex)
         slicer.mrmlScene.RemoveNode(slicer.util.getNode(loadedVolumeNode.GetID()))
-      slicer.mrmlScene.RemoveNode(slicer.util.getNode(transformNode_flip.GetID()))
     else:
       slicer.mrmlScene.RemoveNode(slicer.util.getNode(loadedVolumeNode.GetID()))
       for filename in filenames: # making sure the file postfix  is  "image format"
@@ -665,46 +807,33 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
         # print("Loading sequence data......{0}%".format(Nth/TotalN*100))
         # Nth = Nth + 1
         # time.sleep(0.05)
-    
-    
-    # Create a sequence browser node for the new merged sequence
-    # sequenceBrowserNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode", "Sequence_tracked_US")
-    sequenceBrowserNode = self._parameterNode.GetNodeReference("SequenceBroswerNode_trackedUS")
-    sequenceBrowserNode.AddSynchronizedSequenceNode(sequenceNode_US)
-    slicer.modules.sequences.toolBar().setActiveBrowserNode(sequenceBrowserNode)
 
-    # Show proxy noe in slice vidwers
-    proxyNode = sequenceBrowserNode.GetProxyNode(sequenceNode_US)
-    slicer.util.setSliceViewerLayers(background=proxyNode)
-    print("==================================================================")
-    print('Genearting sequence node (US image) successfully!')
-    print("==================================================================")
-    # self.ui.textEdit_US.setPlainText("Push button US clicked and set the text in this QTextEdit_US")
   def onPushButton_TransSeq(self):
     
     dir = self.ui.lineEdit_TransSeqDir.text # converting from "\" to "\\" 
     sequenceNode_Trans = self._parameterNode.GetNodeReference("TransSeq")
-    # Nth = 1
-    # TotalN = len(os.listdir(dir))
-    for filename in os.listdir(dir): # making sure the file postfix  is  "image format"
-      absolute_filename_ = os.path.join(dir, filename)
-      absolute_filename = absolute_filename_.replace("\\", "\\\\") # in the raw version, "\\" will be printed as "\", therefore we replaced "\\" with "\\\\"
-      # print(absolute_filename)
-      loadedTransformNode = slicer.util.loadTransform(absolute_filename)
-      filename_ = filename.split('.')
-      itemIndex_ = filename_[0].split('_')
-
-      itemIndex = itemIndex_[len(itemIndex_)-1] #Need to change
-      sequenceNode_Trans.SetDataNodeAtValue(loadedTransformNode, itemIndex)
-      slicer.mrmlScene.RemoveNode(slicer.util.getNode(loadedTransformNode.GetID()))
-      # print("Loading sequence data......{0}%".format(Nth/TotalN*100))
-      # Nth = Nth + 1
-      # time.sleep(0.05)
+    if self.ui.checkBox_syncTimestamps.checked:
+      # one pose per US frame, interpolated at the image timestamps and keyed like the US sequence
+      self.logic.ImportSynchronizedTransformStream(dir, self.ui.lineEdit_USTimestamps.text, sequenceNode_Trans)
+    elif os.path.isfile(dir):
+      # all the poses of the sweep are in one file (csv, npz or sequence metafile)
+      self.logic.ImportTransformStream(dir, sequenceNode_Trans)
+    else:
+      # ITK affine transform files are parsed in one pass, other formats are loaded with slicer.util.loadTransform
+      self.logic.ImportTransformSequence(dir, sequenceNode_Trans)
+    filteredSequenceNode_Trans = None
+    if self.ui.checkBox_filterPoses.checked:
+      # the smoothed poses go to a separate sequence (the raw tracking is kept), the flagged frames are skipped by "Save All"
+      filteredSequenceNode_Trans = self.getFilteredTransformSequenceNode(True)
+      self.logic.FilterTransformSequence(sequenceNode_Trans, filteredSequenceNode_Trans, smoothingWindow=self.ui.spinBox_filterWindow.value,
+        maxTranslationStep=self.ui.doubleSpinBox_maxTranslationStep.value, maxRotationStep=self.ui.doubleSpinBox_maxRotationStep.value)
     # Create a sequence browser node for the new merged sequence
     # sequenceBrowserNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode", "Sequence_tracked_US")
     
     sequenceBrowserNode = self._parameterNode.GetNodeReference("SequenceBroswerNode_trackedUS")
     sequenceBrowserNode.AddSynchronizedSequenceNode(sequenceNode_Trans)
+    if filteredSequenceNode_Trans:
+      sequenceBrowserNode.AddSynchronizedSequenceNode(filteredSequenceNode_Trans)
     slicer.modules.sequences.toolBar().setActiveBrowserNode(sequenceBrowserNode)
 
     # Show proxy noe in slice vidwers
@@ -757,6 +886,586 @@ class ReadSequentialDataWidget(ScriptedLoadableModuleWidget, VTKObservationMixin
     print('Loading CT/MRI volume node successfully!')
     print("==================================================================") 
 #
+# LazyFrameLoader
+#
+
+class LazyFrameLoader(object):
+  """Decode the frames of a US sweep on demand.
+  The most recently used frames are kept in an LRU cache bounded by a memory budget (in bytes),
+  and frames can be prefetched by a small pool of background threads.
+  """
+
+  def __init__(self, paths, readFrame, cacheSizeBytes, numberOfPrefetchWorkers=2):
+    import collections
+    import concurrent.futures
+    import threading
+    self.paths = paths
+    self.readFrame = readFrame # path -> numpy array
+    self.cacheSizeBytes = cacheSizeBytes
+    self._cache = collections.OrderedDict()
+    self._cachedBytes = 0
+    self._pending = {}
+    self._lock = threading.Lock()
+    self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=numberOfPrefetchWorkers)
+
+  def GetNumberOfFrames(self):
+    return len(self.paths)
+
+  def AppendPaths(self, paths):
+    # frames written after the sweep was indexed (follow mode), numbered after the existing ones
+    with self._lock:
+      self.paths = self.paths + list(paths)
+
+  def GetFrame(self, frameNumber):
+    with self._lock:
+      frame = self._cache.get(frameNumber)
+      if frame is not None:
+        self._cache.move_to_end(frameNumber)
+        return frame
+      future = self._pending.get(frameNumber)
+    if future is not None:
+      return future.result()
+    return self._decode(frameNumber)
+
+  def Prefetch(self, frameNumbers):
+    with self._lock:
+      for frameNumber in frameNumbers:
+        if frameNumber < 0 or frameNumber >= len(self.paths):
+          continue
+        if frameNumber in self._cache or frameNumber in self._pending:
+          continue
+        self._pending[frameNumber] = self._executor.submit(self._decode, frameNumber)
+
+  def Shutdown(self):
+    self._executor.shutdown(wait=False)
+    with self._lock:
+      self._cache.clear()
+      self._cachedBytes = 0
+
+  def _decode(self, frameNumber):
+    frame = self.readFrame(self.paths[frameNumber])
+    with self._lock:
+      self._pending.pop(frameNumber, None)
+      if frameNumber not in self._cache:
+        self._cache[frameNumber] = frame
+        self._cachedBytes += frame.nbytes
+        # evict the least recently used frames, but always keep the one that was just decoded
+        while self._cachedBytes > self.cacheSizeBytes and len(self._cache) > 1:
+          _, evictedFrame = self._cache.popitem(last=False)
+          self._cachedBytes -= evictedFrame.nbytes
+    return frame
+
+class DepthCalibrationRegistry(object):
+  """Depth calibrations of the US probes, loaded from a JSON calibration file.
+  Every entry gives the pixel spacing and the fan ROI of one (probe, depth) preset; the derived geometry
+  (mask, image height, center pixel) is computed once when the file is loaded and looked up in O(1).
+  Depths are matched at 0.1 cm resolution, so 8.1 read from a text field finds the 8.1 preset.
+  """
+
+  DEFAULT_CALIBRATION_FILE = os.path.join(os.path.dirname(__file__), 'Resources', 'Calibration', 'DepthCalibration.json')
+
+  def __init__(self, calibrationFile=None):
+    import json
+    self.calibrationFile = calibrationFile or self.DEFAULT_CALIBRATION_FILE
+    with open(self.calibrationFile, "r") as f:
+      content = json.load(f)
+    self.defaultProbe = content.get("defaultProbe", "default")
+    self._calibrations = {}
+    for entry in content["calibrations"]:
+      probe = entry.get("probe", self.defaultProbe)
+      self._calibrations[(probe, self.DepthKey(entry["depth"]))] = self._DeriveGeometry(entry)
+
+  @staticmethod
+  def DepthKey(depth):
+    return int(round(float(depth) * 10))
+
+  @staticmethod
+  def _DeriveGeometry(entry):
+    imageSpacing = np.array(entry["spacing"], dtype='f')
+    ROITop, ROILeft = entry["roiTop"], entry["roiLeft"]
+    mask = np.array([ROITop, ROITop + entry["roiHeight"], ROILeft, ROILeft + entry["roiWidth"]])
+    centerPixel = np.array([(mask[3]-mask[2]+1)*0.5, (mask[1]-mask[0]+1)*0.5, 0, 1])
+    for array in (imageSpacing, mask, centerPixel):
+      array.flags.writeable = False # shared by all the callers
+    return {"depth": float(entry["depth"]), "imageSpacing": imageSpacing, "mask": mask, "imageHeight": entry["roiHeight"], "centerPixel": centerPixel}
+
+  def GetCalibration(self, depth, probe=None):
+    # dict with depth, imageSpacing, mask [top, bottom, left, right], imageHeight and centerPixel; None for an unknown preset
+    return self._calibrations.get((probe or self.defaultProbe, self.DepthKey(depth)))
+
+  def GetDepths(self, probe=None):
+    probe = probe or self.defaultProbe
+    return sorted((calibration["depth"] for (calibrationProbe, _), calibration in self._calibrations.items() if calibrationProbe == probe), reverse=True)
+
+class ResliceEngine(object):
+  """Oblique reslicing of one volume with a persistent VTK pipeline.
+  vtkImageReslice, the color mapping, the flip and the writers are created once; reslicing a frame or a slab
+  only replaces the elements of the reslice axes matrix, so the per-slice cost is the interpolation.
+  The reslice axes of a slab are computed directly from the slicing matrix (they do not depend on the
+  previously resliced slabs): axes = M_LPS(shifted along its Z axis) * T(-volume center).
+  The axes of a whole sweep can be computed at once with ComputeResliceAxesArray and passed to the *FromAxes methods.
+  With SetImageGrid, the slabs are resliced on the pixels of the US image ROI only (see ReadSequentialDataLogic.GetUSImageGrid).
+  """
+
+  # from the fastest to the most accurate; "sinc" is a Lanczos windowed sinc (vtkImageSincInterpolator)
+  INTERPOLATION_MODES = ("nearest", "linear", "cubic", "sinc")
+
+  def __init__(self, volume, numberOfThreads=None, interpolation="cubic"):
+    self.volume = volume
+    self.numberOfThreads = numberOfThreads
+    self.interpolation = None
+    self.volumeMTime = volume.GetMTime()
+    inOrigin = volume.GetOrigin()
+    inExtent = volume.GetExtent()
+    self.inSpacing = volume.GetSpacing()
+    self.inCenter = [inOrigin[0] + self.inSpacing[0]*(inExtent[1] - inExtent[0] +1) *0.5,
+                     inOrigin[1] + self.inSpacing[1]*(inExtent[3] - inExtent[2] +1) *0.5,
+                     inOrigin[2] + self.inSpacing[2]*(inExtent[5] - inExtent[4] +1) *0.5]
+
+    # 2D slabs: reslice -> color mapping -> flip -> png
+    self.slabAxes = vtk.vtkMatrix4x4()
+    self.slabReslicer = self._CreateReslicer(self.slabAxes, 2)
+    self.table = vtk.vtkScalarsToColors()
+    self.convert = vtk.vtkImageMapToColors()
+    self.convert.SetLookupTable(self.table)
+    self.convert.SetOutputFormatToRGB()
+    self.convert.SetInputConnection(self.slabReslicer.GetOutputPort())
+    self.flip = vtk.vtkImageFlip()
+    self.flip.SetInputConnection(self.convert.GetOutputPort())
+    self.flip.SetFilteredAxis(1)
+    self.pngWriter = vtk.vtkPNGWriter()
+    self.pngWriter.SetInputConnection(self.flip.GetOutputPort())
+
+    # 3D resliced volume -> mha
+    self.volumeAxes = vtk.vtkMatrix4x4()
+    self.volumeReslicer = self._CreateReslicer(self.volumeAxes, 3)
+    self.mhaWriter = vtk.vtkMetaImageWriter()
+    self.mhaWriter.SetInputConnection(self.volumeReslicer.GetOutputPort())
+    self.arrayWriter = None
+    self.imageGrid = None
+    self.imageGridMatrix = None
+    self.SetInterpolation(interpolation)
+
+  def _CreateReslicer(self, axes, dimensionality):
+    reslicer = vtk.vtkImageReslice()
+    reslicer.SetInputData(self.volume)
+    reslicer.SetResliceAxes(axes)
+    reslicer.SetOutputScalarType(-1) # same as the input
+    reslicer.SetOutputDimensionality(dimensionality)
+    if self.numberOfThreads:
+      reslicer.SetNumberOfThreads(self.numberOfThreads)
+    return reslicer
+
+  def IsValidFor(self, volume):
+    return volume is self.volume and volume.GetMTime() == self.volumeMTime
+
+  def SetInterpolation(self, interpolation):
+    # interpolation of the slabs and of the resliced volume, one of INTERPOLATION_MODES
+    if interpolation not in self.INTERPOLATION_MODES:
+      raise ValueError(f"Unknown interpolation {interpolation}")
+    if interpolation == self.interpolation:
+      return
+    self.interpolation = interpolation
+    for reslicer in (self.slabReslicer, self.volumeReslicer):
+      if interpolation == "sinc":
+        interpolator = vtk.vtkImageSincInterpolator()
+        interpolator.SetWindowFunctionToLanczos()
+        reslicer.SetInterpolator(interpolator)
+      else:
+        # the default interpolator of vtkImageReslice, with its interpolation mode
+        reslicer.SetInterpolator(None)
+        if interpolation == "nearest":
+          reslicer.SetInterpolationModeToNearestNeighbor()
+        elif interpolation == "linear":
+          reslicer.SetInterpolationModeToLinear()
+        else:
+          reslicer.SetInterpolationModeToCubic()
+
+  def SetImageGrid(self, imageGrid):
+    ### INPUTS
+    # imageGrid: dict with imagePixelToMM (numpy 4x4, T_imgPixel_imgMM LPS), width and height of the US image ROI (pixels),
+    #            see ReadSequentialDataLogic.GetUSImageGrid; None: default output geometry of vtkImageReslice (whole volume cross-section)
+    # The output pixel (i, j) of a slab is then the ROI pixel (i, j): the output origin is 0, the output spacing is the pixel size
+    # (column norms of T_imgPixel_imgMM) and the directions and the offset of T_imgPixel_imgMM are moved into the reslice axes.
+    self.imageGrid = imageGrid
+    if imageGrid is None:
+      self.imageGridMatrix = None
+      self.slabReslicer.SetOutputSpacingToDefault()
+      self.slabReslicer.SetOutputOriginToDefault()
+      self.slabReslicer.SetOutputExtentToDefault()
+      return
+    imagePixelToMM = np.asarray(imageGrid["imagePixelToMM"], dtype=np.float64)
+    spacing = np.linalg.norm(imagePixelToMM[:3, :3], axis=0)
+    self.imageGridMatrix = np.eye(4)
+    self.imageGridMatrix[:3, :3] = imagePixelToMM[:3, :3] / spacing
+    # output coordinates of the reslice = image frame in mm shifted by the volume center (see ComputeResliceAxesArray)
+    self.imageGridMatrix[:3, 3] = imagePixelToMM[:3, 3] + self.inCenter
+    self.slabReslicer.SetOutputSpacing(spacing[0], spacing[1], spacing[2])
+    self.slabReslicer.SetOutputOrigin(0, 0, 0)
+    self.slabReslicer.SetOutputExtent(0, int(imageGrid["width"]) - 1, 0, int(imageGrid["height"]) - 1, 0, 0)
+
+  def GetResliceAxes(self, slicingMatrix, slabShift=0, axes=None, onImageGrid=True):
+    ### INPUTS
+    # slicingMatrix: vtkMatrix4x4, pose of the US image (RAS)
+    # slabShift: slab offset along the Z axis of the image, in slices of the volume
+    # axes: vtkMatrix4x4 to fill (a new matrix if None)
+    # onImageGrid: include the image grid (SetImageGrid) in the axes
+    ### OUTPUTS
+    # reslice axes (vtkMatrix4x4)
+    resliceAxes = self.ComputeResliceAxesArray(slicer.util.arrayFromVTKMatrix(slicingMatrix)[np.newaxis], [slabShift], onImageGrid)
+    if axes is None:
+      axes = vtk.vtkMatrix4x4()
+    slicer.util.updateVTKMatrixFromArray(axes, resliceAxes[0, 0])
+    return axes
+
+  def ComputeResliceAxesArray(self, transforms_RAS, slabShifts=(0,), onImageGrid=True):
+    ### INPUTS
+    # transforms_RAS: numpy (N, 4, 4), poses of the US images (RAS)
+    # slabShifts: slab offsets along the Z axis of the images, in slices of the volume
+    # onImageGrid: include the image grid (SetImageGrid) in the axes
+    ### OUTPUTS
+    # numpy (N, S, 4, 4), reslice axes of every frame and slab, computed in one batch
+    transforms_RAS = np.asarray(transforms_RAS, dtype=np.float64)
+    # RAS to LPS: C * M * C with C = diag(-1, -1, 1, 1)
+    lpsToRAS = np.array([-1.0, -1.0, 1.0, 1.0])
+    M_LPS = transforms_RAS * lpsToRAS[:, np.newaxis] * lpsToRAS[np.newaxis, :]
+    # then move the volume center to the origin
+    M_LPS[:, :3, 3] -= np.einsum('nij,j->ni', M_LPS[:, :3, :3], self.inCenter)
+    # shifting the slicing position along Z axis
+    slabOffsets = np.asarray(slabShifts, dtype=np.float64) * self.inSpacing[2]
+    resliceAxes = np.repeat(M_LPS[:, np.newaxis], len(slabOffsets), axis=1)
+    resliceAxes[:, :, :3, 3] += M_LPS[:, np.newaxis, :3, 2] * slabOffsets[np.newaxis, :, np.newaxis]
+    if onImageGrid and self.imageGridMatrix is not None:
+      resliceAxes = np.matmul(resliceAxes, self.imageGridMatrix)
+    return resliceAxes
+
+  def GetSlabOutputGeometry(self, slicingMatrix, slabShift=0):
+    ### OUTPUTS
+    # reslice axes (numpy 4x4), output origin, spacing and whole extent that vtkImageReslice uses for this slab
+    # (only the pipeline information is updated, nothing is resliced)
+    self.GetResliceAxes(slicingMatrix, slabShift, self.slabAxes)
+    return self.GetSlabOutputGeometryFromAxes(None)
+
+  def GetSlabOutputGeometryFromAxes(self, axes):
+    # same as GetSlabOutputGeometry for precomputed reslice axes (numpy 4x4, None: the current axes of the engine)
+    if axes is not None:
+      slicer.util.updateVTKMatrixFromArray(self.slabAxes, axes)
+    self.slabReslicer.UpdateInformation()
+    outInfo = self.slabReslicer.GetOutputInformation(0)
+    return (slicer.util.arrayFromVTKMatrix(self.slabAxes), np.array(outInfo.Get(vtk.vtkDataObject.ORIGIN())),
+            np.array(outInfo.Get(vtk.vtkDataObject.SPACING())), tuple(outInfo.Get(vtk.vtkStreamingDemandDrivenPipeline.WHOLE_EXTENT())))
+
+  def GetFrameOutputGeometryFromAxes(self, slabAxes):
+    ### INPUTS
+    # slabAxes: numpy (S, 4, 4), reslice axes of the slabs of one frame (ComputeResliceAxesArray()[frameNumber])
+    ### OUTPUTS
+    # output origin, spacing and whole extent shared by all the slabs of the frame, so that they can be aggregated pixel by pixel:
+    # the image grid (SetImageGrid), or without one the default geometry of vtkImageReslice for the middle slab
+    if self.imageGrid is None:
+      self.slabReslicer.SetOutputSpacingToDefault()
+      self.slabReslicer.SetOutputOriginToDefault()
+      self.slabReslicer.SetOutputExtentToDefault()
+    _, origin, spacing, extent = self.GetSlabOutputGeometryFromAxes(slabAxes[len(slabAxes) // 2])
+    return origin, spacing, extent
+
+  def SetSlabGeometryFromAxes(self, slabAxes):
+    # Without an image grid, vtkImageReslice derives the output origin and extent of every slab from its own axes, and rounding
+    # may give the slabs of a frame different grids. The next slabs are resliced on the grid of the frame
+    # (GetFrameOutputGeometryFromAxes); None restores the default geometry. With an image grid, all the slabs are on its pixels.
+    if self.imageGrid is not None:
+      return
+    if slabAxes is None:
+      self.slabReslicer.SetOutputSpacingToDefault()
+      self.slabReslicer.SetOutputOriginToDefault()
+      self.slabReslicer.SetOutputExtentToDefault()
+      return
+    origin, spacing, extent = self.GetFrameOutputGeometryFromAxes(slabAxes)
+    self.slabReslicer.SetOutputOrigin(*origin)
+    self.slabReslicer.SetOutputSpacing(*spacing)
+    self.slabReslicer.SetOutputExtent(*extent)
+
+  def ResliceSlab(self, slicingMatrix, slabShift=0):
+    # 2D oblique slice of the volume (the output of the engine, overwritten by the next call)
+    self.GetResliceAxes(slicingMatrix, slabShift, self.slabAxes)
+    self.slabReslicer.Update()
+    return self.slabReslicer.GetOutput()
+
+  def ResliceSlabFromAxes(self, axes):
+    # same as ResliceSlab for precomputed reslice axes (numpy 4x4, see ComputeResliceAxesArray)
+    slicer.util.updateVTKMatrixFromArray(self.slabAxes, axes)
+    self.slabReslicer.Update()
+    return self.slabReslicer.GetOutput()
+
+  def ResliceSlabArray(self, slicingMatrix, slabShift=0):
+    # 2D oblique slice of the volume as a numpy array (rows, columns) that the caller owns
+    return self.SlabToArray(self.ResliceSlab(slicingMatrix, slabShift))
+
+  def ResliceSlabArrayFromAxes(self, axes):
+    return self.SlabToArray(self.ResliceSlabFromAxes(axes))
+
+  def SlabToArray(self, slab):
+    from vtk.util import numpy_support
+    dims = slab.GetDimensions()
+    return numpy_support.vtk_to_numpy(slab.GetPointData().GetScalars()).reshape(dims[1], dims[0], -1).squeeze(axis=2).copy()
+
+  def WriteArrayPNG(self, array, path):
+    # a 2D numpy image (e.g. an aggregated slab) written like WriteSlabPNG
+    if self.arrayWriter is None:
+      self.arrayWriter = SlabPNGWriter()
+    self.arrayWriter.Write(array, path)
+
+  def WriteSlabPNG(self, path):
+    # the slab of the last ResliceSlab call, mapped on its own intensity range
+    intensityRange = self.slabReslicer.GetOutput().GetScalarRange()
+    self.table.SetRange(intensityRange[0], intensityRange[1]) # set the range of your data values
+    self.pngWriter.SetFileName(path)
+    self.pngWriter.Write()
+    if self.pngWriter.GetErrorCode() != 0:
+      raise IOError(f"Failed to write {path} (vtkErrorCode {self.pngWriter.GetErrorCode()})")
+
+  def ResliceVolume(self, slicingMatrix, bounds=None):
+    # volume resampled in the frame of the US image (the output of the engine, overwritten by the next call)
+    # bounds: [xmin, xmax, ymin, ymax, zmin, zmax] in the output coordinates to limit the output to, the whole volume if None
+    self.GetResliceAxes(slicingMatrix, 0, self.volumeAxes, onImageGrid=False)
+    self.volumeReslicer.SetOutputSpacingToDefault()
+    self.volumeReslicer.SetOutputOriginToDefault()
+    self.volumeReslicer.SetOutputExtentToDefault()
+    if bounds is not None:
+      # keep the default sampling of the reslice, on a grid that only covers the bounds
+      self.volumeReslicer.UpdateInformation()
+      spacing = self.volumeReslicer.GetOutputInformation(0).Get(vtk.vtkDataObject.SPACING())
+      self.volumeReslicer.SetOutputSpacing(spacing)
+      self.volumeReslicer.SetOutputOrigin(bounds[0], bounds[2], bounds[4])
+      self.volumeReslicer.SetOutputExtent(0, int(np.ceil((bounds[1] - bounds[0]) / spacing[0])),
+                                          0, int(np.ceil((bounds[3] - bounds[2]) / spacing[1])),
+                                          0, int(np.ceil((bounds[5] - bounds[4]) / spacing[2])))
+    self.volumeReslicer.Update()
+    return self.volumeReslicer.GetOutput()
+
+  def WriteVolumeMHA(self, path, compress=True):
+    self.mhaWriter.SetCompression(compress)
+    self.mhaWriter.SetFileName(path)
+    self.mhaWriter.Write()
+
+class SlabPNGWriter(object):
+  """Write 2D numpy slabs as .png files the way ResliceEngine.WriteSlabPNG does
+  (mapped on their own intensity range, flipped vertically unless flip is False), with one persistent pipeline.
+  """
+
+  def __init__(self, compressionLevel=5, flip=True):
+    self.imageData = vtk.vtkImageData()
+    self.table = vtk.vtkScalarsToColors()
+    self.convert = vtk.vtkImageMapToColors()
+    self.convert.SetLookupTable(self.table)
+    self.convert.SetOutputFormatToRGB()
+    self.convert.SetInputData(self.imageData)
+    self.flip = vtk.vtkImageFlip()
+    self.flip.SetInputConnection(self.convert.GetOutputPort())
+    self.flip.SetFilteredAxis(1)
+    self.writer = vtk.vtkPNGWriter()
+    self.writer.SetInputConnection(self.flip.GetOutputPort() if flip else self.convert.GetOutputPort())
+    self.writer.SetCompressionLevel(compressionLevel) # zlib level, 0 (fastest) to 9 (smallest)
+
+  def Write(self, slab, path):
+    from vtk.util import numpy_support
+    slab = np.ascontiguousarray(slab)
+    self.imageData.SetDimensions(slab.shape[1], slab.shape[0], 1)
+    self.imageData.GetPointData().SetScalars(numpy_support.numpy_to_vtk(slab.ravel(), deep=False))
+    self.imageData.Modified()
+    self.table.SetRange(float(slab.min()), float(slab.max()))
+    self.writer.SetFileName(path)
+    self.writer.Write()
+    # vtkPNGWriter reports its failures (missing directory, full disk...) only through its error code
+    if self.writer.GetErrorCode() != 0:
+      raise IOError(f"Failed to write {path} (vtkErrorCode {self.writer.GetErrorCode()})")
+
+class SliceViewReslicer(object):
+  """Slices of a volume node as the Red slice view shows them for a tracked US pose, without any view.
+  The slice node geometry of "Save All" (SetSliceToRASByNTP of the pose, XYZ origin at the center of the US image,
+  resolution matching the volume) is computed with NumPy for all the poses at once, and the volume image data is
+  resliced in IJK like the background layer of the slice view does (XYToIJK = RASToIJK * SliceToRAS * XYToSlice).
+  No layout manager, slice widget, render or event processing is involved, so it also runs with --no-main-window.
+  """
+
+  def __init__(self, volumeNode, interpolation=None, numberOfThreads=None):
+    self.volumeNode = volumeNode
+    imageData = volumeNode.GetImageData()
+    self.rasToIJK = vtk.vtkMatrix4x4()
+    volumeNode.GetRASToIJKMatrix(self.rasToIJK)
+    self.worldToRAS = np.eye(4)
+    if volumeNode.GetParentTransformNode():
+      worldToParent = vtk.vtkMatrix4x4()
+      volumeNode.GetParentTransformNode().GetMatrixTransformFromWorld(worldToParent)
+      self.worldToRAS = slicer.util.arrayFromVTKMatrix(worldToParent)
+    self.worldToIJK = slicer.util.arrayFromVTKMatrix(self.rasToIJK).dot(self.worldToRAS)
+    # the slice view matches the finest spacing of the volume
+    self.spacing = float(min(volumeNode.GetSpacing()))
+    extent = imageData.GetExtent()
+    corners = np.array([[i, j, k, 1] for i in extent[0:2] for j in extent[2:4] for k in extent[4:6]], dtype=np.float64)
+    self.cornersWorld = corners.dot(np.linalg.inv(self.worldToIJK).T)
+    if interpolation is None:
+      # same as the slice view: linear if the volume is displayed interpolated
+      displayNode = volumeNode.GetDisplayNode()
+      interpolation = "linear" if displayNode is None or displayNode.GetInterpolate() else "nearest"
+
+    self.axes = vtk.vtkMatrix4x4()
+    self.reslice = vtk.vtkImageReslice()
+    self.reslice.SetInputData(imageData)
+    self.reslice.SetResliceAxes(self.axes)
+    self.reslice.SetOutputDimensionality(2)
+    self.reslice.SetOutputScalarType(-1) # same as the input
+    self.reslice.SetOutputOrigin(0, 0, 0)
+    self.reslice.SetOutputSpacing(1, 1, 1)
+    if numberOfThreads:
+      self.reslice.SetNumberOfThreads(numberOfThreads)
+    if interpolation == "sinc":
+      # not available in the slice view, same interpolator as the ResliceEngine
+      interpolator = vtk.vtkImageSincInterpolator()
+      interpolator.SetWindowFunctionToLanczos()
+      self.reslice.SetInterpolator(interpolator)
+    elif interpolation == "nearest":
+      self.reslice.SetInterpolationModeToNearestNeighbor()
+    elif interpolation == "cubic":
+      self.reslice.SetInterpolationModeToCubic()
+    else:
+      self.reslice.SetInterpolationModeToLinear()
+
+  def ComputeSliceToRAS(self, transforms_RAS):
+    ### INPUTS
+    # transforms_RAS: numpy (N, 4, 4), poses of the US images (RAS)
+    ### OUTPUTS
+    # numpy (N, 4, 4), SliceToRAS that vtkMRMLSliceNode.SetSliceToRASByNTP(N: Z axis, T: X axis, P: origin, 0) sets for every pose
+    transforms_RAS = np.asarray(transforms_RAS, dtype=np.float64)
+    normals = transforms_RAS[:, :3, 2] / np.linalg.norm(transforms_RAS[:, :3, 2], axis=1, keepdims=True)
+    # T is made orthogonal to N (the poses may be slightly sheared), as SetSliceToRASByNTP does
+    transverses = np.cross(np.cross(normals, transforms_RAS[:, :3, 0]), normals)
+    transverses /= np.linalg.norm(transverses, axis=1, keepdims=True)
+    sliceToRAS = np.zeros_like(transforms_RAS)
+    sliceToRAS[:, :3, 0] = transverses
+    sliceToRAS[:, :3, 1] = np.cross(normals, transverses)
+    sliceToRAS[:, :3, 2] = normals
+    sliceToRAS[:, :3, 3] = transforms_RAS[:, :3, 3]
+    sliceToRAS[:, 3, 3] = 1
+    return sliceToRAS
+
+  def ComputeGeometry(self, transforms_RAS, xyzOrigin):
+    ### INPUTS
+    # transforms_RAS: numpy (N, 4, 4), poses of the US images (RAS)
+    # xyzOrigin: XYZ origin of the slice node (center of the US image, see ReadSequentialDataLogic.GetSliceXYZOrigin)
+    ### OUTPUTS
+    # XYToIJK reslice axes numpy (N, 4, 4), dimensions (N, 3) and field of view (N, 3) of the slice node for every pose;
+    # the field of view is centered on the XYZ origin and covers the whole volume cross-section
+    sliceToRAS = self.ComputeSliceToRAS(transforms_RAS)
+    # volume corners in the slice coordinates of every pose
+    cornersSlice = np.einsum('nij,cj->nci', np.linalg.inv(sliceToRAS), self.cornersWorld)
+    halfFieldOfView = np.abs(cornersSlice[:, :, :2] - np.asarray(xyzOrigin[:2])).max(axis=1)
+    dimensions = np.ones((len(sliceToRAS), 3), dtype=int)
+    dimensions[:, :2] = np.maximum(np.ceil(2 * halfFieldOfView / self.spacing).astype(int), 1)
+    fieldOfView = dimensions * self.spacing
+    fieldOfView[:, 2] = self.spacing
+    return self.ComputeXYToIJK(sliceToRAS, xyzOrigin, dimensions, fieldOfView), dimensions, fieldOfView
+
+  def ComputeXYToIJK(self, sliceToRAS, xyzOrigin, dimensions, fieldOfView):
+    ### INPUTS
+    # sliceToRAS: numpy (N, 4, 4), see ComputeSliceToRAS
+    # xyzOrigin: XYZ origin of the slice node
+    # dimensions, fieldOfView: (N, 3) or (3,), dimensions and field of view of the slice node
+    ### OUTPUTS
+    # XYToIJK reslice axes numpy (N, 4, 4), with the XYToSlice of vtkMRMLSliceNode (pixel spacing fieldOfView / dimensions)
+    dimensions = np.broadcast_to(np.asarray(dimensions, dtype=np.float64), (len(sliceToRAS), 3))
+    fieldOfView = np.broadcast_to(np.asarray(fieldOfView, dtype=np.float64), (len(sliceToRAS), 3))
+    xyToSlice = np.repeat(np.eye(4)[np.newaxis], len(sliceToRAS), axis=0)
+    for axis in range(3):
+      xyToSlice[:, axis, axis] = fieldOfView[:, axis] / dimensions[:, axis]
+    xyToSlice[:, :2, 3] = np.asarray(xyzOrigin[:2]) - fieldOfView[:, :2] / 2
+    xyToSlice[:, 2, 3] = xyzOrigin[2]
+    return np.matmul(self.worldToIJK, np.matmul(sliceToRAS, xyToSlice))
+
+  def Reslice(self, xyToIJK, dimensions):
+    # one slice (the output of the reslicer, overwritten by the next call)
+    slicer.util.updateVTKMatrixFromArray(self.axes, xyToIJK)
+    self.reslice.SetOutputExtent(0, int(dimensions[0]) - 1, 0, int(dimensions[1]) - 1, 0, 0)
+    self.reslice.Update()
+    return self.reslice.GetOutput()
+
+  def ResliceArray(self, xyToIJK, dimensions):
+    # one slice as a numpy array (rows, columns) that the caller owns
+    from vtk.util import numpy_support
+    slab = self.Reslice(xyToIJK, dimensions)
+    dims = slab.GetDimensions()
+    return numpy_support.vtk_to_numpy(slab.GetPointData().GetScalars()).reshape(dims[1], dims[0], -1).squeeze(axis=2).copy()
+
+class AsyncPNGWriter(object):
+  """Producer/consumer .png export: Write() queues the image and returns, and a pool of writer threads
+  (each with its own SlabPNGWriter pipeline) encodes and writes the queued images, so that reslicing the next frames
+  overlaps with the compression and the disk I/O of the previous ones. The queue is bounded: Write() blocks while it is
+  full, which caps the memory held by the images in flight. An error of a writer thread is raised by the next
+  Write(), Flush() or Close() call (the images queued after the error are dropped).
+  """
+
+  def __init__(self, numberOfWriters=None, queueSize=None, compressionLevel=5, flip=True):
+    import queue
+    import threading
+    if numberOfWriters is None:
+      numberOfWriters = min(4, os.cpu_count() or 1)
+    self.queue = queue.Queue(maxsize=queueSize or 2 * numberOfWriters)
+    self.errors = []
+    self.threads = []
+    for _ in range(numberOfWriters):
+      thread = threading.Thread(target=self._WriteQueuedImages, args=(SlabPNGWriter(compressionLevel, flip),), daemon=True)
+      thread.start()
+      self.threads.append(thread)
+
+  def _WriteQueuedImages(self, writer):
+    while True:
+      item = self.queue.get()
+      try:
+        if item is None:
+          return
+        if not self.errors:
+          writer.Write(*item)
+      except Exception as e:
+        self.errors.append(e)
+      finally:
+        self.queue.task_done()
+
+  def _RaiseError(self):
+    if self.errors:
+      raise self.errors[0]
+
+  def Write(self, image, path):
+    # image: 2D numpy array, it must not be modified by the caller afterwards
+    self._RaiseError()
+    self.queue.put((image, path))
+
+  def Flush(self):
+    # wait until all the queued images are written
+    self.queue.join()
+    self._RaiseError()
+
+  def Close(self):
+    # write the queued images and stop the writer threads
+    self._StopThreads()
+    self._RaiseError()
+
+  def _StopThreads(self):
+    for _ in self.threads:
+      self.queue.put(None)
+    for thread in self.threads:
+      thread.join()
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    if exc_type is None:
+      self.Close()
+    else:
+      # the producer failed: the queued images are dropped and its error is raised
+      self.errors.append(exc_value)
+      self._StopThreads()
+
+#
 # ReadSequentialDataLogic
 #
 
@@ -783,20 +1492,40 @@ class ReadSequentialDataLogic(ScriptedLoadableModuleLogic):
   # Inputs: could be image volume node or transformation node
   # Outputs: converted sequence node
 
+  US_IMAGE_EXTENSIONS = ('.bmp', '.png', '.jpg', '.jpeg', '.tif', '.tiff')
+  FRAME_CACHE_FOLDER = ".ReadSequentialDataCache"
 
   def __init__(self):
     """
     Called when the logic class is instantiated. Can be used for initializing member variables.
     """
     ScriptedLoadableModuleLogic.__init__(self)
-
-  def VolumeReslice(self, volume, slicingMatrix, reslicedImgName, USImg_depth ,slabNum = 1, slabMode = 2):
+    self.lazyFrameLoader = None
+    self.lazyFrameNode = None
+    self.lazySequenceNode = None
+    self.lazyPrefetchCount = 4
+    self.followManifests = {}
+    self.calibrationRegistry = DepthCalibrationRegistry()
+    self._sliceOriginCache = {}
+    self._scalingTransformCache = {}
+    self.resliceEngine = None
+
+  def VolumeReslice(self, volume, slicingMatrix, reslicedImgName, USImg_depth ,slabNum = 1, slabMode = 2, saveSlabs = False,
+                    saveVolume = False, volumeThickness = 10.0, compressVolume = True, imagePixelToMM = None, interpolation = "cubic",
+                    compressionLevel = 5):
     ### INPUTS
     # volume: vtkImageData, this could be any 3D volume data (CT, MRI or 3D US)
     # slicingTransformation, vtkMatrix4x4
     # USImg_depth: this is specially for calibrated US, the depth info can help us obtain the image size, spacing 
     # slabNum: slabNum = 0 (default), if slabNum > 0; each ouput slice will actually be a composite of N slices (symetric slicing from left and right sides)
     # slabMode: if slabNum > 0, different slabMode can be chosen (VTK_IMAGE_SLAB_MIN : 0; VTK_IMAGE_SLAB_MAX: 1, VTK_IMAGE_SLAB_MEAN: 2 (default), VTK_IMAGE_SLAB_SUM: 3)
+    # saveSlabs: also save every slice of the slab (Resliced<name>neg1.png ... pos1.png), by default only the aggregated Resliced<name>.png is saved
+    # saveVolume: also save the volume resampled in the frame of the US image (ReslicedVol<name>.mha), limited to the fan ROI footprint
+    #             and to volumeThickness (mm) around the US plane; compressVolume: compressed .mha
+    # imagePixelToMM: numpy 4x4, T_imgPixel_imgMM (LPS) of the calibration (pixel spacing of the depth if None)
+    #                 the slices are resliced on the pixels of the US image ROI (see GetUSImageGrid) and the volume is limited to its footprint
+    # interpolation: "nearest", "linear" (previews), "cubic" (default) or "sinc" (see ResliceEngine.INTERPOLATION_MODES)
+    # compressionLevel: zlib level of the .png files, 0 (fastest) to 9 (smallest)
 
     ### OUTPUTS
     # reslicedImg: vtkImagedata format
@@ -805,130 +1534,49 @@ class ReadSequentialDataLogic(ScriptedLoadableModuleLogic):
     ### Reslicing defination 
     # Reslicing origin: since our 2D US image is spatially tracked, the reslicng origin is determined by the origin of the 2D US image (left-upper corner) + spatially tracked position
     # Reslicing orientation: same as the "slicingTransformation"
-    # Resliced image resolution: same as the input 2D US image, which is obtained from "USImg_depth" 
-    # Resliced image size: same as the input 2D US image, which is obtained from "USImg_depth"
-    # Interpolation mode: "VTK_NEAREST_INTERPOLATION", "VTK_LINEAR_INTERPOLATION", "VTK_CUBIC_INTERPOLATION"
+    # Resliced image resolution: same as the input 2D US image, which is obtained from "USImg_depth" and "imagePixelToMM"
+    # Resliced image size: same as the fan ROI of the input 2D US image, which is obtained from "USImg_depth"
+    #                      (the output pixel (i, j) is the ROI pixel (i, j), the pixels out of the ROI are not computed)
+    # Interpolation mode: "VTK_NEAREST_INTERPOLATION", "VTK_LINEAR_INTERPOLATION", "VTK_CUBIC_INTERPOLATION", windowed sinc
     #################################################################################################
 
     # Reslicing Origin + orientation
-    imageSpacing, mask, imageHeight = self.ReadMetaInfoFromDepthSetting(USImg_depth)
-    slicingTransform = vtk.vtkTransform()
-
-    translateXYZ_delta = [-(mask[3]-mask[2]+1)*0.5*imageSpacing[0], 0, 0, 1]
-   
-    translateXYZ_delta_new = [0, 0, 0, 1]
-    inOrigin = volume.GetOrigin()
-    inExtent = volume.GetExtent()
-    inSpacing = volume.GetSpacing()
-    inCenter = [inOrigin[0] + inSpacing[0]*(inExtent[1] - inExtent[0] +1) *0.5,
-                inOrigin[1] + inSpacing[1]*(inExtent[3] - inExtent[2] +1) *0.5,
-                inOrigin[2] + inSpacing[2]*(inExtent[5] - inExtent[4] +1) *0.5]
-
-    # print("INPUT imagedata.................")
-    # print("inOrigin: ", inOrigin)
-    # print("inExtent: ", inExtent)
-    # print("inSpacing: ", inSpacing)
-    # print("inCenter: ", inCenter)
-    # print("INPUT imagedata Done.............")
-    
-    for slab_shift in range(-slabNum, slabNum+1):
-
-      slicingMatrix_new = vtk.vtkMatrix4x4()
-      slicingMatrix_new.DeepCopy(slicingMatrix)
-      slicingMatrix_new = self.TransformationFromRASToLPS(slicingMatrix)
-
-      # shifting the slicing position along Z axis
-      delta_shift = [0, 0, slab_shift*inSpacing[2], 1]
-      shifted_translation = [0, 0, 0, 0]
-      slicingMatrix_new.MultiplyPoint(delta_shift, shifted_translation)
-      slicingMatrix_new.SetElement(0, 3, shifted_translation[0])
-      slicingMatrix_new.SetElement(1, 3, shifted_translation[1])
-      slicingMatrix_new.SetElement(2, 3, shifted_translation[2])
-      slicingMatrix_new.SetElement(3, 3, shifted_translation[3])
-
-      slicingMatrix_new_invert = vtk.vtkMatrix4x4()
-      vtk.vtkMatrix4x4.Invert(slicingMatrix_new, slicingMatrix_new_invert)
-
-      slicingTransform.PostMultiply()
-      slicingTransform.Translate(-inCenter[0], -inCenter[1], -inCenter[2])
-      slicingTransform.SetMatrix(slicingMatrix_new_invert)
-      slicingTransform.Translate(inCenter[0], inCenter[1], inCenter[2])
-      slicingTransform.Inverse()
-      slicingTransform.Update()
-      
-      reslicer = vtk.vtkImageReslice()
-      reslicer.SetInputData(volume)
-      # reslicer.SetResliceTransform(slicingTransform)
-      reslicer.SetResliceAxes(slicingTransform.GetMatrix())
-      reslicer.SetInterpolationModeToCubic()
-      reslicer.SetOutputScalarType(-1) # same as the input
-      reslicer.SetOutputDimensionality(2)
-      reslicer.Update()
-      reslicedImg = reslicer.GetOutput()
-
-      # convert to .png image
-      table = vtk.vtkScalarsToColors()
-      intensityRange = reslicedImg.GetScalarRange()
-      table.SetRange(intensityRange[0], intensityRange[1]) # set the range of your data values
-      
-      convert = vtk.vtkImageMapToColors()
-      convert.SetLookupTable(table)
-      convert.SetOutputFormatToRGB()
-      convert.SetInputData(reslicedImg)
-      convert.Update()
-
-      flip = vtk.vtkImageFlip()
-      flip.SetInputConnection(convert.GetOutputPort())
-      flip.SetFilteredAxis(1)
-      writer = vtk.vtkPNGWriter()
-      writer.SetInputConnection(flip.GetOutputPort())
-
-      # save to .png file
-      if slab_shift < 0:
-        slab_shift_name = "neg" + str(abs(slab_shift))
-      else:
-        slab_shift_name = "pos" + str(slab_shift)
-
-      directory = self.getParameterNode().GetParameter("ReslicedImgDir")
-      filename ="Resliced" + reslicedImgName + slab_shift_name + ".png"
-      path = directory +"\\" + filename
-      writer.SetFileName(path)
-      writer.Write()
-
-
-
-    slicingMatrix_new = vtk.vtkMatrix4x4()
-    slicingMatrix_new.DeepCopy(slicingMatrix)
-    slicingMatrix_new = self.TransformationFromRASToLPS(slicingMatrix)
-    slicingMatrix_new_invert = vtk.vtkMatrix4x4()
-    vtk.vtkMatrix4x4.Invert(slicingMatrix_new, slicingMatrix_new_invert)
-
-    slicingTransform.PostMultiply()
-    slicingTransform.Translate(-inCenter[0], -inCenter[1], -inCenter[2])
-    slicingTransform.SetMatrix(slicingMatrix_new_invert)
-    slicingTransform.Translate(inCenter[0], inCenter[1], inCenter[2])
-    slicingTransform.Inverse()
-    slicingTransform.Update()
-    
-    reslicer = vtk.vtkImageReslice()
-    reslicer.SetInputData(volume)
-    # reslicer.SetResliceTransform(slicingTransform)
-    reslicer.SetResliceAxes(slicingTransform.GetMatrix())
-    reslicer.SetInterpolationModeToCubic()
-    reslicer.SetOutputScalarType(-1) # same as the input
-    # reslicer.SetOutputDimensionality(2)
-    reslicer.Update()
-    reslicedImg = reslicer.GetOutput()
-    
-    # save to .mha file
-    filename_mha ="ReslicedVol" + reslicedImgName + ".mha"
-    path_mha = directory +"\\" + filename_mha
-    writer_mha = vtk.vtkMetaImageWriter()
-    writer_mha.SetInputData(reslicedImg)
-    writer_mha.SetFileName(path_mha)
-    writer_mha.Write()
-
-
+    # The pipeline (reslice, color mapping, flip, writers) is built once per volume by the ResliceEngine,
+    # only the reslice axes change between the slabs and the frames.
+    imageGrid = self.GetUSImageGrid(USImg_depth, imagePixelToMM)
+    engine = self.GetResliceEngine(volume)
+    engine.SetImageGrid(imageGrid)
+    engine.SetInterpolation(interpolation)
+    directory = self.getParameterNode().GetParameter("ReslicedImgDir")
+
+    slabShifts = range(-slabNum, slabNum+1)
+    resliceAxes = engine.ComputeResliceAxesArray(slicer.util.arrayFromVTKMatrix(slicingMatrix)[np.newaxis], slabShifts)[0]
+    # the .png files are encoded and written in the background while the next slabs (and the volume) are resliced
+    with AsyncPNGWriter(compressionLevel=compressionLevel) as pngWriter:
+      slabs = []
+      # all the slabs on the same pixels, so that they can be aggregated
+      engine.SetSlabGeometryFromAxes(resliceAxes)
+      for slab_shift, axes in zip(slabShifts, resliceAxes):
+        slabs.append(engine.ResliceSlabArrayFromAxes(axes))
+
+        if saveSlabs:
+          # save to .png file
+          filename ="Resliced" + reslicedImgName + self.SlabShiftName(slab_shift) + ".png"
+          path = os.path.join(directory, filename)
+          pngWriter.Write(slabs[-1], path)
+
+      engine.SetSlabGeometryFromAxes(None)
+      # the slab is aggregated in memory into one image per frame
+      pngWriter.Write(self.AggregateSlabs(slabs, slabMode), os.path.join(directory, "Resliced" + reslicedImgName + ".png"))
+
+      # save to .mha file
+      reslicedImg = None
+      if saveVolume:
+        bounds = self.GetResliceFootprintBounds(engine, imageGrid, volumeThickness)
+        reslicedImg = engine.ResliceVolume(slicingMatrix, bounds)
+        filename_mha ="ReslicedVol" + reslicedImgName + ".mha"
+        path_mha = os.path.join(directory, filename_mha)
+        engine.WriteVolumeMHA(path_mha, compressVolume)
 
 
     # # # initialize the pixels here
@@ -941,7 +1589,344 @@ class ReadSequentialDataLogic(ScriptedLoadableModuleLogic):
     # volumeNode = slicer.mrmlScene.AddNode(volumeNode)
     # volumeNode.CreateDefaultDisplayNodes()
 
-    return reslicedImg    
+    # the returned image (None if the volume is not saved) is the output of the engine, it is overwritten by the next call
+    return reslicedImg
+
+  def GetResliceFootprintBounds(self, engine, imageGrid, thickness):
+    ### INPUTS
+    # engine: ResliceEngine of the volume
+    # imageGrid: US image ROI and T_imgPixel_imgMM (see GetUSImageGrid), None for the whole volume
+    # thickness: thickness (mm) of the slab around the US plane
+    ### OUTPUTS
+    # bounds [xmin, xmax, ymin, ymax, zmin, zmax] of the fan ROI footprint x slab, in the output coordinates of the
+    # reslice (image frame in mm, shifted by the volume center: see ResliceEngine.GetResliceAxes), None for the whole volume
+    if imageGrid is None:
+      return None
+    imagePixelToMM = np.asarray(imageGrid["imagePixelToMM"], dtype=np.float64)
+    corners = np.array([[u, v, 0, 1] for u in (0, imageGrid["width"]) for v in (0, imageGrid["height"])], dtype=np.float64)
+    cornersMM = corners.dot(imagePixelToMM.T)[:, :3]
+    # the image normal in the image frame, scaled to half the thickness
+    normal = imagePixelToMM[:3, 2]
+    normal = normal / np.linalg.norm(normal) * (thickness * 0.5)
+    points = np.concatenate([cornersMM + normal, cornersMM - normal]) + np.array(engine.inCenter)
+    return [points[:, 0].min(), points[:, 0].max(), points[:, 1].min(), points[:, 1].max(), points[:, 2].min(), points[:, 2].max()]
+
+  def SlabShiftName(self, slab_shift):
+    # file name suffix of a slab: neg1, pos0, pos1...
+    if slab_shift < 0:
+      return "neg" + str(abs(slab_shift))
+    return "pos" + str(slab_shift)
+
+  def ComputeResliceAxes(self, volume, slicingMatrices, slabShifts=(0,), imageGrid=None):
+    """
+    Reslice axes of all the frames and slabs of a sweep, computed in one NumPy batch (see ResliceEngine.ComputeResliceAxesArray).
+    :param slicingMatrices: numpy (N, 4, 4) (e.g. GetTransformSequenceArray) or list of vtkMatrix4x4, pose of every frame (RAS)
+    :param imageGrid: optional US image grid (GetUSImageGrid) the slabs are resliced on
+    :return: numpy (N, S, 4, 4)
+    """
+    if not isinstance(slicingMatrices, np.ndarray):
+      slicingMatrices = np.array([slicer.util.arrayFromVTKMatrix(matrix) for matrix in slicingMatrices]).reshape(-1, 4, 4)
+    engine = self.GetResliceEngine(volume)
+    engine.SetImageGrid(imageGrid)
+    return engine.ComputeResliceAxesArray(slicingMatrices, slabShifts)
+
+  def GetUSImageGrid(self, depth, imagePixelToMM=None, probe=None):
+    ### INPUTS
+    # depth: US depth preset
+    # imagePixelToMM: numpy 4x4, T_imgPixel_imgMM (LPS) of the calibration, diag(pixel spacing of the depth) if None
+    ### OUTPUTS
+    # dict with imagePixelToMM, width and height (pixels) of the fan ROI, the output grid of the slabs (ResliceEngine.SetImageGrid);
+    # None for an unknown depth
+    calibration = self.calibrationRegistry.GetCalibration(depth, probe)
+    if calibration is None:
+      return None
+    if imagePixelToMM is None:
+      imagePixelToMM = np.diag([calibration["imageSpacing"][0], calibration["imageSpacing"][1], 1.0, 1.0])
+    mask = calibration["mask"]
+    return {"imagePixelToMM": imagePixelToMM, "width": mask[3] - mask[2], "height": mask[1] - mask[0]}
+
+  def ResliceFrames(self, volume, slicingMatrices, slabShifts=(0,), numberOfWorkers=None, writeSlab=None, aggregate=None, resliceAxes=None,
+                    imageGrid=None, interpolation="cubic"):
+    """
+    Reslice the frames of a sweep with a pool of worker threads.
+    Every worker has its own single-threaded ResliceEngine over a shallow copy of the volume
+    (the voxels are shared, read only), and a worker reslices all the slabs of one frame at a time.
+    The reslice axes of the whole sweep are computed before the workers start (ComputeResliceAxes).
+    :param volume: vtkImageData
+    :param slicingMatrices: numpy (N, 4, 4) or list of vtkMatrix4x4, pose of every frame (RAS)
+    :param slabShifts: slab offsets resliced for every frame
+    :param numberOfWorkers: number of worker threads (default: CPU count)
+    :param writeSlab: optional function(engine, frameNumber, slabShift) called in the worker after each slab is resliced,
+      e.g. to write it with the writers of the engine
+    :param aggregate: optional function(engine, frameNumber, slabs) called in the worker once all the slabs of a frame
+      are resliced, its result replaces the list of slabs
+    :param resliceAxes: optional numpy (N, S, 4, 4) already computed by ComputeResliceAxes, slicingMatrices is then not used
+    :param imageGrid: optional US image grid (GetUSImageGrid) the slabs are resliced on, the same as for resliceAxes
+    :param interpolation: one of ResliceEngine.INTERPOLATION_MODES
+    :return: generator of (frameNumber, list of 2D numpy arrays, one per slab), in frame order
+    """
+    import collections
+    import concurrent.futures
+    import queue
+    if resliceAxes is None:
+      resliceAxes = self.ComputeResliceAxes(volume, slicingMatrices, slabShifts, imageGrid)
+    numberOfFrames = len(resliceAxes)
+    if numberOfWorkers is None:
+      numberOfWorkers = os.cpu_count() or 1
+    numberOfWorkers = max(1, min(numberOfWorkers, numberOfFrames))
+    engines = queue.Queue()
+    for _ in range(numberOfWorkers):
+      sharedVolume = vtk.vtkImageData()
+      sharedVolume.ShallowCopy(volume)
+      engine = ResliceEngine(sharedVolume, numberOfThreads=1, interpolation=interpolation)
+      engine.SetImageGrid(imageGrid)
+      engines.put(engine)
+
+    def resliceFrame(frameNumber):
+      engine = engines.get()
+      try:
+        slabs = []
+        # all the slabs of the frame on the same pixels, so that they can be aggregated
+        engine.SetSlabGeometryFromAxes(resliceAxes[frameNumber])
+        for slabShift, axes in zip(slabShifts, resliceAxes[frameNumber]):
+          slabs.append(engine.ResliceSlabArrayFromAxes(axes))
+          if writeSlab is not None:
+            writeSlab(engine, frameNumber, slabShift)
+        if aggregate is not None:
+          return aggregate(engine, frameNumber, slabs)
+        return slabs
+      finally:
+        engines.put(engine)
+
+    # a bounded window of frames is in flight, the results are returned in frame order
+    with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers) as executor:
+      pending = collections.deque()
+      nextFrameNumber = 0
+      for frameNumber in range(numberOfFrames):
+        while nextFrameNumber < numberOfFrames and len(pending) < 4 * numberOfWorkers:
+          pending.append(executor.submit(resliceFrame, nextFrameNumber))
+          nextFrameNumber += 1
+        yield frameNumber, pending.popleft().result()
+
+  def ResliceFramesNumPy(self, volume, slicingMatrices, slabShifts=(0,), order=3, batchSize=4, resliceAxes=None, imageGrid=None):
+    """
+    Batched alternative to ResliceFrames: the sample coordinates of all the slabs of a batch of frames are computed
+    as one (B, S, H, W, 3) array and the volume is sampled with a single scipy.ndimage.map_coordinates call.
+    The output geometry (origin, spacing, extent) of the slabs of a frame is the one of ResliceFrames (GetFrameOutputGeometryFromAxes).
+    :param order: spline order of the interpolation, 0 (nearest), 1 (linear), 3 (cubic) or 5 (see INTERPOLATION_SPLINE_ORDERS)
+    :param batchSize: number of frames sampled together, the sample coordinates take batchSize x slabs x rows x columns x 12 bytes
+    :param resliceAxes: optional numpy (N, S, 4, 4) already computed by ComputeResliceAxes
+    :param imageGrid: optional US image grid (GetUSImageGrid) the slabs are resliced on, the same as for resliceAxes
+    :return: generator of (frameNumber, list of 2D numpy arrays, one per slab), in frame order
+    """
+    try:
+      from scipy import ndimage
+    except ImportError:
+      raise ImportError("The SciPy reslice backend needs scipy: install it with slicer.util.pip_install('scipy') or use the VTK backend")
+    from vtk.util import numpy_support
+    dims = volume.GetDimensions()
+    voxels = numpy_support.vtk_to_numpy(volume.GetPointData().GetScalars()).reshape(dims[2], dims[1], dims[0])
+    if order > 1:
+      # the spline coefficients are computed once for the whole sweep instead of in every map_coordinates call
+      coefficients = ndimage.spline_filter(voxels, order=order, output=np.float32)
+    else:
+      coefficients = voxels
+    inOrigin = np.array(volume.GetOrigin())
+    inSpacing = np.array(volume.GetSpacing())
+    engine = ResliceEngine(volume)
+    engine.SetImageGrid(imageGrid)
+    if resliceAxes is None:
+      resliceAxes = engine.ComputeResliceAxesArray(
+        slicingMatrices if isinstance(slicingMatrices, np.ndarray) else [slicer.util.arrayFromVTKMatrix(matrix) for matrix in slicingMatrices],
+        slabShifts)
+    numberOfFrames, numberOfSlabs = resliceAxes.shape[:2]
+
+    for batchStart in range(0, numberOfFrames, batchSize):
+      batchFrameNumbers = range(batchStart, min(batchStart + batchSize, numberOfFrames))
+      batchAxes = resliceAxes[batchStart:batchStart + len(batchFrameNumbers)]
+      # output geometry of ResliceFrames, shared by the slabs of a frame
+      origins = np.zeros((len(batchFrameNumbers), numberOfSlabs, 3))
+      spacings = np.zeros((len(batchFrameNumbers), numberOfSlabs, 3))
+      frameExtents = []
+      for batchNumber in range(len(batchFrameNumbers)):
+        origins[batchNumber, :], spacings[batchNumber, :], extent = engine.GetFrameOutputGeometryFromAxes(batchAxes[batchNumber])
+        frameExtents.append(extent)
+      # output voxel (i, j, k) -> volume index: (A[:3,:3] (origin + spacing * (i, j, k)) + A[:3,3] - inOrigin) / inSpacing
+      # (computed in double precision, the sample coordinates are float32 to halve their memory)
+      linear = (batchAxes[:, :, :3, :3] * spacings[:, :, np.newaxis, :] / inSpacing[:, np.newaxis]).astype(np.float32)
+      offset = ((np.einsum('bsij,bsj->bsi', batchAxes[:, :, :3, :3], origins) + batchAxes[:, :, :3, 3] - inOrigin) / inSpacing).astype(np.float32)
+
+      # the frames that share the output grid are sampled together (usually the whole batch)
+      batchSlabs = [None] * len(batchFrameNumbers)
+      for extent in set(frameExtents):
+        groupNumbers = [batchNumber for batchNumber, frameExtent in enumerate(frameExtents) if frameExtent == extent]
+        j, i = np.mgrid[extent[2]:extent[3]+1, extent[0]:extent[1]+1]
+        grid = np.stack([i, j, np.full_like(i, extent[4])], axis=-1).astype(np.float32)
+        indices = np.einsum('bsxy,hwy->bshwx', linear[groupNumbers], grid) + offset[groupNumbers][:, :, np.newaxis, np.newaxis, :]
+        # map_coordinates expects the array axes order (k, j, i)
+        samples = ndimage.map_coordinates(coefficients, np.moveaxis(indices[..., ::-1], -1, 0), order=order,
+          mode='constant', cval=0.0, prefilter=False, output=np.float32)
+        if np.issubdtype(voxels.dtype, np.integer):
+          typeInfo = np.iinfo(voxels.dtype)
+          samples = np.clip(np.rint(samples), typeInfo.min, typeInfo.max)
+        samples = samples.astype(voxels.dtype)
+        for groupIndex, batchNumber in enumerate(groupNumbers):
+          batchSlabs[batchNumber] = list(samples[groupIndex])
+      for batchNumber, frameNumber in enumerate(batchFrameNumbers):
+        yield frameNumber, batchSlabs[batchNumber]
+
+  SLAB_MODES = ("min", "max", "mean", "sum") # VTK_IMAGE_SLAB_MIN, VTK_IMAGE_SLAB_MAX, VTK_IMAGE_SLAB_MEAN, VTK_IMAGE_SLAB_SUM
+
+  def AggregateSlabs(self, slabs, slabMode=2):
+    ### INPUTS
+    # slabs: list of 2D numpy arrays (same shape), the slices of a slab
+    # slabMode: VTK_IMAGE_SLAB_MIN : 0; VTK_IMAGE_SLAB_MAX: 1, VTK_IMAGE_SLAB_MEAN: 2, VTK_IMAGE_SLAB_SUM: 3
+    ### OUTPUTS
+    # aggregated 2D image: min/max keep the type of the slices, mean is rounded back to it for integer slices, sum is float32
+    if len(slabs) == 1 and slabMode != 3:
+      return slabs[0]
+    stack = np.stack(slabs)
+    if slabMode == 0:
+      return stack.min(axis=0)
+    elif slabMode == 1:
+      return stack.max(axis=0)
+    elif slabMode == 2:
+      mean = stack.mean(axis=0, dtype=np.float32)
+      if np.issubdtype(stack.dtype, np.integer):
+        return np.rint(mean).astype(stack.dtype)
+      return mean.astype(stack.dtype)
+    elif slabMode == 3:
+      return stack.sum(axis=0, dtype=np.float32)
+    raise ValueError(f"Unknown slab mode {slabMode}")
+
+  # spline order of ResliceFramesNumPy for the interpolation modes of the ResliceEngine (no windowed sinc in scipy.ndimage: quintic spline)
+  INTERPOLATION_SPLINE_ORDERS = {"nearest": 0, "linear": 1, "cubic": 3, "sinc": 5}
+
+  def SaveReslicedSweep(self, volume, slicingMatrices, reslicedImgNames, directory, slabNum=1, numberOfWorkers=None, backend="vtk",
+                        interpolation="cubic", slabMode=2, saveSlabs=False, imageGrid=None, compressionLevel=5, numberOfWriters=None,
+                        filePrefix="Resliced"):
+    """
+    Reslice and save all the frames (same slicing as VolumeReslice, without the .mha volume) as <filePrefix><name>.png
+    with the frame-parallel ResliceFrames ("vtk" backend) or the batched ResliceFramesNumPy ("scipy" backend).
+    slicingMatrices: numpy (N, 4, 4) (e.g. GetTransformSequenceArray) or list of vtkMatrix4x4, the reslice axes
+    of all the frames and slabs are computed at once before reslicing.
+    One image aggregated over the slab (see AggregateSlabs) is saved per frame, every slice of the slab too if saveSlabs.
+    imageGrid: optional US image grid (GetUSImageGrid), the saved images are then pixel-aligned with the US frames.
+    interpolation: one of ResliceEngine.INTERPOLATION_MODES (INTERPOLATION_SPLINE_ORDERS for the "scipy" backend).
+    The images are encoded and written by an AsyncPNGWriter (compressionLevel, numberOfWriters) while the next frames are resliced.
+    filePrefix: "Resliced" gives the file names of VolumeReslice; use another prefix when the directory also holds the
+    slice view images of SaveReslicedSequence, which have the same names but another geometry.
+    """
+    startTime = time.time()
+
+    def slabPath(frameNumber, slabShift):
+      return os.path.join(directory, filePrefix + reslicedImgNames[frameNumber] + self.SlabShiftName(slabShift) + ".png")
+
+    def aggregatedPath(frameNumber):
+      return os.path.join(directory, filePrefix + reslicedImgNames[frameNumber] + ".png")
+
+    slabShifts = range(-slabNum, slabNum+1)
+    resliceAxes = self.ComputeResliceAxes(volume, slicingMatrices, slabShifts, imageGrid)
+    if backend == "scipy":
+      order = self.INTERPOLATION_SPLINE_ORDERS[interpolation]
+      frames = self.ResliceFramesNumPy(volume, None, slabShifts, order, resliceAxes=resliceAxes, imageGrid=imageGrid)
+    else:
+      frames = self.ResliceFrames(volume, None, slabShifts, numberOfWorkers, resliceAxes=resliceAxes, imageGrid=imageGrid,
+                                  interpolation=interpolation)
+    with AsyncPNGWriter(numberOfWriters, compressionLevel=compressionLevel) as pngWriter:
+      for frameNumber, slabs in frames:
+        if saveSlabs:
+          for slabShift, slab in zip(slabShifts, slabs):
+            pngWriter.Write(slab, slabPath(frameNumber, slabShift))
+        pngWriter.Write(self.AggregateSlabs(slabs, slabMode), aggregatedPath(frameNumber))
+    logging.info(f'Resliced {len(resliceAxes)} frames in {time.time()-startTime:.2f} seconds')
+
+  def SaveReslicedSequence(self, volumeNode, transformSequenceNode, imageSequenceNode, directory, xyzOrigin_RAS_mm, validFrames=None,
+                           interpolation=None, writeMeta=True, compressionLevel=5, numberOfWriters=None, numberOfWorkers=1):
+    """
+    Headless "Save All": the slices of the volume node that the Red slice view shows for every pose of the transform sequence,
+    saved as Resliced<US image name>.png (and Meta<US image name>.txt with the field of view and the dimensions), see SliceViewReslicer.
+    It does not use the layout manager nor the event loop, e.g. in a batch job run with
+    Slicer --no-main-window --python-script script.py:
+      logic = ReadSequentialDataLogic()
+      origin = logic.GetSliceXYZOrigin(depth, os.path.join(scalingDir, "T_imgPixel_imgMM.txt"))
+      logic.SaveReslicedSequence(volumeNode, transformSequenceNode, imageSequenceNode, outputDir, origin)
+    :param validFrames: optional mask of the frames to save (e.g. GetValidFrameMask)
+    :param interpolation: one of ResliceEngine.INTERPOLATION_MODES, by default the interpolation of the volume display (as the slice view)
+    :param compressionLevel, numberOfWriters: png compression level and number of writer threads (see AsyncPNGWriter)
+    :param numberOfWorkers: number of reslice workers (see ResliceSliceViewFrames), the saved files do not depend on it
+    :return: number of saved frames
+    """
+    startTime = time.time()
+    frameNumbers = np.arange(transformSequenceNode.GetNumberOfDataNodes())
+    if validFrames is not None:
+      frameNumbers = frameNumbers[np.asarray(validFrames, dtype=bool)]
+    transforms_RAS = self.GetTransformSequenceArray(transformSequenceNode, toWorld=True)[frameNumbers]
+    reslicer = SliceViewReslicer(volumeNode, interpolation)
+    xyToIJK, dimensions, fieldOfView = reslicer.ComputeGeometry(transforms_RAS, xyzOrigin_RAS_mm)
+    # the slices are not flipped, as saved from the slice view
+    with AsyncPNGWriter(numberOfWriters, compressionLevel=compressionLevel, flip=False) as pngWriter:
+      for frameIndex, reslicedImg in self.ResliceSliceViewFrames(volumeNode, xyToIJK, dimensions, numberOfWorkers, interpolation, reslicer):
+        reslicedImgName = imageSequenceNode.GetNthDataNode(int(frameNumbers[frameIndex])).GetName()
+        pngWriter.Write(reslicedImg, os.path.join(directory, "Resliced" + reslicedImgName + ".png"))
+        if writeMeta:
+          with open(os.path.join(directory, "Meta" + reslicedImgName + ".txt"), 'w') as f:
+            f.write('FOV:  ' + '  '.join(str(value) for value in fieldOfView[frameIndex]) + '\n')
+            f.write('Dims:  ' + '  '.join(str(value) for value in dimensions[frameIndex]) + '\n')
+    logging.info(f'Resliced {len(frameNumbers)} frames (headless) in {time.time()-startTime:.2f} seconds')
+    return len(frameNumbers)
+
+  def ResliceSliceViewFrames(self, volumeNode, xyToIJK, dimensions, numberOfWorkers=1, interpolation=None, reslicer=None):
+    """
+    Slices of the SliceViewReslicer for the geometry of all the frames (SliceViewReslicer.ComputeGeometry).
+    With more than one worker, the frames are spread over a pool of threads, each with its own single-threaded
+    SliceViewReslicer over the image data of the volume node (the voxels are shared, read only); vtkImageReslice
+    releases the GIL while it interpolates. The slices are the same as with one worker.
+    :param numberOfWorkers: number of worker threads (None: CPU count), 1: the frames are resliced in the calling thread
+    :param reslicer: optional SliceViewReslicer of the volume node, used when there is one worker
+    :return: generator of (frameIndex, 2D numpy array), in frame order
+    """
+    import collections
+    import concurrent.futures
+    import queue
+    numberOfFrames = len(xyToIJK)
+    if numberOfWorkers is None:
+      numberOfWorkers = os.cpu_count() or 1
+    numberOfWorkers = max(1, min(numberOfWorkers, numberOfFrames))
+    if numberOfWorkers == 1:
+      if reslicer is None:
+        reslicer = SliceViewReslicer(volumeNode, interpolation)
+      for frameIndex in range(numberOfFrames):
+        yield frameIndex, reslicer.ResliceArray(xyToIJK[frameIndex], dimensions[frameIndex])
+      return
+
+    reslicers = queue.Queue()
+    for _ in range(numberOfWorkers):
+      reslicers.put(SliceViewReslicer(volumeNode, interpolation, numberOfThreads=1))
+
+    def resliceFrame(frameIndex):
+      workerReslicer = reslicers.get()
+      try:
+        return workerReslicer.ResliceArray(xyToIJK[frameIndex], dimensions[frameIndex])
+      finally:
+        reslicers.put(workerReslicer)
+
+    # a bounded window of frames is in flight, the results are returned in frame order
+    with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers) as executor:
+      pending = collections.deque()
+      nextFrameIndex = 0
+      for frameIndex in range(numberOfFrames):
+        while nextFrameIndex < numberOfFrames and len(pending) < 4 * numberOfWorkers:
+          pending.append(executor.submit(resliceFrame, nextFrameIndex))
+          nextFrameIndex += 1
+        yield frameIndex, pending.popleft().result()
+
+  def GetResliceEngine(self, volume):
+    # the engine is kept while the same volume is resliced (e.g. all the frames of a sweep)
+    if self.resliceEngine is None or not self.resliceEngine.IsValidFor(volume):
+      self.resliceEngine = ResliceEngine(volume)
+    return self.resliceEngine
+
   def TransformationFromRASToLPS(self, transformation_RAS):
     # transformation_RAS: vtkMatrix4x4
     T_RAS_to_LPS = vtk.vtkMatrix4x4()
@@ -973,6 +1958,57 @@ class ReadSequentialDataLogic(ScriptedLoadableModuleLogic):
       parameterNode.SetParameter("CTDir", "Copy and Paste the folder directory!")
     if not parameterNode.GetParameter("ReslicedImgDir"):
       parameterNode.SetParameter("ReslicedImgDir", "Copy and Paste the folder directory!")
+    if not parameterNode.GetParameter("ParallelDecode"):
+      # opt-in: the default import path stays slicer.util.loadVolume (see test_ParallelDecodeMatchesLoadVolume)
+      parameterNode.SetParameter("ParallelDecode", "False")
+    if not parameterNode.GetParameter("DecodeWorkers"):
+      parameterNode.SetParameter("DecodeWorkers", str(min(8, os.cpu_count() or 1)))
+    if not parameterNode.GetParameter("ParallelExport"):
+      parameterNode.SetParameter("ParallelExport", "False")
+    if not parameterNode.GetParameter("ResliceWorkers"):
+      parameterNode.SetParameter("ResliceWorkers", str(os.cpu_count() or 1))
+    if not parameterNode.GetParameter("SlabNumber"):
+      parameterNode.SetParameter("SlabNumber", "1")
+    if not parameterNode.GetParameter("SlabMode"):
+      parameterNode.SetParameter("SlabMode", "2") # VTK_IMAGE_SLAB_MEAN
+    if not parameterNode.GetParameter("Interpolation"):
+      parameterNode.SetParameter("Interpolation", "cubic")
+    if not parameterNode.GetParameter("PNGCompressionLevel"):
+      parameterNode.SetParameter("PNGCompressionLevel", "5") # default of vtkPNGWriter
+    if not parameterNode.GetParameter("SaveSlabs"):
+      parameterNode.SetParameter("SaveSlabs", "False")
+    if not parameterNode.GetParameter("SaveVolume"):
+      parameterNode.SetParameter("SaveVolume", "False")
+    if not parameterNode.GetParameter("VolumeThickness"):
+      parameterNode.SetParameter("VolumeThickness", "10.0")
+    if not parameterNode.GetParameter("CompressVolume"):
+      parameterNode.SetParameter("CompressVolume", "True")
+    if not parameterNode.GetParameter("CollapseGrayscale"):
+      parameterNode.SetParameter("CollapseGrayscale", "False")
+    if not parameterNode.GetParameter("FrameCache"):
+      parameterNode.SetParameter("FrameCache", "False")
+    if not parameterNode.GetParameter("LazyLoad"):
+      parameterNode.SetParameter("LazyLoad", "False")
+    if not parameterNode.GetParameter("LazyCacheSizeMB"):
+      parameterNode.SetParameter("LazyCacheSizeMB", "256")
+    if not parameterNode.GetParameter("FollowIntervalMs"):
+      parameterNode.SetParameter("FollowIntervalMs", "1000")
+    if not parameterNode.GetParameter("USDepth"):
+      parameterNode.SetParameter("USDepth", "16")
+    if not parameterNode.GetParameter("CropROI"):
+      parameterNode.SetParameter("CropROI", "False")
+    if not parameterNode.GetParameter("ProxyFactor"):
+      parameterNode.SetParameter("ProxyFactor", "Off")
+    if not parameterNode.GetParameter("SyncTimestamps"):
+      parameterNode.SetParameter("SyncTimestamps", "False")
+    if not parameterNode.GetParameter("FilterPoses"):
+      parameterNode.SetParameter("FilterPoses", "False")
+    if not parameterNode.GetParameter("FilterWindow"):
+      parameterNode.SetParameter("FilterWindow", "5")
+    if not parameterNode.GetParameter("MaxTranslationStep"):
+      parameterNode.SetParameter("MaxTranslationStep", "5.0")
+    if not parameterNode.GetParameter("MaxRotationStep"):
+      parameterNode.SetParameter("MaxRotationStep", "5.0")
     if not parameterNode.GetNodeReference("SequenceBroswerNode_trackedUS"):
       sequenceBrowserNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceBrowserNode", "SequenceBroswerNode_trackedUS")
       parameterNode.SetNodeReferenceID("SequenceBroswerNode_trackedUS", sequenceBrowserNode.GetID())
@@ -1008,66 +2044,1129 @@ class ReadSequentialDataLogic(ScriptedLoadableModuleLogic):
   #
     # Objective: read meta information from the US image with a specific depth
     #
-  def ReadMetaInfoFromDepthSetting(self, depth):
-    ROILeft = 0
-    ROITop = 0
-    ROIWidth = 0
-    ROIHeight = 0
-    imageSpacing = np.array([0, 0, 0], dtype='f')
-    if depth == 18:
-        imageSpacing[0:3] = [0.319, 0.319, 1]
-        ROILeft = 80
-        ROITop = 120
-        ROIWidth = 752
-        ROIHeight = 564
-    elif depth == 16:
-        imageSpacing[0:3] = [0.286, 0.286, 1]
-        ROILeft = 80
-        ROITop = 123
-        ROIWidth = 752
-        ROIHeight = 560
-    elif depth == 14:
-        imageSpacing[0:3] = [0.251, 0.251, 1]
-        ROILeft = 79
-        ROITop = 127
-        ROIWidth = 752
-        ROIHeight = 558
-    elif depth == 12:
-        imageSpacing[0:3] = [0.218, 0.218, 1]
-        ROILeft = 74
-        ROITop = 132
-        ROIWidth = 752
-        ROIHeight = 550
-    elif depth == 11:
-        imageSpacing[0:3] = [0.200, 0.200, 1]
-        ROILeft = 71
-        ROITop = 135
-        ROIWidth = 752
-        ROIHeight = 550
-    elif depth == 10:
-        imageSpacing[0:3] = [0.185, 0.185, 1]
-        ROILeft = 71
-        ROITop = 140
-        ROIWidth = 752
-        ROIHeight = 542
-    elif depth == 9:
-        imageSpacing[0:3] = [0.171, 0.171, 1]
-        ROILeft = 68
-        ROITop = 153
-        ROIWidth = 752
-        ROIHeight = 526
-    elif depth == 8.1:
-        imageSpacing[0:3] = [0.160, 0.160, 1]
-        ROILeft = 71
-        ROITop = 162
-        ROIWidth = 752
-        ROIHeight = 506
+  def ReadMetaInfoFromDepthSetting(self, depth, probe=None):
+    # the presets are in Resources/Calibration/DepthCalibration.json (see DepthCalibrationRegistry)
+    calibration = self.calibrationRegistry.GetCalibration(depth, probe)
+    if calibration is None:
+      print("checking the depth of US image!")
+      return np.array([0, 0, 0], dtype='f'), np.array([0, 0, 0, 0]), 0
+    return calibration["imageSpacing"], calibration["mask"], calibration["imageHeight"]
+
+  def GetImagePixelToMMTransform(self, scalingTransformPath):
+    # T_imgPixel_imgMM (LPS, numpy 4x4) read with ReadSlicerTransfrom, cached until the file is rewritten; None if there is no such file
+    if not os.path.isfile(scalingTransformPath):
+      return None
+    cacheKey = (scalingTransformPath, os.stat(scalingTransformPath).st_mtime_ns)
+    if cacheKey not in self._scalingTransformCache:
+      self._scalingTransformCache[cacheKey] = self.ReadSlicerTransfrom(scalingTransformPath)
+    return self._scalingTransformCache[cacheKey]
+
+  def GetSliceXYZOrigin(self, depth, scalingTransformPath, probe=None):
+    ### INPUTS
+    # depth: US depth preset
+    # scalingTransformPath: T_imgPixel_imgMM.txt of the calibration
+    ### OUTPUTS
+    # RAS position (mm, homogeneous) of the center of the US image, used as the XYZ origin of the slice
+    # It is cached per preset and scaling file (invalidated when the file is rewritten).
+    cacheKey = (probe or self.calibrationRegistry.defaultProbe, self.calibrationRegistry.DepthKey(depth), scalingTransformPath, os.stat(scalingTransformPath).st_mtime_ns)
+    xyzOrigin_RAS_mm = self._sliceOriginCache.get(cacheKey)
+    if xyzOrigin_RAS_mm is None:
+      calibration = self.calibrationRegistry.GetCalibration(depth, probe)
+      if calibration is None:
+        raise ValueError(f"No calibration for the US depth {depth}")
+      T_imgPixel_imgMM_LPS = self.GetImagePixelToMMTransform(scalingTransformPath)
+      xyzOrigin_LPS_mm = np.dot(T_imgPixel_imgMM_LPS, calibration["centerPixel"])
+      xyzOrigin_RAS_mm = np.array([-xyzOrigin_LPS_mm[0], -xyzOrigin_LPS_mm[1], xyzOrigin_LPS_mm[2], 1])
+      self._sliceOriginCache[cacheKey] = xyzOrigin_RAS_mm
+    return xyzOrigin_RAS_mm
+
+  #
+    # Objective: list the sequential US images of a directory, sorted by the item index in the file name
+    #
+  def ListSequentialImageFiles(self, directory):
+    # file names look like "Image_0002.bmp", the item index is the part after the first "_"
+    items = []
+    for filename in os.listdir(directory):
+      if os.path.splitext(filename)[1].lower() not in self.US_IMAGE_EXTENSIONS:
+        continue
+      filename_ = filename.split('.')
+      itemIndex_ = filename_[0].split('_')
+      items.append((itemIndex_[1], filename))
+
+    def itemOrder(item):
+      try:
+        return (0, float(item[0]), item[0])
+      except ValueError:
+        return (1, 0.0, item[0])
+    items.sort(key=itemOrder)
+    itemIndices = [item[0] for item in items]
+    filenames = [item[1] for item in items]
+    return itemIndices, filenames
+
+  def ReadImageFrame(self, file_path):
+    ### INPUTS
+    # file_path: a single 2D image (.bmp, .png, .jpg, ...)
+    ### OUTPUTS
+    # frame: numpy array (rows, columns) or (rows, columns, components), same layout as slicer.util.arrayFromVolume
+    # ijkToRAS: vtkMatrix4x4, the same geometry that slicer.util.loadVolume assigns to the volume node
+    # Nothing is added to the scene, so this can be called from worker threads.
+    from vtk.util import numpy_support
+    reader = slicer.vtkITKArchetypeImageSeriesVectorReaderFile()
+    reader.SetArchetype(file_path)
+    reader.SetSingleFile(1)
+    reader.SetOutputScalarTypeToNative()
+    reader.SetDesiredCoordinateOrientationToNative()
+    reader.SetUseNativeOriginOn()
+    reader.Update()
+    imageData = reader.GetOutput()
+
+    ijkToRAS = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Invert(reader.GetRasToIjkMatrix(), ijkToRAS)
+
+    dims = imageData.GetDimensions()
+    scalars = imageData.GetPointData().GetScalars()
+    numberOfComponents = scalars.GetNumberOfComponents()
+    frame = numpy_support.vtk_to_numpy(scalars)
+    if numberOfComponents > 1:
+      frame = frame.reshape(dims[1], dims[0], numberOfComponents)
     else:
-        print("checking the depth of US image!")
-    
-    imageHeight = ROIHeight
-    mask = np.array([ROITop, ROITop + ROIHeight, ROILeft, ROILeft + ROIWidth])
-    return imageSpacing, mask, imageHeight
+      frame = frame.reshape(dims[1], dims[0])
+    return frame, ijkToRAS
+
+  def ReadImageFramesFromDirectory(self, directory, numberOfWorkers=None, collapseGrayscale=False):
+    ### INPUTS
+    # directory: the directory including all the sequential 2D US images
+    # numberOfWorkers: size of the decoding thread pool (default: number of cores, at most 8)
+    # collapseGrayscale: store RGB images with identical channels as single-channel frames (see ReadImageFrames)
+    ### OUTPUTS
+    # itemIndices, names: item index and node name of every frame, sorted by item index
+    # frames: numpy array (N, rows, columns) or (N, rows, columns, components) in the same order
+    # ijkToRAS: vtkMatrix4x4 of the first frame (all the frames of a sweep share the same geometry)
+    itemIndices, filenames = self.ListSequentialImageFiles(directory)
+    if not filenames:
+      raise ValueError("No US image found in " + directory)
+    paths = [os.path.join(directory, filename) for filename in filenames]
+    names = [os.path.splitext(filename)[0] for filename in filenames]
+    frames, ijkToRAS = self.ReadImageFrames(paths, numberOfWorkers, collapseGrayscale)
+    return itemIndices, names, frames, ijkToRAS
+
+  def ReadImageFrames(self, paths, numberOfWorkers=None, collapseGrayscale=False):
+    # Decode a list of 2D images with a thread pool into one preallocated (N, rows, columns[, components]) array.
+    # With collapseGrayscale, RGB images whose channels are all equal (most B-mode exports) are stored as (N, rows, columns),
+    # a third of the memory. If a truly colored frame (e.g. Doppler) shows up, the sweep falls back to RGB.
+    import concurrent.futures
+    if not numberOfWorkers:
+      numberOfWorkers = min(8, os.cpu_count() or 1)
+
+    startTime = time.time()
+    # the first frame gives the frame shape, so the whole stack can be preallocated and filled in place by the workers
+    firstFrame, ijkToRAS = self.ReadImageFrame(paths[0])
+    collapse = collapseGrayscale and self.IsGrayscaleFrame(firstFrame)
+    frameShape = firstFrame.shape[:2] if collapse else firstFrame.shape
+    frames = np.empty((len(paths),) + frameShape, dtype=firstFrame.dtype)
+    colorFrames = {}
+
+    def storeFrame(frameNumber, frame):
+      if frame.shape != firstFrame.shape:
+        raise ValueError("All the US images must have the same size: " + paths[frameNumber])
+      if not collapse:
+        frames[frameNumber] = frame
+      elif self.IsGrayscaleFrame(frame):
+        frames[frameNumber] = frame[..., 0]
+      else:
+        colorFrames[frameNumber] = frame
+
+    def decodeFrame(frameNumber):
+      frame, _ = self.ReadImageFrame(paths[frameNumber])
+      storeFrame(frameNumber, frame)
+
+    storeFrame(0, firstFrame)
+    # the ITK readers release the GIL while decoding, so a thread pool is enough (no process spawning in Slicer)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=numberOfWorkers) as executor:
+      list(executor.map(decodeFrame, range(1, len(paths))))
+
+    if colorFrames:
+      logging.info(f'{len(colorFrames)} colored US images found, keeping all the frames in RGB')
+      rgbFrames = np.repeat(frames[..., np.newaxis], firstFrame.shape[2], axis=3)
+      for frameNumber, frame in colorFrames.items():
+        rgbFrames[frameNumber] = frame
+      frames = rgbFrames
+    logging.info(f'Decoded {len(frames)} US images with {numberOfWorkers} workers in {time.time()-startTime:.2f} seconds')
+    return frames, ijkToRAS
+
+  def ImportUSSequence(self, directory, sequenceNode, flip=False, numberOfWorkers=None, useCache=False, cacheDirectory=None,
+                       collapseGrayscale=False, cropMask=None, proxySequenceNode=None, proxyFactor=2):
+    """
+    Decode the US images of a directory in parallel and store them in the sequence node in index order.
+    Can be used without GUI widget.
+    :param directory: directory including all the sequential 2D US images
+    :param sequenceNode: output vtkMRMLSequenceNode
+    :param flip: mirror the images along the x axis (same as the "Flip" check box)
+    :param numberOfWorkers: size of the decoding thread pool
+    :param useCache: memory-map the raw frame stack cached by a previous import (written on the first import)
+    :param cacheDirectory: where the frame stack cache is stored (default: a sub-folder of the image directory)
+    :param collapseGrayscale: store RGB images with identical channels as single-channel frames
+    :param cropMask: fan ROI [top, bottom, left, right] in pixels (see ReadMetaInfoFromDepthSetting), None to keep the full frames
+    :param proxySequenceNode: if set, filled with a downsampled copy of the sweep (same item indices) for fast scrubbing
+    :param proxyFactor: downsampling factor of the proxy sequence
+    """
+    if not sequenceNode:
+      raise ValueError("Output sequence node is invalid")
+
+    if useCache:
+      itemIndices, names, frames, ijkToRAS = self.ReadImageFramesCached(directory, numberOfWorkers, cacheDirectory, collapseGrayscale)
+    else:
+      itemIndices, names, frames, ijkToRAS = self.ReadImageFramesFromDirectory(directory, numberOfWorkers, collapseGrayscale)
+
+    if flip:
+      # all the frames share the same geometry, so the flip is folded into the IJK to RAS matrix once
+      ijkToRAS = self.FlipIJKToRAS(ijkToRAS, frames.shape[2])
+    if cropMask is not None:
+      frames, ijkToRAS = self.CropFrames(frames, ijkToRAS, cropMask)
+
+    self.FillSequenceFromArray(sequenceNode, frames, ijkToRAS, itemIndices, names)
+    if proxySequenceNode:
+      # the proxy is derived data, rebuild it from scratch
+      proxySequenceNode.RemoveAllDataNodes()
+      proxyFrames, proxyIJKToRAS = self.DownsampleFrames(frames, ijkToRAS, proxyFactor)
+      self.FillSequenceFromArray(proxySequenceNode, proxyFrames, proxyIJKToRAS, itemIndices, names)
+
+  def DownsampleFrames(self, frames, ijkToRAS, factor, chunkSize=64):
+    ### INPUTS
+    # frames: numpy array (N, rows, columns[, components])
+    # ijkToRAS: vtkMatrix4x4 of the frames
+    # factor: integer downsampling factor along rows and columns
+    ### OUTPUTS
+    # block-averaged frames (N, rows/factor, columns/factor[, components]) and the matching IJK to RAS matrix
+    # (spacing multiplied by the factor, origin moved to the center of the first block)
+    numberOfFrames, rows, columns = frames.shape[:3]
+    proxyRows, proxyColumns = rows // factor, columns // factor
+    componentShape = frames.shape[3:]
+    proxyFrames = np.empty((numberOfFrames, proxyRows, proxyColumns) + componentShape, dtype=frames.dtype)
+    # a few frames at a time, so that the float accumulation buffer stays small
+    for start in range(0, numberOfFrames, chunkSize):
+      chunk = frames[start:start+chunkSize, :proxyRows*factor, :proxyColumns*factor]
+      blocks = chunk.reshape((chunk.shape[0], proxyRows, factor, proxyColumns, factor) + componentShape)
+      blockMean = blocks.mean(axis=(2, 4), dtype=np.float32)
+      if np.issubdtype(frames.dtype, np.integer):
+        np.rint(blockMean, out=blockMean)
+      proxyFrames[start:start+chunkSize] = blockMean
+
+    scale_blocks = vtk.vtkMatrix4x4()
+    for axis in range(2):
+      scale_blocks.SetElement(axis, axis, factor)
+      scale_blocks.SetElement(axis, 3, (factor - 1) * 0.5)
+    proxyIJKToRAS = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Multiply4x4(ijkToRAS, scale_blocks, proxyIJKToRAS)
+    return proxyFrames, proxyIJKToRAS
+
+  def CropFrames(self, frames, ijkToRAS, cropMask):
+    ### INPUTS
+    # frames: numpy array (N, rows, columns[, components])
+    # ijkToRAS: vtkMatrix4x4 of the full frames
+    # cropMask: [top, bottom, left, right] in pixels, as returned by ReadMetaInfoFromDepthSetting
+    ### OUTPUTS
+    # the cropped frames (a view, no copy) and the IJK to RAS matrix with the origin moved to the ROI corner,
+    # so that every kept pixel stays at the same RAS position
+    top, bottom, left, right = [int(value) for value in cropMask]
+    rows, columns = frames.shape[1], frames.shape[2]
+    if top < 0 or left < 0 or bottom > rows or right > columns or top >= bottom or left >= right:
+      raise ValueError(f"ROI {list(cropMask)} does not fit in the {columns}x{rows} US images, check the depth setting")
+    croppedFrames = frames[:, top:bottom, left:right]
+
+    translate_roi = vtk.vtkMatrix4x4()
+    translate_roi.SetElement(0, 3, left)
+    translate_roi.SetElement(1, 3, top)
+    ijkToRAS_cropped = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Multiply4x4(ijkToRAS, translate_roi, ijkToRAS_cropped)
+    return croppedFrames, ijkToRAS_cropped
+
+  #
+    # Objective: list the sequential transforms of a directory, sorted by the item index in the file name
+    #
+  def ListSequentialTransformFiles(self, directory):
+    # the item index is the last "_" separated part of the file name (e.g. "Transform_0002.tfm" -> "0002")
+    items = []
+    for filename in os.listdir(directory):
+      if not os.path.isfile(os.path.join(directory, filename)):
+        continue
+      filename_ = filename.split('.')
+      itemIndex_ = filename_[0].split('_')
+      items.append((itemIndex_[len(itemIndex_)-1], filename))
+
+    def itemOrder(item):
+      try:
+        return (0, float(item[0]), item[0])
+      except ValueError:
+        return (1, 0.0, item[0])
+    items.sort(key=itemOrder)
+    return [item[0] for item in items], [item[1] for item in items]
+
+  def ResetFollowManifests(self):
+    self.followManifests = {}
+
+  def GetNewFilesToIngest(self, stream, directory, itemIndices, filenames, sequenceNode):
+    ### Follow mode
+    # The manifest of a (stream, directory) pair keeps the files that are already in the sequence node.
+    # It is seeded from the index values already stored in the sequence node, so a previous full import is not loaded twice.
+    # A new file is only returned once its size did not change between two polls (it may still be written).
+    manifest = self.followManifests.get((stream, directory))
+    if manifest is None:
+      existingIndices = set(sequenceNode.GetNthIndexValue(itemNumber) for itemNumber in range(sequenceNode.GetNumberOfDataNodes()))
+      ingested = set(filename for itemIndex, filename in zip(itemIndices, filenames) if itemIndex in existingIndices)
+      manifest = {"ingested": ingested, "sizes": {}}
+      self.followManifests[(stream, directory)] = manifest
+
+    newItems = []
+    for itemIndex, filename in zip(itemIndices, filenames):
+      if filename in manifest["ingested"]:
+        continue
+      size = os.path.getsize(os.path.join(directory, filename))
+      if manifest["sizes"].get(filename) == size:
+        newItems.append((itemIndex, filename))
+      else:
+        manifest["sizes"][filename] = size
+    return newItems
+
+  def MarkFilesIngested(self, stream, directory, filenames):
+    manifest = self.followManifests[(stream, directory)]
+    for filename in filenames:
+      manifest["ingested"].add(filename)
+      manifest["sizes"].pop(filename, None)
+
+  def FollowUSSequence(self, directory, sequenceNode, flip=False, numberOfWorkers=None, collapseGrayscale=False, cropMask=None,
+                       proxySequenceNode=None, proxyFactor=2):
+    """
+    Append the US images written since the previous call to the sequence node (live acquisition).
+    Only the new images are decoded, so the cost is proportional to the new data. If the sequence node is the one of a
+    lazy import (ImportUSSequenceLazy), nothing is decoded: 1x1 placeholders are appended and the new images are added
+    to the LazyFrameLoader, which decodes them when they are browsed.
+    :param collapseGrayscale: only used while the sequence is empty; the new frames of a non-empty sequence are converted
+      to the number of scalar components of its items, so that a sequence never mixes single-channel and RGB frames
+    :return: number of appended frames
+    """
+    itemIndices, filenames = self.ListSequentialImageFiles(directory)
+    newItems = self.GetNewFilesToIngest("US", directory, itemIndices, filenames, sequenceNode)
+    if not newItems:
+      return 0
+    newIndices = [itemIndex for itemIndex, _ in newItems]
+    newFilenames = [filename for _, filename in newItems]
+    newNames = [os.path.splitext(filename)[0] for filename in newFilenames]
+    if self.lazyFrameLoader and sequenceNode is self.lazySequenceNode:
+      # same placeholders and geometry (flip and crop included) as the items of the lazy import
+      placeholderNode = sequenceNode.GetNthDataNode(0)
+      ijkToRAS = vtk.vtkMatrix4x4()
+      placeholderNode.GetIJKToRASMatrix(ijkToRAS)
+      placeholders = np.zeros((len(newItems), 1, 1), dtype=slicer.util.arrayFromVolume(placeholderNode).dtype)
+      self.FillSequenceFromArray(sequenceNode, placeholders, ijkToRAS, newIndices, newNames)
+      self.lazyFrameLoader.AppendPaths([os.path.join(directory, filename) for filename in newFilenames])
+      self.MarkFilesIngested("US", directory, newFilenames)
+      return len(newItems)
+    numberOfComponents = None
+    if sequenceNode.GetNumberOfDataNodes() > 0:
+      numberOfComponents = sequenceNode.GetNthDataNode(0).GetImageData().GetNumberOfScalarComponents()
+      collapseGrayscale = numberOfComponents == 1
+    frames, ijkToRAS = self.ReadImageFrames([os.path.join(directory, filename) for filename in newFilenames], numberOfWorkers, collapseGrayscale)
+    if numberOfComponents is not None:
+      frames = self.ConvertFramesToComponents(frames, numberOfComponents)
+    if flip:
+      ijkToRAS = self.FlipIJKToRAS(ijkToRAS, frames.shape[2])
+    if cropMask is not None:
+      frames, ijkToRAS = self.CropFrames(frames, ijkToRAS, cropMask)
+    self.FillSequenceFromArray(sequenceNode, frames, ijkToRAS, newIndices, newNames)
+    if proxySequenceNode:
+      proxyFrames, proxyIJKToRAS = self.DownsampleFrames(frames, ijkToRAS, proxyFactor)
+      self.FillSequenceFromArray(proxySequenceNode, proxyFrames, proxyIJKToRAS, newIndices, newNames)
+    self.MarkFilesIngested("US", directory, newFilenames)
+    return len(newItems)
+
+  def FollowTransformSequence(self, directory, sequenceNode):
+    """
+    Append the transforms written since the previous call to the sequence node (live acquisition).
+    :return: number of appended transforms
+    """
+    itemIndices, filenames = self.ListSequentialTransformFiles(directory)
+    newItems = self.GetNewFilesToIngest("Trans", directory, itemIndices, filenames, sequenceNode)
+    if not newItems:
+      return 0
+    slicer.mrmlScene.StartState(slicer.vtkMRMLScene.BatchProcessState)
+    wasModified = sequenceNode.StartModify()
+    try:
+      self.FillTransformSequenceFromFiles(sequenceNode, directory, [itemIndex for itemIndex, _ in newItems], [filename for _, filename in newItems])
+    finally:
+      sequenceNode.EndModify(wasModified)
+      slicer.mrmlScene.EndState(slicer.vtkMRMLScene.BatchProcessState)
+    self.MarkFilesIngested("Trans", directory, [filename for _, filename in newItems])
+    return len(newItems)
+
+  # ITK transform types whose 12 parameters are the 3x3 matrix (row-major) followed by the translation
+  ITK_AFFINE_TRANSFORM_TYPES = ("AffineTransform_double_3_3", "AffineTransform_float_3_3",
+                                "MatrixOffsetTransformBase_double_3_3", "MatrixOffsetTransformBase_float_3_3")
+
+  def ParseITKAffineTransformFile(self, file_path):
+    ### INPUTS
+    # file_path: ITK text transform file (.tfm/.txt), with one or more transforms
+    ### OUTPUTS
+    # list of (12 Parameters, 3 FixedParameters (center of rotation)) per transform of the file,
+    # None if the file is not made of ITK affine transforms only (e.g. .h5 or non-linear transforms)
+    if os.path.splitext(file_path)[1].lower() not in (".tfm", ".txt"):
+      return None
+    transforms = []
+    try:
+      with open(file_path, "r") as f:
+        for line in f:
+          # the values are whitespace separated ("Parameters:  1 0 0 ..." is written by ConvertToSlicerTransform)
+          fields = line.split()
+          if not fields:
+            continue
+          if fields[0] == "Transform:":
+            if len(fields) < 2 or fields[1] not in self.ITK_AFFINE_TRANSFORM_TYPES:
+              return None
+            transforms.append([None, [0.0, 0.0, 0.0]])
+          elif fields[0] == "Parameters:" and transforms:
+            transforms[-1][0] = [float(value) for value in fields[1:]]
+          elif fields[0] == "FixedParameters:" and transforms:
+            transforms[-1][1] = [float(value) for value in fields[1:]]
+    except (OSError, UnicodeDecodeError, ValueError):
+      return None
+    for parameters, fixedParameters in transforms:
+      if parameters is None or len(parameters) != 12 or len(fixedParameters) != 3:
+        return None
+    return [(parameters, fixedParameters) for parameters, fixedParameters in transforms]
+
+  def ReadITKAffineTransformParameters(self, file_path):
+    # Parameters and FixedParameters of a file with a single ITK affine transform, None otherwise
+    transforms = self.ParseITKAffineTransformFile(file_path)
+    if not transforms or len(transforms) != 1:
+      return None
+    return transforms[0]
+
+  def ITKAffineParametersToMatrices(self, parameters, centers):
+    # (N, 12) Parameters and (N, 3) centers to the (N, 4, 4) matrices stored in the files (from parent, LPS): y = A (x - c) + c + t
+    parameters = np.asarray(parameters, dtype=np.float64)
+    centers = np.asarray(centers, dtype=np.float64)
+    matrices = np.zeros((parameters.shape[0], 4, 4))
+    matrices[:, :3, :3] = parameters[:, :9].reshape(-1, 3, 3)
+    matrices[:, :3, 3] = parameters[:, 9:] + centers - np.einsum('nij,nj->ni', matrices[:, :3, :3], centers)
+    matrices[:, 3, 3] = 1.0
+    return matrices
+
+  def LPSToRASTransforms(self, transforms_LPS):
+    # transforms to parent in LPS to transforms to parent in RAS:
+    # C M C with C = diag(-1, -1, 1, 1), which is a sign change of rows and columns
+    lpsToRAS = np.array([-1.0, -1.0, 1.0, 1.0])
+    return np.asarray(transforms_LPS) * lpsToRAS[:, np.newaxis] * lpsToRAS[np.newaxis, :]
+
+  def ITKFileMatricesToRAS(self, matrices_LPS):
+    # from parent in LPS (ITK file) to the transforms to parent in RAS (what slicer.util.loadTransform would load): C inv(M) C
+    return self.LPSToRASTransforms(np.linalg.inv(matrices_LPS))
+
+  def ReadTransformFiles(self, paths):
+    ### INPUTS
+    # paths: list of ITK transform files
+    ### OUTPUTS
+    # (N, 4, 4) array of the transforms to parent in RAS (what slicer.util.loadTransform would load)
+    # and the list of positions of the files that could not be parsed (their matrix is left as identity)
+    numberOfTransforms = len(paths)
+    parameters = np.zeros((numberOfTransforms, 12))
+    centers = np.zeros((numberOfTransforms, 3))
+    parameters[:, [0, 4, 8]] = 1.0
+    failed = []
+    for fileNumber, path in enumerate(paths):
+      fileParameters = self.ReadITKAffineTransformParameters(path)
+      if fileParameters is None:
+        failed.append(fileNumber)
+        continue
+      parameters[fileNumber], centers[fileNumber] = fileParameters
+    return self.ITKFileMatricesToRAS(self.ITKAffineParametersToMatrices(parameters, centers)), failed
+
+  def ReadMultiTransformFile(self, file_path, convertToRAS=True):
+    ### INPUTS
+    # file_path: ITK text transform file with one or more affine transforms (e.g. written by ConvertToSlicerTransforms)
+    # convertToRAS: if False, the matrices are returned as stored in the file (from parent, LPS)
+    ### OUTPUTS
+    # (N, 4, 4) array of transforms, in file order
+    transforms = self.ParseITKAffineTransformFile(file_path)
+    if not transforms:
+      raise ValueError(f"{file_path} is not an ITK affine transform file")
+    matrices_LPS = self.ITKAffineParametersToMatrices([parameters for parameters, _ in transforms], [center for _, center in transforms])
+    return self.ITKFileMatricesToRAS(matrices_LPS) if convertToRAS else matrices_LPS
+
+  def ConvertToSlicerTransforms(self, transformations_LPS, outputPaths=None, outputPath=None, numberOfWorkers=None):
+    """
+    Batch version of ConvertToSlicerTransform: all the transformations are inverted at once and written either
+    as one ITK file per transformation (outputPaths, written by a pool of threads) or as a single multi-transform
+    ITK file (outputPath). The values are written with the shortest exact representation (repr), so reading the
+    files back (ReadMultiTransformFile(convertToRAS=False) or ParseITKAffineTransformFile) gives exactly np.linalg.inv(transformations_LPS).
+    :param transformations_LPS: numpy array (N, 4, 4) or (4, 4)
+    :param outputPaths: N output files
+    :param outputPath: single output file with N transforms
+    :param numberOfWorkers: number of writer threads (default: CPU count, at most 8)
+    """
+    import concurrent.futures
+    transformations_LPS = np.asarray(transformations_LPS, dtype=np.float64).reshape(-1, 4, 4)
+    if (outputPaths is None) == (outputPath is None):
+      raise ValueError("Either outputPaths or outputPath must be given")
+    if outputPaths is not None and len(outputPaths) != transformations_LPS.shape[0]:
+      raise ValueError("Number of output paths does not match the number of transformations")
+    transformations_LPS_inv = np.linalg.inv(transformations_LPS)
+    parameters = np.concatenate([transformations_LPS_inv[:, :3, :3].reshape(-1, 9), transformations_LPS_inv[:, :3, 3]], axis=1)
+    parameterLines = [" ".join(map(repr, row)) for row in parameters.tolist()]
+
+    def transformCell(transformNumber, parameterLine):
+      return f'#Transform {transformNumber}\nTransform: AffineTransform_double_3_3\nParameters: {parameterLine}\nFixedParameters: 0 0 0\n'
+
+    if outputPath is not None:
+      with open(outputPath, "w") as f:
+        f.write('#Insight Transform File V1.0\n')
+        f.writelines(transformCell(transformNumber, parameterLine) for transformNumber, parameterLine in enumerate(parameterLines))
+      return
+
+    def writeTransform(pathAndLine):
+      with open(pathAndLine[0], "w") as f:
+        f.write('#Insight Transform File V1.0\n' + transformCell(0, pathAndLine[1]))
+
+    if numberOfWorkers is None:
+      numberOfWorkers = min(8, os.cpu_count() or 1)
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, numberOfWorkers)) as executor:
+      list(executor.map(writeTransform, zip(outputPaths, parameterLines)))
+
+  def FillTransformSequenceFromFiles(self, sequenceNode, directory, itemIndices, filenames):
+    # Parse all the files at once, store the matrices through a single scratch transform node,
+    # and load the files that could not be parsed with slicer.util.loadTransform
+    paths = [os.path.join(directory, filename) for filename in filenames]
+    transforms, failed = self.ReadTransformFiles(paths)
+    failed = set(failed)
+    parsed = [fileNumber for fileNumber in range(len(paths)) if fileNumber not in failed]
+    self.FillTransformSequenceFromArray(sequenceNode, transforms[parsed], [itemIndices[fileNumber] for fileNumber in parsed],
+      [os.path.splitext(filenames[fileNumber])[0] for fileNumber in parsed])
+    for fileNumber in sorted(failed):
+      loadedTransformNode = slicer.util.loadTransform(paths[fileNumber])
+      sequenceNode.SetDataNodeAtValue(loadedTransformNode, itemIndices[fileNumber])
+      slicer.mrmlScene.RemoveNode(loadedTransformNode)
+    if failed:
+      logging.info(f'{len(failed)} transform files were loaded with slicer.util.loadTransform')
+
+  def ImportTransformSequence(self, directory, sequenceNode):
+    """
+    Load all the transform files of a directory into a sequence node.
+    The item index is the last "_" separated part of the file name (as for the legacy loading).
+    :param directory: folder of the transform files
+    :param sequenceNode: output vtkMRMLSequenceNode
+    """
+    if not sequenceNode:
+      raise ValueError("Output sequence node is invalid")
+    startTime = time.time()
+    itemIndices, filenames = self.ListSequentialTransformFiles(directory)
+    slicer.mrmlScene.StartState(slicer.vtkMRMLScene.BatchProcessState)
+    wasModified = sequenceNode.StartModify()
+    try:
+      self.FillTransformSequenceFromFiles(sequenceNode, directory, itemIndices, filenames)
+    finally:
+      sequenceNode.EndModify(wasModified)
+      slicer.mrmlScene.EndState(slicer.vtkMRMLScene.BatchProcessState)
+    logging.info(f'Imported {len(filenames)} transforms in {time.time()-startTime:.2f} seconds')
+
+  def ImportTransformStream(self, file_path, sequenceNode, transformName="ImageToReferenceTransform", coordinateSystem="LPS"):
+    """
+    Load the poses of a sweep stored in one file into a sequence node.
+    The poses of the file are image to reference transforms (transforms to parent); by default they are in LPS like the
+    tracker poses of the ITK transform files, and they are converted to RAS so that both give the same sequence items.
+    :param file_path: .csv, .npz or PLUS sequence metafile (.mha/.mhd), see ReadPoseStream
+    :param sequenceNode: output vtkMRMLSequenceNode
+    :param transformName: transform field of the sequence metafile
+    :param coordinateSystem: "LPS" (default) or "RAS" (the poses are stored as they are)
+    """
+    if not sequenceNode:
+      raise ValueError("Output sequence node is invalid")
+    startTime = time.time()
+    itemIndices, timestamps, transforms = self.ReadPoseStream(file_path, transformName, coordinateSystem)
+    self.FillTransformSequenceFromArray(sequenceNode, transforms, itemIndices)
+    logging.info(f'Imported {len(itemIndices)} transforms from {file_path} in {time.time()-startTime:.2f} seconds')
+
+  def ReadPoseStream(self, file_path, transformName="ImageToReferenceTransform", coordinateSystem="LPS"):
+    ### INPUTS
+    # file_path: pose file of a whole sweep
+    #   .csv: one row per frame: frame index, timestamp, then the first 3 rows of the 4x4 matrix (row-major); a header row is skipped
+    #   .npz: "transforms" (N, 4, 4), (N, 3, 4), (N, 16) or (N, 12), optional "indices" and "timestamps"
+    #   .mha/.mhd: PLUS sequence metafile, Seq_FrameNNNN_<transformName> (16 values) fields of the header, frames with a status other than OK are skipped
+    # transformName: transform field of the sequence metafile
+    # coordinateSystem: "LPS" if the poses of the file are image to reference transforms in LPS, as the tracker poses that
+    #   ConvertToSlicerTransforms writes to the ITK files (converted with C M C, which gives the same RAS matrix as reading
+    #   the ITK file of the pose); "RAS" if they are already Slicer transforms to parent
+    ### OUTPUTS
+    # item indices (list of str), timestamps (numpy array, None if the file has none), transforms to parent in RAS (N, 4, 4)
+    if coordinateSystem not in ("LPS", "RAS"):
+      raise ValueError(f"Unknown coordinate system of the poses: {coordinateSystem}")
+    extension = os.path.splitext(file_path)[1].lower()
+    if extension == ".csv":
+      itemIndices, timestamps, transforms = self.ReadPoseStreamCSV(file_path)
+    elif extension == ".npz":
+      itemIndices, timestamps, transforms = self.ReadPoseStreamNPZ(file_path)
+    elif extension in (".mha", ".mhd"):
+      itemIndices, timestamps, transforms = self.ReadPoseStreamMetafile(file_path, transformName)
+    else:
+      raise ValueError(f"Unsupported pose file format: {file_path}")
+    if coordinateSystem == "LPS":
+      transforms = self.LPSToRASTransforms(transforms)
+    return itemIndices, timestamps, transforms
+
+  VALID_FRAMES_ATTRIBUTE = "ReadSequentialData.ValidFrames"
+
+  def FilterTransformSequence(self, sequenceNode, outputSequenceNode, smoothingWindow=5, maxTranslationStep=5.0, maxRotationStep=5.0):
+    """
+    Write the smoothed poses of a transform sequence to outputSequenceNode (same item indices and names, previous items
+    are removed) and store the per-frame validity mask as its VALID_FRAMES_ATTRIBUTE attribute (see FilterPoses and
+    GetValidFrameMask). The input sequence keeps the raw tracking, so filtering again starts from the raw poses.
+    :return: validity mask (numpy bool array, one value per sequence item)
+    """
+    if not outputSequenceNode or outputSequenceNode is sequenceNode:
+      raise ValueError("The filtered poses need an output sequence node other than the input one")
+    numberOfItems = sequenceNode.GetNumberOfDataNodes()
+    outputSequenceNode.RemoveAllDataNodes()
+    outputSequenceNode.SetIndexName(sequenceNode.GetIndexName())
+    outputSequenceNode.SetIndexUnit(sequenceNode.GetIndexUnit())
+    outputSequenceNode.SetIndexType(sequenceNode.GetIndexType())
+    if numberOfItems == 0:
+      outputSequenceNode.RemoveAttribute(self.VALID_FRAMES_ATTRIBUTE)
+      return np.zeros(0, dtype=bool)
+    transforms = self.GetTransformSequenceArray(sequenceNode)
+    filteredTransforms, validFrames = self.FilterPoses(transforms, smoothingWindow, maxTranslationStep, maxRotationStep)
+    itemIndices = [sequenceNode.GetNthIndexValue(itemNumber) for itemNumber in range(numberOfItems)]
+    names = [sequenceNode.GetNthDataNode(itemNumber).GetName() for itemNumber in range(numberOfItems)]
+    self.FillTransformSequenceFromArray(outputSequenceNode, filteredTransforms, itemIndices, names)
+    outputSequenceNode.SetAttribute(self.VALID_FRAMES_ATTRIBUTE, "".join("1" if valid else "0" for valid in validFrames))
+    logging.info(f'Pose filter: {numberOfItems - np.count_nonzero(validFrames)} of {numberOfItems} frames flagged as invalid')
+    return validFrames
+
+  def GetTransformSequenceArray(self, sequenceNode, toWorld=False):
+    # matrices of all the items of a transform sequence as a numpy (N, 4, 4) array (to parent, or to world if toWorld)
+    transforms = np.zeros((sequenceNode.GetNumberOfDataNodes(), 4, 4))
+    matrix = vtk.vtkMatrix4x4()
+    for itemNumber in range(len(transforms)):
+      if toWorld:
+        sequenceNode.GetNthDataNode(itemNumber).GetMatrixTransformToWorld(matrix)
+      else:
+        sequenceNode.GetNthDataNode(itemNumber).GetMatrixTransformToParent(matrix)
+      transforms[itemNumber] = slicer.util.arrayFromVTKMatrix(matrix)
+    return transforms
+
+  def GetValidFrameMask(self, sequenceNode):
+    # validity mask stored by FilterTransformSequence, None if the sequence was not filtered (all frames are valid)
+    mask = sequenceNode.GetAttribute(self.VALID_FRAMES_ATTRIBUTE) if sequenceNode else None
+    if not mask or len(mask) != sequenceNode.GetNumberOfDataNodes():
+      return None
+    return np.array([value == "1" for value in mask])
+
+  def FilterPoses(self, transforms, smoothingWindow=5, maxTranslationStep=5.0, maxRotationStep=5.0):
+    ### INPUTS
+    # transforms: (N, 4, 4) poses in acquisition order
+    # smoothingWindow: number of frames of the moving average (1: no smoothing), an even window is made odd (+1)
+    # so that the average is centered on the frame
+    # maxTranslationStep: largest plausible translation between two consecutive frames (mm)
+    # maxRotationStep: largest plausible rotation between two consecutive frames (degrees)
+    ### OUTPUTS
+    # smoothed (N, 4, 4) poses and validity mask (N,)
+    # A frame is invalid if its matrix is not finite/degenerate (tracking dropout), or if it jumps away from
+    # both its neighbours further than the thresholds (spike). Invalid frames do not contribute to the smoothing,
+    # their pose is replaced by the average of the valid frames around them.
+    transforms = np.asarray(transforms, dtype=np.float64)
+    numberOfFrames = transforms.shape[0]
+    scales = np.linalg.norm(transforms[:, :3, :3], axis=1)
+    valid = np.all(np.isfinite(transforms.reshape(numberOfFrames, -1)), axis=1) & np.all(scales > 1e-9, axis=1)
+    # the dropouts must not spread into the moving average of their neighbours
+    scales = np.where(valid[:, np.newaxis], scales, 1.0)
+    rotations = np.where(valid[:, np.newaxis, np.newaxis], transforms[:, :3, :3] / np.where(scales > 1e-9, scales, 1.0)[:, np.newaxis, :], np.eye(3))
+    translations = np.where(valid[:, np.newaxis], transforms[:, :3, 3], 0.0)
+
+    # frame to frame steps (step k is between frame k and k+1)
+    translationSteps = np.linalg.norm(np.diff(translations, axis=0), axis=1)
+    relativeTrace = np.einsum('nji,nji->n', rotations[:-1], rotations[1:])
+    rotationSteps = np.degrees(np.arccos(np.clip((relativeTrace - 1) * 0.5, -1.0, 1.0)))
+    jumps = (translationSteps > maxTranslationStep) | (rotationSteps > maxRotationStep)
+    jumps |= ~valid[:-1] | ~valid[1:]
+    # a spike jumps in and out; the first (last) frame is a spike if it jumps to a steady pair of frames
+    spikes = np.zeros(numberOfFrames, dtype=bool)
+    if numberOfFrames >= 3:
+      spikes[1:-1] = jumps[:-1] & jumps[1:]
+      spikes[0] = jumps[0] and not jumps[1]
+      spikes[-1] = jumps[-1] and not jumps[-2]
+    valid &= ~spikes
+
+    if not np.any(valid):
+      return transforms.copy(), valid
+
+    # moving average of the valid frames; the quaternions are sign-aligned with their predecessor first
+    quaternions = self.RotationMatricesToQuaternions(rotations)
+    signs = np.concatenate([[1.0], np.where(np.sum(quaternions[1:] * quaternions[:-1], axis=1) < 0, -1.0, 1.0)])
+    quaternions *= np.cumprod(signs)[:, np.newaxis]
+    kernel = np.ones(max(1, int(smoothingWindow)) | 1)
+    weights = valid.astype(np.float64)
+    weightSums = np.convolve(weights, kernel, mode='same')
+    # frames without valid neighbours in the window keep the nearest valid pose
+    noNeighbours = weightSums == 0
+    def movingAverage(values):
+      smoothed = np.stack([np.convolve(values[:, column] * weights, kernel, mode='same') for column in range(values.shape[1])], axis=1)
+      return smoothed / np.where(noNeighbours, 1.0, weightSums)[:, np.newaxis]
+    smoothedTranslations = movingAverage(translations)
+    smoothedQuaternions = movingAverage(quaternions)
+    smoothedScales = movingAverage(scales)
+    if np.any(noNeighbours):
+      validNumbers = np.flatnonzero(valid)
+      nearest = validNumbers[np.clip(np.searchsorted(validNumbers, np.flatnonzero(noNeighbours)), 0, len(validNumbers) - 1)]
+      smoothedTranslations[noNeighbours] = translations[nearest]
+      smoothedQuaternions[noNeighbours] = quaternions[nearest]
+      smoothedScales[noNeighbours] = scales[nearest]
+    smoothedQuaternions /= np.linalg.norm(smoothedQuaternions, axis=1)[:, np.newaxis]
+
+    filtered = np.zeros_like(transforms)
+    filtered[:, :3, :3] = self.QuaternionsToRotationMatrices(smoothedQuaternions) * smoothedScales[:, np.newaxis, :]
+    filtered[:, :3, 3] = smoothedTranslations
+    filtered[:, 3, 3] = 1.0
+    return filtered, valid
+
+  def ImportSynchronizedTransformStream(self, poseFile, imageTimestampFile, sequenceNode, transformName="ImageToReferenceTransform",
+                                        coordinateSystem="LPS"):
+    """
+    Fill the transform sequence with the pose at the acquisition time of every US frame.
+    The tracker and the scanner do not need to run at the same rate: the poses are interpolated
+    (SLERP for the rotation, linear for the translation and scaling) at the image timestamps.
+    :param poseFile: pose file with timestamps (see ReadPoseStream)
+    :param imageTimestampFile: CSV of the US frames (item index, timestamp), see ReadFrameTimestamps
+    :param sequenceNode: output vtkMRMLSequenceNode, its item indices are the ones of the US frames
+    :param coordinateSystem: coordinate system of the poses, see ReadPoseStream
+    """
+    if not sequenceNode:
+      raise ValueError("Output sequence node is invalid")
+    startTime = time.time()
+    _, poseTimestamps, transforms = self.ReadPoseStream(poseFile, transformName, coordinateSystem)
+    if poseTimestamps is None:
+      raise ValueError(f"{poseFile} has no timestamps, the poses cannot be synchronized")
+    imageIndices, imageTimestamps = self.ReadFrameTimestamps(imageTimestampFile)
+    synchronizedTransforms = self.InterpolatePoses(poseTimestamps, transforms, imageTimestamps)
+    self.FillTransformSequenceFromArray(sequenceNode, synchronizedTransforms, imageIndices)
+    logging.info(f'Synchronized {len(imageIndices)} frames with {len(poseTimestamps)} poses in {time.time()-startTime:.2f} seconds')
+
+  def ReadFrameTimestamps(self, file_path):
+    ### INPUTS
+    # file_path: CSV file, one row per US frame: item index, timestamp (a header row is skipped)
+    ### OUTPUTS
+    # item indices (list of str) and timestamps (numpy array)
+    itemIndices = []
+    timestamps = []
+    with open(file_path, "r") as f:
+      for lineNumber, line in enumerate(f):
+        fields = [field.strip() for field in line.split(',')]
+        if not fields[0] or fields[0].startswith('#'):
+          continue
+        try:
+          timestamp = float(fields[1])
+        except (IndexError, ValueError):
+          if lineNumber == 0:
+            continue  # header
+          raise ValueError(f"Invalid timestamp at line {lineNumber+1} of {file_path}")
+        itemIndices.append(fields[0])
+        timestamps.append(timestamp)
+    return itemIndices, np.array(timestamps)
+
+  def InterpolatePoses(self, poseTimestamps, transforms, queryTimestamps):
+    ### INPUTS
+    # poseTimestamps: (N,) acquisition times of the poses (any order)
+    # transforms: (N, 4, 4) poses (rotation and scaling, no shear)
+    # queryTimestamps: (M,) times where the poses are needed
+    ### OUTPUTS
+    # (M, 4, 4) poses; queries outside of the tracked time range get the first/last pose
+    order = np.argsort(poseTimestamps, kind='stable')
+    poseTimestamps = np.asarray(poseTimestamps, dtype=np.float64)[order]
+    transforms = np.asarray(transforms, dtype=np.float64)[order]
+    queryTimestamps = np.asarray(queryTimestamps, dtype=np.float64)
+    if len(poseTimestamps) == 1:
+      return np.repeat(transforms, len(queryTimestamps), axis=0)
+
+    # binary search of the pose interval of every query
+    upper = np.clip(np.searchsorted(poseTimestamps, queryTimestamps, side='right'), 1, len(poseTimestamps) - 1)
+    lower = upper - 1
+    interval = poseTimestamps[upper] - poseTimestamps[lower]
+    with np.errstate(divide='ignore', invalid='ignore'):
+      alpha = np.where(interval > 0, (queryTimestamps - poseTimestamps[lower]) / interval, 0.0)
+    outOfRange = (alpha < 0) | (alpha > 1)
+    if np.any(outOfRange):
+      logging.info(f'{np.count_nonzero(outOfRange)} timestamps are outside of the tracked time range, the nearest pose is used')
+    alpha = np.clip(alpha, 0.0, 1.0)
+
+    # split the linear part into rotation and per-axis scaling
+    scales = np.linalg.norm(transforms[:, :3, :3], axis=1)
+    quaternions = self.RotationMatricesToQuaternions(transforms[:, :3, :3] / scales[:, np.newaxis, :])
+
+    interpolated = np.zeros((len(queryTimestamps), 4, 4))
+    rotations = self.QuaternionsToRotationMatrices(self.SlerpQuaternions(quaternions[lower], quaternions[upper], alpha))
+    interpolatedScales = (1 - alpha)[:, np.newaxis] * scales[lower] + alpha[:, np.newaxis] * scales[upper]
+    interpolated[:, :3, :3] = rotations * interpolatedScales[:, np.newaxis, :]
+    interpolated[:, :3, 3] = (1 - alpha)[:, np.newaxis] * transforms[lower, :3, 3] + alpha[:, np.newaxis] * transforms[upper, :3, 3]
+    interpolated[:, 3, 3] = 1.0
+    return interpolated
+
+  def RotationMatricesToQuaternions(self, rotations):
+    # (N, 3, 3) rotation matrices to (N, 4) unit quaternions (w, x, y, z)
+    # the largest of the four candidate components is used as pivot, for numerical stability
+    R = rotations
+    candidates = np.stack([1 + R[:, 0, 0] + R[:, 1, 1] + R[:, 2, 2],
+                           1 + R[:, 0, 0] - R[:, 1, 1] - R[:, 2, 2],
+                           1 - R[:, 0, 0] + R[:, 1, 1] - R[:, 2, 2],
+                           1 - R[:, 0, 0] - R[:, 1, 1] + R[:, 2, 2]], axis=1)
+    pivot = np.argmax(candidates, axis=1)
+    s = 2 * np.sqrt(np.maximum(candidates[np.arange(len(R)), pivot], 1e-12))
+    quaternions = np.empty((len(R), 4))
+    for component, values in enumerate([
+        (s / 4, (R[:, 2, 1] - R[:, 1, 2]) / s, (R[:, 0, 2] - R[:, 2, 0]) / s, (R[:, 1, 0] - R[:, 0, 1]) / s),
+        ((R[:, 2, 1] - R[:, 1, 2]) / s, s / 4, (R[:, 0, 1] + R[:, 1, 0]) / s, (R[:, 0, 2] + R[:, 2, 0]) / s),
+        ((R[:, 0, 2] - R[:, 2, 0]) / s, (R[:, 0, 1] + R[:, 1, 0]) / s, s / 4, (R[:, 1, 2] + R[:, 2, 1]) / s),
+        ((R[:, 1, 0] - R[:, 0, 1]) / s, (R[:, 0, 2] + R[:, 2, 0]) / s, (R[:, 1, 2] + R[:, 2, 1]) / s, s / 4)]):
+      selected = pivot == component
+      quaternions[selected] = np.stack(values, axis=1)[selected]
+    return quaternions / np.linalg.norm(quaternions, axis=1)[:, np.newaxis]
+
+  def QuaternionsToRotationMatrices(self, quaternions):
+    # (N, 4) unit quaternions (w, x, y, z) to (N, 3, 3) rotation matrices
+    w, x, y, z = quaternions.T
+    return np.stack([
+      np.stack([1 - 2*(y*y + z*z), 2*(x*y - z*w), 2*(x*z + y*w)], axis=1),
+      np.stack([2*(x*y + z*w), 1 - 2*(x*x + z*z), 2*(y*z - x*w)], axis=1),
+      np.stack([2*(x*z - y*w), 2*(y*z + x*w), 1 - 2*(x*x + y*y)], axis=1)], axis=1)
+
+  def SlerpQuaternions(self, q0, q1, alpha):
+    # spherical linear interpolation of (N, 4) unit quaternions, alpha (N,) in [0, 1]
+    dot = np.sum(q0 * q1, axis=1)
+    # take the shortest path
+    q1 = np.where((dot < 0)[:, np.newaxis], -q1, q1)
+    dot = np.abs(dot)
+    theta = np.arccos(np.clip(dot, -1.0, 1.0))
+    sinTheta = np.sin(theta)
+    nearlyParallel = sinTheta < 1e-6
+    safeSinTheta = np.where(nearlyParallel, 1.0, sinTheta)
+    w0 = np.where(nearlyParallel, 1 - alpha, np.sin((1 - alpha) * theta) / safeSinTheta)
+    w1 = np.where(nearlyParallel, alpha, np.sin(alpha * theta) / safeSinTheta)
+    quaternions = w0[:, np.newaxis] * q0 + w1[:, np.newaxis] * q1
+    return quaternions / np.linalg.norm(quaternions, axis=1)[:, np.newaxis]
+
+  def PoseArrayToMatrices(self, values):
+    # (N, 12) or (N, 16) row-major values, or (N, 3, 4) / (N, 4, 4) arrays, to (N, 4, 4) matrices
+    values = np.asarray(values, dtype=np.float64).reshape(len(values), -1)
+    if values.shape[1] not in (12, 16):
+      raise ValueError(f"A pose has {values.shape[1]} values, 12 or 16 are expected")
+    transforms = np.zeros((values.shape[0], 4, 4))
+    transforms[:, :3, :] = values[:, :12].reshape(-1, 3, 4)
+    transforms[:, 3, 3] = 1.0
+    return transforms
+
+  def ReadPoseStreamCSV(self, file_path):
+    itemIndices = []
+    timestamps = []
+    values = []
+    with open(file_path, "r") as f:
+      for lineNumber, line in enumerate(f):
+        fields = [field.strip() for field in line.split(',')]
+        if not fields[0] or fields[0].startswith('#'):
+          continue
+        try:
+          row = [float(field) for field in fields[1:]]
+        except ValueError:
+          if lineNumber == 0:
+            continue  # header
+          raise ValueError(f"Invalid pose at line {lineNumber+1} of {file_path}")
+        if len(row) not in (13, 17):
+          raise ValueError(f"Line {lineNumber+1} of {file_path} has {len(row)+1} columns, 14 (or 18) are expected")
+        itemIndices.append(fields[0])
+        timestamps.append(row[0])
+        values.append(row[1:])
+    return itemIndices, np.array(timestamps), self.PoseArrayToMatrices(values)
+
+  def ReadPoseStreamNPZ(self, file_path):
+    with np.load(file_path) as data:
+      if "transforms" not in data:
+        raise ValueError(f"{file_path} has no 'transforms' array")
+      transforms = self.PoseArrayToMatrices(data["transforms"])
+      numberOfPoses = transforms.shape[0]
+      itemIndices = [str(itemIndex) for itemIndex in data["indices"]] if "indices" in data else [str(itemIndex) for itemIndex in range(numberOfPoses)]
+      timestamps = np.asarray(data["timestamps"], dtype=np.float64) if "timestamps" in data else None
+    if len(itemIndices) != numberOfPoses or (timestamps is not None and len(timestamps) != numberOfPoses):
+      raise ValueError(f"The arrays of {file_path} do not have the same number of poses")
+    return itemIndices, timestamps, transforms
+
+  def ReadPoseStreamMetafile(self, file_path, transformName="ImageToReferenceTransform"):
+    # Only the text header is read: it ends at the ElementDataFile field, the pixel data (if any) is not loaded
+    fieldPattern = re.compile(r'^Seq_Frame(\d+)_(\w+)\s*=\s*(.*)$')
+    poses = {}
+    statuses = {}
+    timestamps = {}
+    with open(file_path, "rb") as f:
+      for rawLine in f:
+        line = rawLine.decode('latin-1').strip()
+        if line.startswith("ElementDataFile"):
+          break
+        match = fieldPattern.match(line)
+        if not match:
+          continue
+        frameNumber, fieldName, value = int(match.group(1)), match.group(2), match.group(3)
+        if fieldName == transformName:
+          poses[frameNumber] = [float(number) for number in value.split()]
+        elif fieldName == transformName + "Status":
+          statuses[frameNumber] = value
+        elif fieldName == "Timestamp":
+          timestamps[frameNumber] = float(value)
+    frameNumbers = [frameNumber for frameNumber in sorted(poses) if statuses.get(frameNumber, "OK") == "OK"]
+    if len(frameNumbers) < len(poses):
+      logging.info(f'Skipped {len(poses)-len(frameNumbers)} frames with an invalid {transformName}')
+    if not frameNumbers:
+      raise ValueError(f"No valid {transformName} field in {file_path}")
+    hasTimestamps = all(frameNumber in timestamps for frameNumber in frameNumbers)
+    return ([str(frameNumber) for frameNumber in frameNumbers],
+            np.array([timestamps[frameNumber] for frameNumber in frameNumbers]) if hasTimestamps else None,
+            self.PoseArrayToMatrices([poses[frameNumber] for frameNumber in frameNumbers]))
+
+  def FillTransformSequenceFromArray(self, sequenceNode, transforms, itemIndices, names=None):
+    """
+    Store a stack of linear transforms in a sequence node, through one scratch transform node that is never added to the scene.
+    :param sequenceNode: output vtkMRMLSequenceNode
+    :param transforms: numpy array (N, 4, 4) of transforms to parent (RAS)
+    :param itemIndices: N index values of the sequence items
+    :param names: N data node names (default: the index values)
+    """
+    if not sequenceNode:
+      raise ValueError("Output sequence node is invalid")
+    numberOfTransforms = transforms.shape[0]
+    if len(itemIndices) != numberOfTransforms or (names is not None and len(names) != numberOfTransforms):
+      raise ValueError("Number of item indices or names does not match the number of transforms")
+    scratchTransformNode = slicer.vtkMRMLLinearTransformNode()
+    matrix = vtk.vtkMatrix4x4()
+    slicer.mrmlScene.StartState(slicer.vtkMRMLScene.BatchProcessState)
+    wasModified = sequenceNode.StartModify()
+    try:
+      for transformNumber in range(numberOfTransforms):
+        slicer.util.updateVTKMatrixFromArray(matrix, transforms[transformNumber])
+        scratchTransformNode.SetMatrixTransformToParent(matrix)
+        scratchTransformNode.SetName(names[transformNumber] if names is not None else str(itemIndices[transformNumber]))
+        sequenceNode.SetDataNodeAtValue(scratchTransformNode, str(itemIndices[transformNumber]))
+    finally:
+      sequenceNode.EndModify(wasModified)
+      slicer.mrmlScene.EndState(slicer.vtkMRMLScene.BatchProcessState)
+
+  def GetFrameStackCacheKey(self, directory, filenames):
+    # The cache is invalidated whenever an image is added, removed, renamed or rewritten (file list, size and mtime)
+    import hashlib
+    digest = hashlib.sha1()
+    for filename in filenames:
+      fileStat = os.stat(os.path.join(directory, filename))
+      digest.update(f'{filename}|{fileStat.st_size}|{fileStat.st_mtime_ns}\n'.encode('utf-8'))
+    return digest.hexdigest()
+
+  def ReadImageFramesCached(self, directory, numberOfWorkers=None, cacheDirectory=None, collapseGrayscale=False):
+    ### INPUTS
+    # directory: the directory including all the sequential 2D US images
+    # cacheDirectory: folder of the frame stack cache (default: "<directory>/.ReadSequentialDataCache")
+    ### OUTPUTS
+    # same as ReadImageFramesFromDirectory, but the frames are a read-only memory-mapped array when the cache is valid
+    import json
+    if not cacheDirectory:
+      cacheDirectory = os.path.join(directory, self.FRAME_CACHE_FOLDER)
+    headerPath = os.path.join(cacheDirectory, "frames.json")
+    framesPath = os.path.join(cacheDirectory, "frames.npy")
+
+    itemIndices, filenames = self.ListSequentialImageFiles(directory)
+    cacheKey = self.GetFrameStackCacheKey(directory, filenames) + ("-gray" if collapseGrayscale else "")
+    if os.path.isfile(headerPath) and os.path.isfile(framesPath):
+      with open(headerPath, "r") as f:
+        header = json.load(f)
+      if header.get("key") == cacheKey:
+        frames = np.load(framesPath, mmap_mode='r')
+        if list(frames.shape) == header["shape"]:
+          ijkToRAS = vtk.vtkMatrix4x4()
+          ijkToRAS.DeepCopy(header["ijkToRAS"])
+          logging.info('Memory-mapped cached US frame stack ' + framesPath)
+          return header["itemIndices"], header["names"], frames, ijkToRAS
+
+    itemIndices, names, frames, ijkToRAS = self.ReadImageFramesFromDirectory(directory, numberOfWorkers, collapseGrayscale)
+    try:
+      os.makedirs(cacheDirectory, exist_ok=True)
+      # write the stack first and the header last, so that an interrupted write never looks like a valid cache
+      if os.path.isfile(headerPath):
+        os.remove(headerPath)
+      np.save(framesPath, frames)
+      ijkToRASElements = [ijkToRAS.GetElement(row, column) for row in range(4) for column in range(4)]
+      header = {
+        "key": cacheKey,
+        "shape": list(frames.shape),
+        "dtype": frames.dtype.str,
+        "spacing": [float(np.linalg.norm([ijkToRAS.GetElement(row, column) for row in range(3)])) for column in range(3)],
+        "ijkToRAS": ijkToRASElements,
+        "itemIndices": itemIndices,
+        "names": names,
+        }
+      with open(headerPath, "w") as f:
+        json.dump(header, f)
+    except OSError as e:
+      logging.warning('Could not write the US frame stack cache: ' + str(e))
+    return itemIndices, names, frames, ijkToRAS
+
+  def ConvertFramesToComponents(self, frames, numberOfComponents):
+    ### INPUTS
+    # frames: numpy array (N, rows, columns) or (N, rows, columns, components)
+    # numberOfComponents: number of scalar components of the frames already in the sequence
+    ### OUTPUTS
+    # frames with numberOfComponents components: single-channel frames are repeated in every color channel, the alpha channel
+    # is opaque unless the frames have one,
+    # colored frames are reduced to their luminance (ITU-R BT.601) when the sequence is single-channel
+    frameComponents = 1 if frames.ndim == 3 else frames.shape[3]
+    if frameComponents == numberOfComponents:
+      return frames
+    if numberOfComponents == 1:
+      if frameComponents == 2 or self.IsGrayscaleFrame(frames.reshape((-1,) + frames.shape[2:])):
+        return frames[..., 0]
+      logging.warning('Colored US images appended to a single-channel sequence, they are converted to grayscale')
+      luminance = frames[..., :3].astype(np.float32).dot(np.array([0.299, 0.587, 0.114], dtype=np.float32))
+      return np.clip(np.rint(luminance), np.iinfo(frames.dtype).min, np.iinfo(frames.dtype).max).astype(frames.dtype) \
+        if np.issubdtype(frames.dtype, np.integer) else luminance.astype(frames.dtype)
+    # color channels: the gray value (1 or 2 components: gray, alpha) or the RGB channels of the frames
+    colors = frames[..., np.newaxis] if frames.ndim == 3 else frames[..., :1] if frameComponents <= 2 else frames[..., :3]
+    converted = np.empty(frames.shape[:3] + (numberOfComponents,), dtype=frames.dtype)
+    converted[..., :3] = colors
+    if numberOfComponents == 4:
+      # the alpha channel is never made of the gray values (dark pixels would become transparent)
+      if frameComponents in (2, 4):
+        converted[..., 3] = frames[..., -1]
+      else:
+        converted[..., 3] = np.iinfo(frames.dtype).max if np.issubdtype(frames.dtype, np.integer) else 1
+    return converted
+
+  def IsGrayscaleFrame(self, frame):
+    # True if the color channels (alpha is ignored) of an RGB(A) frame are all equal
+    if frame.ndim != 3 or frame.shape[2] < 2:
+      return False
+    colorChannels = min(frame.shape[2], 3)
+    return all(np.array_equal(frame[..., 0], frame[..., channel]) for channel in range(1, colorChannels))
+
+  def ImportUSSequenceLazy(self, directory, sequenceNode, flip=False, cacheSizeMB=256, prefetchCount=4, cropMask=None):
+    """
+    Index the US images of a directory without decoding them (for sweeps that do not fit in memory).
+    The sequence node gets one 1x1 placeholder item per image, with the same index values and names as a full import,
+    and the selected frame is decoded on demand into lazyFrameNode by UpdateLazyFrame.
+    :param directory: directory including all the sequential 2D US images
+    :param sequenceNode: output vtkMRMLSequenceNode
+    :param flip: mirror the images along the x axis (same as the "Flip" check box)
+    :param cacheSizeMB: memory budget of the decoded frame cache
+    :param prefetchCount: number of frames decoded ahead in the browsing direction
+    :param cropMask: fan ROI [top, bottom, left, right] in pixels, None to keep the full frames
+    """
+    self.StopLazyLoading()
+    itemIndices, filenames = self.ListSequentialImageFiles(directory)
+    if not filenames:
+      raise ValueError("No US image found in " + directory)
+    paths = [os.path.join(directory, filename) for filename in filenames]
+    names = [os.path.splitext(filename)[0] for filename in filenames]
+
+    # only the first image is decoded, to get the geometry shared by the sweep
+    firstFrame, ijkToRAS = self.ReadImageFrame(paths[0])
+    if flip:
+      ijkToRAS = self.FlipIJKToRAS(ijkToRAS, firstFrame.shape[1])
+    readFrame = lambda path: self.ReadImageFrame(path)[0]
+    if cropMask is not None:
+      _, ijkToRAS = self.CropFrames(firstFrame[np.newaxis, ...], ijkToRAS, cropMask)
+      top, bottom, left, right = [int(value) for value in cropMask]
+      # copy the ROI so that the cache does not keep the full decoded frames alive
+      readFrame = lambda path: self.ReadImageFrame(path)[0][top:bottom, left:right].copy()
+    placeholders = np.zeros((len(paths), 1, 1), dtype=firstFrame.dtype)
+    self.FillSequenceFromArray(sequenceNode, placeholders, ijkToRAS, itemIndices, names)
+
+    nodeClass = "vtkMRMLVectorVolumeNode" if firstFrame.ndim == 3 else "vtkMRMLScalarVolumeNode"
+    if (self.lazyFrameNode is None or not slicer.mrmlScene.IsNodePresent(self.lazyFrameNode)
+        or self.lazyFrameNode.GetClassName() != nodeClass):
+      self.lazyFrameNode = slicer.mrmlScene.AddNewNodeByClass(nodeClass, sequenceNode.GetName() + "_LazyFrame")
+      self.lazyFrameNode.CreateDefaultDisplayNodes()
+    self.lazyFrameNode.SetIJKToRASMatrix(ijkToRAS)
+
+    self.lazyFrameLoader = LazyFrameLoader(paths, readFrame, cacheSizeMB*1024*1024)
+    self.lazySequenceNode = sequenceNode
+    self.lazyPrefetchCount = prefetchCount
+    self.lazyFrameLoader.Prefetch(range(prefetchCount + 1))
+
+  def UpdateLazyFrame(self, frameNumber, direction=1):
+    # Show the frame of the selected sequence item in lazyFrameNode, then prefetch the next frames (direction: +1 or -1)
+    if not self.lazyFrameLoader:
+      return
+    frame = self.lazyFrameLoader.GetFrame(frameNumber)
+    slicer.util.updateVolumeFromArray(self.lazyFrameNode, frame[np.newaxis, ...])
+    numberOfFrames = self.lazyFrameLoader.GetNumberOfFrames()
+    self.lazyFrameLoader.Prefetch([(frameNumber + direction*shift) % numberOfFrames for shift in range(1, self.lazyPrefetchCount + 1)])
+
+  def StopLazyLoading(self):
+    if self.lazyFrameLoader:
+      self.lazyFrameLoader.Shutdown()
+      self.lazyFrameLoader = None
+    self.lazySequenceNode = None
+
+  def FillSequenceFromArray(self, sequenceNode, frames, ijkToRAS, itemIndices, names=None):
+    """
+    Store a stack of 2D frames in a sequence node.
+    Only one scratch volume node is used (it is never added to the scene) and the scene is kept in
+    batch processing state, so the cost is the pixel copy instead of per-node MRML overhead.
+    :param sequenceNode: output vtkMRMLSequenceNode
+    :param frames: numpy array (N, rows, columns) for scalar or (N, rows, columns, components) for vector frames
+    :param ijkToRAS: vtkMatrix4x4 shared by all the frames
+    :param itemIndices: N index values of the sequence items
+    :param names: N data node names (default: the index values)
+    """
+    from vtk.util import numpy_support
+    if not sequenceNode:
+      raise ValueError("Output sequence node is invalid")
+    numberOfFrames = frames.shape[0]
+    if len(itemIndices) != numberOfFrames or (names is not None and len(names) != numberOfFrames):
+      raise ValueError("Number of item indices or names does not match the number of frames")
+
+    isVector = frames.ndim == 4
+    scratchVolumeNode = slicer.vtkMRMLVectorVolumeNode() if isVector else slicer.vtkMRMLScalarVolumeNode()
+    scratchVolumeNode.SetIJKToRASMatrix(ijkToRAS)
+    scratchImageData = vtk.vtkImageData()
+    scratchImageData.SetDimensions(frames.shape[2], frames.shape[1], 1)
+    scratchImageData.AllocateScalars(numpy_support.get_vtk_array_type(frames.dtype), frames.shape[3] if isVector else 1)
+    scratchVolumeNode.SetAndObserveImageData(scratchImageData)
+    scratchFrame = numpy_support.vtk_to_numpy(scratchImageData.GetPointData().GetScalars()).reshape(frames.shape[1:])
+
+    startTime = time.time()
+    slicer.mrmlScene.StartState(slicer.vtkMRMLScene.BatchProcessState)
+    wasModified = sequenceNode.StartModify()
+    try:
+      for frameNumber in range(numberOfFrames):
+        # the sequence node stores a deep copy, so the scratch buffer can be overwritten by the next frame
+        scratchFrame[...] = frames[frameNumber]
+        scratchImageData.Modified()
+        scratchVolumeNode.SetName(names[frameNumber] if names is not None else str(itemIndices[frameNumber]))
+        sequenceNode.SetDataNodeAtValue(scratchVolumeNode, str(itemIndices[frameNumber]))
+    finally:
+      sequenceNode.EndModify(wasModified)
+      slicer.mrmlScene.EndState(slicer.vtkMRMLScene.BatchProcessState)
+    logging.info(f'Filled {numberOfFrames} sequence items in {time.time()-startTime:.2f} seconds')
+
+  def GetFlipMatrix(self, imageWidth, imageSpacing=1.0):
+    # Mirror along the x axis: translate(-w/2) * flip * translate(w/2), w = image width (in IJK units for a loaded US image)
+    transform_matrix_flip = vtk.vtkMatrix4x4()
+    transform_matrix_flip.SetElement(0, 0, -1)
+    transform_matrix_translate = vtk.vtkMatrix4x4()
+    transform_matrix_translate.SetElement(0, 3, imageWidth*0.5*imageSpacing)
+
+    transform_matrix_translate_inverted = vtk.vtkMatrix4x4()
+    transform_matrix_translate_inverted.SetElement(0, 3, -imageWidth*0.5*imageSpacing)
+
+    transform_matrix_concatenated = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Multiply4x4(transform_matrix_flip, transform_matrix_translate, transform_matrix_concatenated)
+    vtk.vtkMatrix4x4.Multiply4x4(transform_matrix_translate_inverted, transform_matrix_concatenated, transform_matrix_concatenated)
+    return transform_matrix_concatenated
+
+  def FlipIJKToRAS(self, ijkToRAS, imageWidth, imageSpacing=1.0):
+    # Hardening a linear transform on a volume only premultiplies its IJK to RAS matrix,
+    # so the flip is applied to the geometry directly instead of going through a transform node per frame
+    ijkToRAS_flipped = vtk.vtkMatrix4x4()
+    vtk.vtkMatrix4x4.Multiply4x4(self.GetFlipMatrix(imageWidth, imageSpacing), ijkToRAS, ijkToRAS_flipped)
+    return ijkToRAS_flipped
 
   def process(self, inputVolume, outputVolume, imageThreshold, invert=False, showResult=True):
     """
@@ -1123,6 +3222,46 @@ class ReadSequentialDataTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_ReadSequentialData1()
+    self.setUp()
+    self.test_ResliceEngineBenchmark()
+    self.setUp()
+    self.test_NumPyResliceBackendComparison()
+    self.setUp()
+    self.test_InterpolationBenchmark()
+    self.setUp()
+    self.test_FilterPosesDropouts()
+    self.setUp()
+    self.test_AsyncPNGWriterErrors()
+    self.setUp()
+    self.test_TransformFilesRoundTrip()
+    self.setUp()
+    self.test_ITKAffineTransformCenter()
+    self.setUp()
+    self.test_InterpolatePoses()
+    self.setUp()
+    self.test_CropFrames()
+    self.setUp()
+    self.test_DownsampleFrames()
+    self.setUp()
+    self.test_AggregateSlabs()
+    self.setUp()
+    self.test_FrameStackCacheInvalidation()
+    self.setUp()
+    self.test_SliceViewReslicerMatchesRedSliceView()
+    self.setUp()
+    self.test_ConvertFramesToComponents()
+    self.setUp()
+    self.test_FilterPosesRamp()
+    self.setUp()
+    self.test_SlabsWithoutImageGrid()
+    self.setUp()
+    self.test_SliceViewResliceScaling()
+    self.setUp()
+    self.test_ParallelDecodeMatchesLoadVolume()
+    self.setUp()
+    self.test_FollowLazySequence()
+    self.setUp()
+    self.test_PoseStreamMatchesTransformFile()
 
   def test_ReadSequentialData1(self):
     """ Ideally you should have several levels of tests.  At the lowest level
@@ -1169,3 +3308,666 @@ class ReadSequentialDataTest(ScriptedLoadableModuleTest):
     self.assertEqual(outputScalarRange[1], inputScalarRange[1])
 
     self.delayDisplay('Test passed')
+
+  def createSyntheticVolume(self, dimension=128):
+    # smooth synthetic CT-like volume (short), with an anisotropic spacing
+    from vtk.util import numpy_support
+    k, j, i = np.mgrid[0:dimension, 0:dimension, 0:dimension].astype(np.float32)
+    voxels = (1000 * np.sin(i * 0.11) * np.cos(j * 0.07) + 5 * k).astype(np.int16)
+    volume = vtk.vtkImageData()
+    volume.SetDimensions(dimension, dimension, dimension)
+    volume.SetSpacing(0.8, 0.8, 1.25)
+    volume.SetOrigin(-50, -60, -70)
+    volume.GetPointData().SetScalars(numpy_support.numpy_to_vtk(voxels.ravel(), deep=True, array_type=vtk.VTK_SHORT))
+    return volume
+
+  def createSyntheticPoses(self, numberOfFrames):
+    # a sweep: the image plane rotates and translates through the volume
+    poses = []
+    for frameNumber in range(numberOfFrames):
+      transform = vtk.vtkTransform()
+      transform.Translate(0.2 * frameNumber, -5, 3)
+      transform.RotateY(20 + 0.5 * frameNumber)
+      transform.RotateX(10)
+      poses.append(transform.GetMatrix())
+    return poses
+
+  def test_ResliceEngineBenchmark(self):
+    """ Compare the persistent pipeline of the ResliceEngine with building the pipeline (and the reslice axes, with
+    TransformationFromRASToLPS and a vtkTransform) for every slab, as VolumeReslice used to do. Both must give the same slices.
+    """
+    self.delayDisplay("Starting the reslice engine benchmark")
+    from vtk.util import numpy_support
+    logic = ReadSequentialDataLogic()
+    volume = self.createSyntheticVolume()
+    poses = self.createSyntheticPoses(30)
+    slabNum = 1
+    engine = ResliceEngine(volume)
+    inOrigin = volume.GetOrigin()
+    inExtent = volume.GetExtent()
+    inSpacing = volume.GetSpacing()
+    inCenter = [inOrigin[0] + inSpacing[0]*(inExtent[1] - inExtent[0] +1) *0.5,
+                inOrigin[1] + inSpacing[1]*(inExtent[3] - inExtent[2] +1) *0.5,
+                inOrigin[2] + inSpacing[2]*(inExtent[5] - inExtent[4] +1) *0.5]
+
+    startTime = time.time()
+    perSlabOutputs = []
+    for pose in poses:
+      slicingTransform = vtk.vtkTransform()
+      for slab_shift in range(-slabNum, slabNum+1):
+        slicingMatrix_new = logic.TransformationFromRASToLPS(pose)
+        # shifting the slicing position along Z axis
+        shifted_translation = [0, 0, 0, 0]
+        slicingMatrix_new.MultiplyPoint([0, 0, slab_shift*inSpacing[2], 1], shifted_translation)
+        for i in range(4):
+          slicingMatrix_new.SetElement(i, 3, shifted_translation[i])
+        slicingMatrix_new_invert = vtk.vtkMatrix4x4()
+        vtk.vtkMatrix4x4.Invert(slicingMatrix_new, slicingMatrix_new_invert)
+        slicingTransform.PostMultiply()
+        slicingTransform.Translate(-inCenter[0], -inCenter[1], -inCenter[2])
+        slicingTransform.SetMatrix(slicingMatrix_new_invert)
+        slicingTransform.Translate(inCenter[0], inCenter[1], inCenter[2])
+        slicingTransform.Inverse()
+        slicingTransform.Update()
+
+        reslicer = vtk.vtkImageReslice()
+        reslicer.SetInputData(volume)
+        reslicer.SetResliceAxes(slicingTransform.GetMatrix())
+        reslicer.SetInterpolationModeToCubic()
+        reslicer.SetOutputScalarType(-1)
+        reslicer.SetOutputDimensionality(2)
+        reslicer.Update()
+        table = vtk.vtkScalarsToColors()
+        table.SetRange(reslicer.GetOutput().GetScalarRange())
+        convert = vtk.vtkImageMapToColors()
+        convert.SetLookupTable(table)
+        convert.SetOutputFormatToRGB()
+        convert.SetInputConnection(reslicer.GetOutputPort())
+        flip = vtk.vtkImageFlip()
+        flip.SetInputConnection(convert.GetOutputPort())
+        flip.SetFilteredAxis(1)
+        flip.Update()
+        perSlabOutputs.append(numpy_support.vtk_to_numpy(flip.GetOutput().GetPointData().GetScalars()).copy())
+    perSlabTime = time.time() - startTime
+
+    startTime = time.time()
+    engineOutputs = []
+    for pose in poses:
+      for slab_shift in range(-slabNum, slabNum+1):
+        engine.ResliceSlab(pose, slab_shift)
+        engine.table.SetRange(engine.slabReslicer.GetOutput().GetScalarRange())
+        engine.flip.Update()
+        engineOutputs.append(numpy_support.vtk_to_numpy(engine.flip.GetOutput().GetPointData().GetScalars()).copy())
+    engineTime = time.time() - startTime
+
+    numberOfSlices = len(poses) * (2 * slabNum + 1)
+    logging.info(f'Reslicing {numberOfSlices} slices: new pipeline per slab {perSlabTime:.3f} s, persistent pipeline {engineTime:.3f} s '
+                 f'({(perSlabTime - engineTime) / numberOfSlices * 1000:.2f} ms setup removed per slice)')
+    for perSlabOutput, engineOutput in zip(perSlabOutputs, engineOutputs):
+      self.assertTrue(np.array_equal(perSlabOutput.ravel(), engineOutput.ravel()))
+    self.delayDisplay('Test passed')
+
+  def test_NumPyResliceBackendComparison(self):
+    """ The batched SciPy sampler must reproduce the geometry of the VTK reslice: same output grid,
+    intensities within rounding for linear interpolation and close for cubic (B-spline vs. VTK cubic).
+    """
+    self.delayDisplay("Starting the NumPy reslice backend comparison")
+    from vtk.util import numpy_support
+    volume = self.createSyntheticVolume()
+    poses = self.createSyntheticPoses(6)
+    slabShifts = (-1, 0, 1)
+    logic = ReadSequentialDataLogic()
+    engine = ResliceEngine(volume)
+    intensityRange = volume.GetScalarRange()
+    for order, setInterpolation in ((1, engine.slabReslicer.SetInterpolationModeToLinear), (3, engine.slabReslicer.SetInterpolationModeToCubic)):
+      setInterpolation()
+      for frameNumber, slabs in logic.ResliceFramesNumPy(volume, poses, slabShifts, order=order, batchSize=4):
+        for slabShift, slab in zip(slabShifts, slabs):
+          vtkSlab = engine.ResliceSlab(poses[frameNumber], slabShift)
+          dims = vtkSlab.GetDimensions()
+          expected = numpy_support.vtk_to_numpy(vtkSlab.GetPointData().GetScalars()).reshape(dims[1], dims[0])
+          self.assertEqual(slab.shape, expected.shape)
+          # the volume border may be resolved differently by the two samplers
+          inside = (expected != 0) & (slab != 0)
+          self.assertLess(np.count_nonzero((expected != 0) != (slab != 0)), 0.02 * expected.size)
+          difference = np.abs(expected[inside].astype(np.float64) - slab[inside])
+          if order == 1:
+            self.assertLessEqual(difference.max(), 1)
+          else:
+            self.assertLess(difference.max(), 0.01 * (intensityRange[1] - intensityRange[0]))
+            self.assertLess(difference.mean(), 0.001 * (intensityRange[1] - intensityRange[0]))
+    self.delayDisplay('Test passed')
+
+  def test_InterpolationBenchmark(self):
+    """ Per-frame reslice time of every interpolation mode and intensity difference against cubic,
+    to choose the fast modes for previews and cubic (or windowed sinc) for the final datasets.
+    """
+    self.delayDisplay("Starting the interpolation benchmark")
+    volume = self.createSyntheticVolume()
+    poses = self.createSyntheticPoses(20)
+    engine = ResliceEngine(volume)
+    slabs = {}
+    frameTimes = {}
+    for interpolation in ResliceEngine.INTERPOLATION_MODES:
+      engine.SetInterpolation(interpolation)
+      startTime = time.time()
+      slabs[interpolation] = [engine.ResliceSlabArray(pose) for pose in poses]
+      frameTimes[interpolation] = (time.time() - startTime) / len(poses)
+
+    intensityRange = volume.GetScalarRange()
+    for interpolation in ResliceEngine.INTERPOLATION_MODES:
+      differences = []
+      for slab, cubicSlab in zip(slabs[interpolation], slabs["cubic"]):
+        self.assertEqual(slab.shape, cubicSlab.shape)
+        differences.append(np.abs(slab.astype(np.float64) - cubicSlab).ravel())
+      difference = np.concatenate(differences)
+      logging.info(f'Interpolation {interpolation}: {frameTimes[interpolation] * 1000:.2f} ms per frame, '
+                   f'difference to cubic: mean {difference.mean():.2f}, max {difference.max():.0f}')
+      # all the modes sample the same smooth volume at the same points
+      self.assertLess(difference.mean(), 0.05 * (intensityRange[1] - intensityRange[0]))
+    self.delayDisplay('Test passed')
+
+  def test_FilterPosesDropouts(self):
+    """ A tracking dropout (NaN pose) or a degenerate (zero) pose is flagged as invalid
+    and must not corrupt the smoothed poses of its neighbours.
+    """
+    self.delayDisplay("Starting the pose filter dropout test")
+    logic = ReadSequentialDataLogic()
+    transforms = np.repeat(np.eye(4)[np.newaxis], 12, axis=0)
+    transforms[:, 0, 3] = np.arange(12) * 0.5
+    transforms[:, :3, :3] *= 0.2 # pixel to mm scaling
+    transforms[5] = np.nan
+    transforms[9, :3, :3] = 0
+    filtered, valid = logic.FilterPoses(transforms, smoothingWindow=5)
+    self.assertFalse(valid[5])
+    self.assertFalse(valid[9])
+    self.assertTrue(np.all(np.isfinite(filtered[valid])))
+    np.testing.assert_allclose(np.linalg.norm(filtered[valid, :3, :3], axis=1), 0.2)
+    self.delayDisplay('Test passed')
+
+  def test_AsyncPNGWriterErrors(self):
+    """ A .png that cannot be written (here: missing directory) must raise in the caller
+    when the writer is closed, instead of silently dropping the frame.
+    """
+    self.delayDisplay("Starting the asynchronous png writer error test")
+    import tempfile
+    slab = np.arange(64, dtype=np.int16).reshape(8, 8)
+    with tempfile.TemporaryDirectory() as directory:
+      with AsyncPNGWriter(numberOfWriters=2) as pngWriter:
+        pngWriter.Write(slab, os.path.join(directory, "Resliced.png"))
+      self.assertTrue(os.path.isfile(os.path.join(directory, "Resliced.png")))
+      with self.assertRaises(IOError):
+        with AsyncPNGWriter(numberOfWriters=2) as pngWriter:
+          pngWriter.Write(slab, os.path.join(directory, "missing", "Resliced.png"))
+    self.delayDisplay('Test passed')
+
+  def test_TransformFilesRoundTrip(self):
+    """ Transforms written by ConvertToSlicerTransforms (one file per transform and one multi-transform file)
+    must be read back as the same matrices by ReadTransformFiles, ReadMultiTransformFile and ReadSlicerTransfrom.
+    """
+    self.delayDisplay("Starting the transform files round trip test")
+    import tempfile
+    logic = ReadSequentialDataLogic()
+    transforms_LPS = np.array([slicer.util.arrayFromVTKMatrix(pose) for pose in self.createSyntheticPoses(5)])
+    transforms_LPS[:, :3, :3] *= 1.5 # with a scaling, as the image to reference transforms
+    # the RAS matrix of a LPS matrix: C M C with C = diag(-1, -1, 1, 1)
+    lpsToRAS = np.array([-1.0, -1.0, 1.0, 1.0])
+    transforms_RAS = transforms_LPS * lpsToRAS[:, np.newaxis] * lpsToRAS[np.newaxis, :]
+    with tempfile.TemporaryDirectory() as directory:
+      paths = [os.path.join(directory, f"Transform_{transformNumber}.txt") for transformNumber in range(len(transforms_LPS))]
+      logic.ConvertToSlicerTransforms(transforms_LPS, outputPaths=paths, numberOfWorkers=2)
+      readTransforms_RAS, failed = logic.ReadTransformFiles(paths)
+      self.assertEqual(failed, [])
+      np.testing.assert_allclose(readTransforms_RAS, transforms_RAS, rtol=1e-12, atol=1e-9)
+      for path, transform_LPS in zip(paths, transforms_LPS):
+        np.testing.assert_allclose(logic.ReadSlicerTransfrom(path), transform_LPS, rtol=1e-12, atol=1e-9)
+
+      multiTransformPath = os.path.join(directory, "Transforms.txt")
+      logic.ConvertToSlicerTransforms(transforms_LPS, outputPath=multiTransformPath)
+      np.testing.assert_allclose(logic.ReadMultiTransformFile(multiTransformPath), transforms_RAS, rtol=1e-12, atol=1e-9)
+      np.testing.assert_allclose(logic.ReadMultiTransformFile(multiTransformPath, convertToRAS=False), np.linalg.inv(transforms_LPS),
+                                 rtol=1e-12, atol=1e-12)
+    self.delayDisplay('Test passed')
+
+  def test_ITKAffineTransformCenter(self):
+    """ An ITK affine transform file with a rotation center (non-zero FixedParameters) must be parsed to the same
+    transform to parent (RAS) as slicer.util.loadTransform loads from the file.
+    """
+    self.delayDisplay("Starting the ITK affine transform center test")
+    import tempfile
+    logic = ReadSequentialDataLogic()
+    transform = vtk.vtkTransform()
+    transform.RotateZ(30)
+    transform.RotateX(-15)
+    transform.Scale(1.2, 0.9, 1.1)
+    matrix = slicer.util.arrayFromVTKMatrix(transform.GetMatrix())
+    parameters = matrix[:3, :3].ravel().tolist() + [4.0, -7.5, 12.25]
+    with tempfile.TemporaryDirectory() as directory:
+      path = os.path.join(directory, "CenteredTransform.txt")
+      with open(path, "w") as f:
+        f.write('#Insight Transform File V1.0\n#Transform 0\nTransform: AffineTransform_double_3_3\n')
+        f.write('Parameters: ' + ' '.join(map(repr, parameters)) + '\n')
+        f.write('FixedParameters: 10.5 -20 35\n')
+      self.assertEqual(logic.ParseITKAffineTransformFile(path)[0][1], [10.5, -20.0, 35.0])
+      transforms_RAS, failed = logic.ReadTransformFiles([path])
+      self.assertEqual(failed, [])
+      loadedTransformNode = slicer.util.loadTransform(path)
+      loadedMatrix = vtk.vtkMatrix4x4()
+      loadedTransformNode.GetMatrixTransformToParent(loadedMatrix)
+      np.testing.assert_allclose(transforms_RAS[0], slicer.util.arrayFromVTKMatrix(loadedMatrix), rtol=1e-9, atol=1e-9)
+      np.testing.assert_allclose(logic.ReadMultiTransformFile(path)[0], transforms_RAS[0], rtol=1e-12, atol=1e-12)
+    self.delayDisplay('Test passed')
+
+  def test_InterpolatePoses(self):
+    """ Poses interpolated at the image timestamps: SLERP of the rotation and linear translation between the two
+    nearest poses, and the first/last pose for the timestamps outside of the tracked time range.
+    """
+    self.delayDisplay("Starting the pose interpolation test")
+    logic = ReadSequentialDataLogic()
+
+    def pose(angle, translation, scale=0.5):
+      transform = vtk.vtkTransform()
+      transform.Translate(translation)
+      transform.RotateWXYZ(angle, 1, 2, 3)
+      transform.Scale(scale, scale, scale)
+      return slicer.util.arrayFromVTKMatrix(transform.GetMatrix())
+
+    poses = np.array([pose(10, [0, 0, 0]), pose(100, [10, -4, 2])])
+    # the poses do not have to be sorted by time
+    interpolated = logic.InterpolatePoses([3.0, 1.0], poses[::-1], [2.0, 2.5, 0.0, 5.0])
+    np.testing.assert_allclose(interpolated[0], pose(55, [5, -2, 1]), atol=1e-9)
+    np.testing.assert_allclose(interpolated[1], pose(77.5, [7.5, -3, 1.5]), atol=1e-9)
+    # clamped to the tracked time range
+    np.testing.assert_allclose(interpolated[2], poses[0], atol=1e-9)
+    np.testing.assert_allclose(interpolated[3], poses[1], atol=1e-9)
+    self.delayDisplay('Test passed')
+
+  def createFrameGeometry(self):
+    # IJK to RAS of US frames (spacing, flipped columns, rotated in the RAS space)
+    transform = vtk.vtkTransform()
+    transform.Translate(12.5, -30, 7)
+    transform.RotateX(90)
+    transform.Scale(-0.3, 0.3, 1)
+    ijkToRAS = vtk.vtkMatrix4x4()
+    ijkToRAS.DeepCopy(transform.GetMatrix())
+    return ijkToRAS
+
+  def test_CropFrames(self):
+    """ The pixels of the cropped frames must keep the value and the RAS position of the matching pixels of the full frames.
+    """
+    self.delayDisplay("Starting the frame cropping test")
+    logic = ReadSequentialDataLogic()
+    frames = np.random.default_rng(0).integers(0, 255, (3, 40, 50), dtype=np.uint8)
+    ijkToRAS = self.createFrameGeometry()
+    top, bottom, left, right = 5, 31, 7, 44
+    croppedFrames, croppedIJKToRAS = logic.CropFrames(frames, ijkToRAS, [top, bottom, left, right])
+    self.assertEqual(croppedFrames.shape, (3, bottom - top, right - left))
+    for row, column in [(0, 0), (10, 20), (bottom - top - 1, right - left - 1)]:
+      np.testing.assert_array_equal(croppedFrames[:, row, column], frames[:, top + row, left + column])
+      np.testing.assert_allclose(croppedIJKToRAS.MultiplyPoint([column, row, 0, 1]), ijkToRAS.MultiplyPoint([left + column, top + row, 0, 1]),
+                                 atol=1e-9)
+    with self.assertRaises(ValueError):
+      logic.CropFrames(frames, ijkToRAS, [top, 41, left, right])
+    self.delayDisplay('Test passed')
+
+  def test_DownsampleFrames(self):
+    """ Every pixel of the downsampled frames must be the rounded mean of its block of the full frames,
+    at the RAS position of the center of the block.
+    """
+    self.delayDisplay("Starting the frame downsampling test")
+    logic = ReadSequentialDataLogic()
+    ijkToRAS = self.createFrameGeometry()
+    for factor, frames in [(2, np.random.default_rng(0).integers(0, 255, (5, 41, 50), dtype=np.uint8)),
+                           (4, np.random.default_rng(1).integers(0, 255, (5, 41, 50, 3), dtype=np.uint8))]:
+      proxyFrames, proxyIJKToRAS = logic.DownsampleFrames(frames, ijkToRAS, factor, chunkSize=2)
+      self.assertEqual(proxyFrames.shape, (5, 41 // factor, 50 // factor) + frames.shape[3:])
+      for row, column in [(0, 0), (3, 7), (41 // factor - 1, 50 // factor - 1)]:
+        block = frames[:, row*factor:(row+1)*factor, column*factor:(column+1)*factor]
+        np.testing.assert_array_equal(proxyFrames[:, row, column], np.rint(block.mean(axis=(1, 2))).astype(np.uint8))
+        blockCenter = [column*factor + (factor - 1) * 0.5, row*factor + (factor - 1) * 0.5, 0, 1]
+        np.testing.assert_allclose(proxyIJKToRAS.MultiplyPoint([column, row, 0, 1]), ijkToRAS.MultiplyPoint(blockCenter), atol=1e-9)
+    self.delayDisplay('Test passed')
+
+  def test_AggregateSlabs(self):
+    """ Slab aggregation of each mode: min and max keep the type, the mean is rounded back to the integer type
+    (without overflowing), the sum is float32.
+    """
+    self.delayDisplay("Starting the slab aggregation test")
+    logic = ReadSequentialDataLogic()
+    slabs = [np.array([[1, -4], [7, 30000]], dtype=np.int16),
+             np.array([[2, -5], [8, 30000]], dtype=np.int16),
+             np.array([[4, -5], [7, 30000]], dtype=np.int16)]
+    expected = {0: np.array([[1, -5], [7, 30000]], dtype=np.int16),
+                1: np.array([[4, -4], [8, 30000]], dtype=np.int16),
+                2: np.array([[2, -5], [7, 30000]], dtype=np.int16),
+                3: np.array([[7, -14], [22, 90000]], dtype=np.float32)}
+    for slabMode, expectedImage in expected.items():
+      aggregated = logic.AggregateSlabs(slabs, slabMode)
+      self.assertEqual(aggregated.dtype, expectedImage.dtype)
+      np.testing.assert_array_equal(aggregated, expectedImage)
+    # the mean of uint8 slices is rounded to the nearest integer
+    np.testing.assert_array_equal(logic.AggregateSlabs([np.array([[1, 200]], dtype=np.uint8), np.array([[2, 255]], dtype=np.uint8)], 2),
+                                  np.array([[2, 228]], dtype=np.uint8))
+    # float slices stay float
+    self.assertEqual(logic.AggregateSlabs([np.zeros((2, 2), dtype=np.float64)] * 3, 2).dtype, np.float64)
+    # a single slice is returned as is, but summed as float32
+    self.assertIs(logic.AggregateSlabs(slabs[:1], 2), slabs[0])
+    self.assertEqual(logic.AggregateSlabs(slabs[:1], 3).dtype, np.float32)
+    with self.assertRaises(ValueError):
+      logic.AggregateSlabs(slabs, 4)
+    self.delayDisplay('Test passed')
+
+  def test_FrameStackCacheInvalidation(self):
+    """ The frame stack cache must be reused while the images are unchanged, and rebuilt (with the frames
+    of a fresh decode) when one image is replaced.
+    """
+    self.delayDisplay("Starting the frame stack cache invalidation test")
+    import tempfile
+    logic = ReadSequentialDataLogic()
+    pngWriter = SlabPNGWriter(flip=False)
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as directory:
+      for itemIndex in range(4):
+        pngWriter.Write(rng.integers(0, 255, (24, 32), dtype=np.uint8), os.path.join(directory, f"Image_{itemIndex:04d}.png"))
+      _, filenames = logic.ListSequentialImageFiles(directory)
+      cacheKey = logic.GetFrameStackCacheKey(directory, filenames)
+      itemIndices, names, frames, ijkToRAS = logic.ReadImageFramesCached(directory)
+      self.assertNotIsInstance(frames, np.memmap)
+      cachedItemIndices, cachedNames, cachedFrames, _ = logic.ReadImageFramesCached(directory)
+      self.assertIsInstance(cachedFrames, np.memmap)
+      self.assertEqual((cachedItemIndices, cachedNames), (itemIndices, names))
+      np.testing.assert_array_equal(cachedFrames, frames)
+
+      # replace one image (same size), with a later modification time
+      path = os.path.join(directory, filenames[2])
+      modificationTime = os.stat(path).st_mtime_ns
+      pngWriter.Write(rng.integers(0, 255, (24, 32), dtype=np.uint8), path)
+      os.utime(path, ns=(modificationTime + 10**9, modificationTime + 10**9))
+      self.assertNotEqual(logic.GetFrameStackCacheKey(directory, filenames), cacheKey)
+      _, _, rebuiltFrames, _ = logic.ReadImageFramesCached(directory)
+      self.assertNotIsInstance(rebuiltFrames, np.memmap)
+      _, _, decodedFrames, _ = logic.ReadImageFramesFromDirectory(directory)
+      np.testing.assert_array_equal(rebuiltFrames, decodedFrames)
+      self.assertFalse(np.array_equal(rebuiltFrames[2], frames[2]))
+      # the rebuilt cache is used by the next import
+      _, _, cachedFrames, _ = logic.ReadImageFramesCached(directory)
+      self.assertIsInstance(cachedFrames, np.memmap)
+      np.testing.assert_array_equal(cachedFrames, decodedFrames)
+      del cachedFrames # release the memory-mapped file before the directory is removed
+    self.delayDisplay('Test passed')
+
+  def test_SliceViewReslicerMatchesRedSliceView(self):
+    """ For two oblique (one of them slightly sheared) poses set on the Red slice node as the former "Save All" did,
+    with SetSliceResolutionMode(0) and the geometry computed by the slice view itself, the SliceViewReslicer must give
+    the same SliceToRAS, XYToIJK, dimensions, field of view and slice as the background layer of the Red slice view.
+    """
+    self.delayDisplay("Starting the comparison of the SliceViewReslicer with the Red slice view")
+    from vtk.util import numpy_support
+    volumeNode = self.createSyntheticVolumeNode(64)
+    slicer.util.setSliceViewerLayers(background=volumeNode, foreground=None, label=None)
+    reslicer = SliceViewReslicer(volumeNode)
+    sliceWidget = slicer.app.layoutManager().sliceWidget("Red")
+    sliceNode = sliceWidget.mrmlSliceNode()
+    sliceNode.SetSliceResolutionMode(0)
+    rasToIJK = vtk.vtkMatrix4x4()
+    volumeNode.GetRASToIJKMatrix(rasToIJK)
+
+    poses = []
+    for rotateX, rotateY, shear in [(70, 15, 0.05), (115, -25, 0.0)]:
+      transform = vtk.vtkTransform()
+      transform.Translate(-6, 4, 2)
+      transform.RotateX(rotateX)
+      transform.RotateY(rotateY)
+      pose = slicer.util.arrayFromVTKMatrix(transform.GetMatrix())
+      pose[:3, 0] += shear * pose[:3, 2]
+      poses.append(pose)
+    xyzOrigin = [3.0, -4.0, 0.0]
+    for pose in poses:
+      sliceNode.SetSliceToRASByNTP(*pose[:3, 2], *pose[:3, 0], *pose[:3, 3], 0)
+      sliceNode.SetXYZOrigin(*xyzOrigin)
+      slicer.app.processEvents()
+
+      xyToIJK, dimensions, fieldOfView = reslicer.ComputeGeometry(pose[np.newaxis], xyzOrigin)
+      self.assertEqual(tuple(dimensions[0]), tuple(sliceNode.GetDimensions()))
+      np.testing.assert_allclose(fieldOfView[0], sliceNode.GetFieldOfView(), rtol=1e-6)
+      np.testing.assert_allclose(reslicer.ComputeSliceToRAS(pose[np.newaxis])[0], slicer.util.arrayFromVTKMatrix(sliceNode.GetSliceToRAS()),
+                                 atol=1e-9)
+      np.testing.assert_allclose(xyToIJK[0], slicer.util.arrayFromVTKMatrix(rasToIJK).dot(slicer.util.arrayFromVTKMatrix(sliceNode.GetXYToRAS())),
+                                 atol=1e-6)
+
+      reslice = sliceWidget.sliceLogic().GetBackgroundLayer().GetReslice()
+      reslice.Update()
+      sliceViewImage = reslice.GetOutput()
+      sliceViewDimensions = sliceViewImage.GetDimensions()
+      sliceViewArray = numpy_support.vtk_to_numpy(sliceViewImage.GetPointData().GetScalars()).reshape(sliceViewDimensions[1], sliceViewDimensions[0])
+      np.testing.assert_array_equal(reslicer.ResliceArray(xyToIJK[0], dimensions[0]), sliceViewArray)
+    self.delayDisplay('Test passed')
+
+  def test_ConvertFramesToComponents(self):
+    """ Frames appended by the follow mode are converted to the layout of the sequence: gray values are copied
+    to the color channels only, the alpha channel is opaque (or the alpha of the frames).
+    """
+    self.delayDisplay("Starting the frame layout conversion test")
+    logic = ReadSequentialDataLogic()
+    gray = np.array([[[0, 40], [128, 255]]], dtype=np.uint8)
+    rgba = logic.ConvertFramesToComponents(gray, 4)
+    self.assertEqual(rgba.shape, (1, 2, 2, 4))
+    for channel in range(3):
+      np.testing.assert_array_equal(rgba[..., channel], gray)
+    np.testing.assert_array_equal(rgba[..., 3], 255)
+    rgb = np.stack([gray, gray // 2, gray // 4], axis=3)
+    np.testing.assert_array_equal(logic.ConvertFramesToComponents(rgb, 4)[..., :3], rgb)
+    np.testing.assert_array_equal(logic.ConvertFramesToComponents(rgb, 4)[..., 3], 255)
+    np.testing.assert_array_equal(logic.ConvertFramesToComponents(rgba, 3), rgba[..., :3])
+    np.testing.assert_array_equal(logic.ConvertFramesToComponents(rgba, 1), gray)
+    np.testing.assert_array_equal(logic.ConvertFramesToComponents(gray, 3), rgba[..., :3])
+    self.delayDisplay('Test passed')
+
+  def test_FilterPosesRamp(self):
+    """ A linear translation ramp must come through the smoothing unchanged (no lag, also for an even window),
+    and FilterTransformSequence must keep the raw poses and give the same result when it is run again.
+    """
+    self.delayDisplay("Starting the pose filter ramp test")
+    logic = ReadSequentialDataLogic()
+    transforms = np.repeat(np.eye(4)[np.newaxis], 20, axis=0)
+    transforms[:, :3, 3] = np.arange(20)[:, np.newaxis] * np.array([0.5, -0.25, 1.0])
+    for smoothingWindow in [1, 4, 5, 6]:
+      filtered, valid = logic.FilterPoses(transforms, smoothingWindow=smoothingWindow)
+      self.assertTrue(np.all(valid))
+      # the frames whose whole window is inside the sweep
+      halfWindow = smoothingWindow // 2
+      np.testing.assert_allclose(filtered[halfWindow:20-halfWindow], transforms[halfWindow:20-halfWindow], atol=1e-9)
+
+    sequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "TransSeq")
+    filteredSequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "TransSeq_filtered")
+    noisyTransforms = transforms.copy()
+    noisyTransforms[:, :3, 3] += np.random.default_rng(0).normal(0, 0.1, (20, 3))
+    logic.FillTransformSequenceFromArray(sequenceNode, noisyTransforms, list(range(20)))
+    validFrames = logic.FilterTransformSequence(sequenceNode, filteredSequenceNode, smoothingWindow=5)
+    filteredTransforms = logic.GetTransformSequenceArray(filteredSequenceNode)
+    np.testing.assert_allclose(logic.GetTransformSequenceArray(sequenceNode), noisyTransforms, atol=1e-9)
+    np.testing.assert_array_equal(logic.GetValidFrameMask(filteredSequenceNode), validFrames)
+    self.assertFalse(np.allclose(filteredTransforms, noisyTransforms))
+    logic.FilterTransformSequence(sequenceNode, filteredSequenceNode, smoothingWindow=5)
+    np.testing.assert_allclose(logic.GetTransformSequenceArray(filteredSequenceNode), filteredTransforms, atol=1e-9)
+    with self.assertRaises(ValueError):
+      logic.FilterTransformSequence(sequenceNode, sequenceNode)
+    self.delayDisplay('Test passed')
+
+  def test_SlabsWithoutImageGrid(self):
+    """ Without an image grid (unknown depth), all the slabs of a frame must be resliced on the grid of the middle slab,
+    so that they can be aggregated, with both backends.
+    """
+    self.delayDisplay("Starting the slab geometry test without an image grid")
+    logic = ReadSequentialDataLogic()
+    volume = self.createSyntheticVolume(48)
+    poses = self.createSyntheticPoses(4)
+    slabShifts = range(-2, 3)
+    engine = ResliceEngine(volume, interpolation="linear")
+    for backendFrames in [logic.ResliceFrames(volume, poses, slabShifts, numberOfWorkers=2, interpolation="linear"),
+                          logic.ResliceFramesNumPy(volume, poses, slabShifts, order=1)]:
+      for frameNumber, slabs in backendFrames:
+        self.assertEqual(len({slab.shape for slab in slabs}), 1)
+        middleSlab = engine.ResliceSlabArray(poses[frameNumber], 0)
+        self.assertEqual(slabs[2].shape, middleSlab.shape)
+        np.testing.assert_allclose(slabs[2], middleSlab, atol=1)
+        self.assertEqual(logic.AggregateSlabs(slabs, 2).shape, middleSlab.shape)
+    self.delayDisplay('Test passed')
+
+  def createSyntheticVolumeNode(self, dimension=128):
+    # scalar volume node of createSyntheticVolume (the origin and spacing of the image data are moved to the node)
+    volume = self.createSyntheticVolume(dimension)
+    imageData = vtk.vtkImageData()
+    imageData.DeepCopy(volume)
+    imageData.SetOrigin(0, 0, 0)
+    imageData.SetSpacing(1, 1, 1)
+    volumeNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLScalarVolumeNode", "SyntheticCT")
+    volumeNode.SetOrigin(volume.GetOrigin())
+    volumeNode.SetSpacing(volume.GetSpacing())
+    volumeNode.SetAndObserveImageData(imageData)
+    volumeNode.CreateDefaultDisplayNodes()
+    return volumeNode
+
+  def test_SliceViewResliceScaling(self):
+    """ "Save All" with 1, 2, 4 and 8 reslice workers on a sweep of 1000 frames: the throughput is logged
+    and every slice must be the same as with one worker.
+    """
+    self.delayDisplay("Starting the parallel slice view reslice scaling test")
+    logic = ReadSequentialDataLogic()
+    volumeNode = self.createSyntheticVolumeNode(128)
+    numberOfFrames = 1000
+    transforms_RAS = np.zeros((numberOfFrames, 4, 4))
+    for frameNumber in range(numberOfFrames):
+      # an oblique sweep through the volume
+      transform = vtk.vtkTransform()
+      transform.Translate(-10, -15 + 0.06 * frameNumber, 0)
+      transform.RotateX(90 + 0.02 * frameNumber)
+      transform.RotateY(15)
+      transforms_RAS[frameNumber] = slicer.util.arrayFromVTKMatrix(transform.GetMatrix())
+    reslicer = SliceViewReslicer(volumeNode, "linear")
+    xyToIJK, dimensions, _ = reslicer.ComputeGeometry(transforms_RAS, [0.0, 0.0, 0.0])
+    referenceSlices = None
+    referenceTime = None
+    for numberOfWorkers in [1, 2, 4, 8]:
+      startTime = time.time()
+      slices = [reslicedImg for _, reslicedImg in logic.ResliceSliceViewFrames(volumeNode, xyToIJK, dimensions, numberOfWorkers, "linear")]
+      elapsedTime = time.time() - startTime
+      if referenceSlices is None:
+        referenceSlices, referenceTime = slices, elapsedTime
+      else:
+        for frameNumber in range(numberOfFrames):
+          np.testing.assert_array_equal(slices[frameNumber], referenceSlices[frameNumber])
+      logging.info(f'Slice view reslice of {numberOfFrames} frames with {numberOfWorkers} workers: {numberOfFrames / elapsedTime:.0f} frames/s '
+                   f'(x{referenceTime / elapsedTime:.2f}, {os.cpu_count()} cores)')
+    self.delayDisplay('Test passed')
+
+  def test_ParallelDecodeMatchesLoadVolume(self):
+    """ The parallel decoder must give the frames and the geometry of slicer.util.loadVolume (the serial import),
+    and the same frames with 1 and N workers; the decoding times are logged.
+    """
+    self.delayDisplay("Starting the parallel decoding test")
+    import tempfile
+    logic = ReadSequentialDataLogic()
+    pngWriter = SlabPNGWriter(flip=False)
+    rng = np.random.default_rng(0)
+    numberOfImages = 64
+    with tempfile.TemporaryDirectory() as directory:
+      for itemIndex in range(numberOfImages):
+        # RGB images with equal channels, as the B-mode exports
+        pngWriter.Write(rng.integers(0, 255, (480, 640), dtype=np.uint8), os.path.join(directory, f"Image_{itemIndex:04d}.png"))
+      decodedFrames = {}
+      decodeTimes = {}
+      for numberOfWorkers in sorted({1, min(8, os.cpu_count() or 1)}):
+        startTime = time.time()
+        _, names, decodedFrames[numberOfWorkers], ijkToRAS = logic.ReadImageFramesFromDirectory(directory, numberOfWorkers)
+        decodeTimes[numberOfWorkers] = time.time() - startTime
+        logging.info(f'Decoded {numberOfImages} images with {numberOfWorkers} workers in {decodeTimes[numberOfWorkers]:.3f} s '
+                     f'(x{decodeTimes[1] / decodeTimes[numberOfWorkers]:.2f}, {os.cpu_count()} cores)')
+        np.testing.assert_array_equal(decodedFrames[numberOfWorkers], decodedFrames[1])
+      frames = decodedFrames[1]
+
+      for frameNumber, name in enumerate(names):
+        loadedVolumeNode = slicer.util.loadVolume(os.path.join(directory, name + ".png"), {"singleFile": True})
+        np.testing.assert_array_equal(frames[frameNumber], slicer.util.arrayFromVolume(loadedVolumeNode)[0])
+        loadedIJKToRAS = vtk.vtkMatrix4x4()
+        loadedVolumeNode.GetIJKToRASMatrix(loadedIJKToRAS)
+        np.testing.assert_allclose(slicer.util.arrayFromVTKMatrix(ijkToRAS), slicer.util.arrayFromVTKMatrix(loadedIJKToRAS), atol=1e-9)
+        slicer.mrmlScene.RemoveNode(loadedVolumeNode)
+    self.delayDisplay('Test passed')
+
+  def test_FollowLazySequence(self):
+    """ The follow mode appends the new images of a lazily imported sweep as placeholders decoded on demand,
+    so the sequence never mixes decoded frames with the 1x1 placeholders of the lazy import.
+    """
+    self.delayDisplay("Starting the lazy follow test")
+    import tempfile
+    logic = ReadSequentialDataLogic()
+    pngWriter = SlabPNGWriter(flip=False)
+    rng = np.random.default_rng(0)
+    images = rng.integers(0, 255, (5, 48, 64), dtype=np.uint8)
+    sequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "LazyUSSeq")
+    with tempfile.TemporaryDirectory() as directory:
+      for itemIndex in range(3):
+        pngWriter.Write(images[itemIndex], os.path.join(directory, f"Image_{itemIndex:04d}.png"))
+      logic.ImportUSSequenceLazy(directory, sequenceNode, cacheSizeMB=1, prefetchCount=0)
+      logic.ResetFollowManifests()
+      for itemIndex in range(3, 5):
+        pngWriter.Write(images[itemIndex], os.path.join(directory, f"Image_{itemIndex:04d}.png"))
+      # a new file is only ingested once its size did not change between two polls
+      self.assertEqual(logic.FollowUSSequence(directory, sequenceNode), 0)
+      self.assertEqual(logic.FollowUSSequence(directory, sequenceNode), 2)
+      self.assertEqual(sequenceNode.GetNumberOfDataNodes(), 5)
+      self.assertEqual(logic.lazyFrameLoader.GetNumberOfFrames(), 5)
+      for itemNumber in range(5):
+        self.assertEqual(sequenceNode.GetNthDataNode(itemNumber).GetImageData().GetDimensions()[:2], (1, 1))
+        logic.UpdateLazyFrame(itemNumber)
+        imagePath = os.path.join(directory, f"Image_{itemNumber:04d}.png")
+        np.testing.assert_array_equal(slicer.util.arrayFromVolume(logic.lazyFrameNode)[0], logic.ReadImageFrame(imagePath)[0])
+      logic.StopLazyLoading()
+    slicer.mrmlScene.RemoveNode(sequenceNode)
+    self.delayDisplay('Test passed')
+
+  def test_PoseStreamMatchesTransformFile(self):
+    """ The same tracker pose (image to reference, LPS) stored in a .csv pose file and written to a .tfm file by
+    ConvertToSlicerTransforms must give the same transform to parent (RAS) in the transform sequence.
+    """
+    self.delayDisplay("Starting the pose file convention test")
+    import tempfile
+    logic = ReadSequentialDataLogic()
+    transform = vtk.vtkTransform()
+    transform.Translate(12.5, -30.0, 48.0)
+    transform.RotateZ(25)
+    transform.RotateX(-40)
+    transform.Scale(0.2, 0.2, 0.2)
+    pose_LPS = slicer.util.arrayFromVTKMatrix(transform.GetMatrix())
+    with tempfile.TemporaryDirectory() as directory:
+      csvPath = os.path.join(directory, "Poses.csv")
+      with open(csvPath, "w") as f:
+        f.write("index,timestamp," + ",".join(f"m{row}{column}" for row in range(3) for column in range(4)) + "\n")
+        f.write("7,0.5," + ",".join(map(repr, pose_LPS[:3].ravel().tolist())) + "\n")
+      # the transform directory only holds the transform files
+      transformDirectory = os.path.join(directory, "Transforms")
+      os.mkdir(transformDirectory)
+      tfmPath = os.path.join(transformDirectory, "Transform_7.tfm")
+      logic.ConvertToSlicerTransforms(pose_LPS, outputPaths=[tfmPath])
+
+      itemIndices, _, streamTransforms_RAS = logic.ReadPoseStream(csvPath)
+      self.assertEqual(itemIndices, ["7"])
+      fileTransforms_RAS, failed = logic.ReadTransformFiles([tfmPath])
+      self.assertEqual(failed, [])
+      np.testing.assert_allclose(streamTransforms_RAS, fileTransforms_RAS, rtol=1e-12, atol=1e-9)
+      np.testing.assert_allclose(logic.ReadPoseStream(csvPath, coordinateSystem="RAS")[2][0], pose_LPS, rtol=1e-12, atol=1e-12)
+
+      streamSequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "StreamTransSeq")
+      fileSequenceNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSequenceNode", "FileTransSeq")
+      logic.ImportTransformStream(csvPath, streamSequenceNode)
+      logic.ImportTransformSequence(transformDirectory, fileSequenceNode)
+      streamMatrix = vtk.vtkMatrix4x4()
+      streamSequenceNode.GetNthDataNode(0).GetMatrixTransformToParent(streamMatrix)
+      fileMatrix = vtk.vtkMatrix4x4()
+      fileSequenceNode.GetNthDataNode(0).GetMatrixTransformToParent(fileMatrix)
+      self.assertEqual(streamSequenceNode.GetNthIndexValue(0), fileSequenceNode.GetNthIndexValue(0))
+      np.testing.assert_allclose(slicer.util.arrayFromVTKMatrix(streamMatrix), slicer.util.arrayFromVTKMatrix(fileMatrix), rtol=1e-9, atol=1e-9)
+      slicer.mrmlScene.RemoveNode(streamSequenceNode)
+      slicer.mrmlScene.RemoveNode(fileSequenceNode)
+    self.delayDisplay('Test passed')